@@ -2,4 +2,7 @@ from django.apps import AppConfig
 
 class UserPreferencesConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
-    name = 'user_preferences' 
\ No newline at end of file
+    name = 'user_preferences'
+
+    def ready(self):
+        from . import signals  # noqa: F401
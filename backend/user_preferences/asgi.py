@@ -4,8 +4,15 @@ ASGI config for user_preferences project.
 
 import os
 
+from django.conf import settings
 from django.core.asgi import get_asgi_application
 
 os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'user_preferences.settings')
 
-application = get_asgi_application() 
\ No newline at end of file
+application = get_asgi_application()
+
+if settings.PREFERENCES_WARMUP:
+    # Imported once the application has set Django up
+    from user_preferences.warmup import warm_up
+
+    warm_up()
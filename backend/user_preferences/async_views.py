@@ -0,0 +1,339 @@
+import json
+import logging
+import math
+from functools import wraps
+
+from asgiref.sync import sync_to_async
+from django.contrib.auth.password_validation import validate_password
+from django.core.exceptions import ValidationError
+from django.http import Http404, HttpResponse, HttpResponseNotAllowed, JsonResponse
+from django.views.decorators.csrf import csrf_exempt
+from rest_framework.exceptions import AuthenticationFailed
+
+from .authentication import CachedJWTAuthentication
+from .cache import aget_preferences, aget_preferences_section, apeek_preferences
+from .coalescing import buffer_patch, coalescing_enabled, flush_pending
+from .etags import if_match_versions, make_etag, matching_etag, request_etags
+from .fieldsets import get_sparse_document, load_section, parse_fieldset, section_if_match_versions
+from .hashing import acheck_password, amake_password
+from .replicas import replica_reads
+from .models import SECTIONS
+from .serializers import UserPreferencesSerializer, user_fields
+from .services import (
+    PreconditionFailed,
+    create_account,
+    ensure_preferences,
+    fetch_preferences_data,
+    patch_or_create_preferences,
+)
+from .sharding import preferences_manager
+from .throttling import PASSWORD_THROTTLES, HashingOverloaded
+from .views import UserPreferencesViewSet
+
+logger = logging.getLogger(__name__)
+
+authentication = CachedJWTAuthentication()
+
+# Methods the async detail view leaves to the DRF viewset
+preferences_detail_fallback = UserPreferencesViewSet.as_view({'delete': 'destroy'})
+
+
+class BadRequest(Exception):
+    def __init__(self, detail, status=400):
+        super().__init__(detail)
+        self.detail = detail
+        self.status = status
+
+
+def json_response(data, status=200, headers=None):
+    # Rendered as compactly as DRF's JSONRenderer
+    return JsonResponse(
+        data, status=status, headers=headers, safe=False,
+        json_dumps_params={'separators': (',', ':'), 'ensure_ascii': False}
+    )
+
+
+def parse_json(request):
+    if not request.body:
+        return {}
+    if request.content_type != 'application/json':
+        raise BadRequest(f'Unsupported media type "{request.content_type}" in request.', status=415)
+    try:
+        data = json.loads(request.body)
+    except ValueError as e:
+        raise BadRequest(f'JSON parse error - {e}')
+    if not isinstance(data, dict):
+        raise BadRequest('Expected a JSON object.')
+    return data
+
+
+def jwt_required(view):
+    """
+    Authenticate an async view with CachedJWTAuthentication, answering 401
+    the way DRF does when there are no valid credentials.
+    """
+    @wraps(view)
+    async def wrapper(request, *args, **kwargs):
+        challenge = {'WWW-Authenticate': authentication.authenticate_header(request)}
+        try:
+            result = await authentication.aauthenticate(request)
+        except AuthenticationFailed as e:
+            data = e.detail if isinstance(e.detail, (list, dict)) else {'detail': e.detail}
+            return json_response(data, status=e.status_code, headers=challenge)
+        if result is None:
+            return json_response(
+                {'detail': 'Authentication credentials were not provided.'}, status=401, headers=challenge
+            )
+        request.user, request.auth = result
+        return await view(request, *args, **kwargs)
+
+    return csrf_exempt(wrapper)
+
+
+def throttled_response(wait, detail='Request was throttled.'):
+    headers = {'Retry-After': str(math.ceil(wait))} if wait else None
+    return json_response({'detail': detail}, status=429, headers=headers)
+
+
+async def check_password_throttles(request, data):
+    """The DRF views' PASSWORD_THROTTLES, answering 429 when one refuses."""
+    # Read by the throttles, as on DRF requests
+    request.data = data
+    for throttle_class in PASSWORD_THROTTLES:
+        throttle = throttle_class()
+        # Off the event loop, since the bucket store may be a network cache
+        if not await sync_to_async(throttle.allow_request)(request, None):
+            return throttled_response(throttle.wait())
+    return None
+
+
+async def get_document(user, create_missing=False):
+    async def load():
+        data = await sync_to_async(fetch_preferences_data)(user.pk)
+        if data is None:
+            if not create_missing:
+                raise Http404
+            await sync_to_async(ensure_preferences)(user)
+            data = await sync_to_async(fetch_preferences_data)(user.pk)
+        return {'etag': make_etag(data), 'data': data}
+
+    return await aget_preferences(user.pk, load)
+
+
+async def get_section(user, section, create_missing=False):
+    return await aget_preferences_section(
+        user.pk, section, lambda: sync_to_async(load_section)(user, section, create_missing)
+    )
+
+
+def content_response(request, document):
+    etags = request_etags(request)
+    if '*' in etags or document['etag'] in etags:
+        return HttpResponse(status=304, headers={'ETag': document['etag']})
+    return json_response(document['data'], headers={'ETag': document['etag']})
+
+
+async def get_not_modified_etag(request):
+    etags = request_etags(request)
+    if not etags:
+        return None
+
+    document = await apeek_preferences(request.user.pk)
+    if document is not None:
+        if '*' in etags or document['etag'] in etags:
+            return document['etag']
+        return None
+
+    row = await preferences_manager(request.user.pk).filter(user=request.user).values_list(
+        'version', 'updated_at'
+    ).afirst()
+    return matching_etag(etags, *row, user_fields(request.user)) if row is not None else None
+
+
+async def conditional_response(request, create_missing=False):
+    if coalescing_enabled():
+        await sync_to_async(flush_pending)(request.user.pk)
+    try:
+        names = parse_fieldset(request.GET)
+    except ValueError as e:
+        return json_response({'detail': str(e)}, status=400)
+    with replica_reads(request.user.pk):
+        if names is not None:
+            try:
+                document = await sync_to_async(get_sparse_document)(request.user, names, create_missing)
+            except Http404:
+                return json_response({'detail': 'Not found.'}, status=404)
+            return content_response(request, document)
+
+        etag = await get_not_modified_etag(request)
+        if etag is not None:
+            return HttpResponse(status=304, headers={'ETag': etag})
+        try:
+            document = await get_document(request.user, create_missing)
+        except Http404:
+            return json_response({'detail': 'Not found.'}, status=404)
+    return json_response(document['data'], headers={'ETag': document['etag']})
+
+
+async def conditional_update(request, create_missing=False):
+    try:
+        serializer = UserPreferencesSerializer(data=parse_json(request), partial=True)
+    except BadRequest as e:
+        return json_response({'detail': e.detail}, status=e.status)
+    if not serializer.is_valid():
+        return json_response(serializer.errors, status=400)
+
+    if_match = 'HTTP_IF_MATCH' in request.META
+    if create_missing and coalescing_enabled() and not if_match:
+        document = await get_document(request.user, create_missing=True)
+        try:
+            preview = buffer_patch(request.user, document['data'], serializer.validated_data)
+        except ValueError as e:
+            return json_response({'detail': str(e)}, status=400)
+        return json_response(preview, status=202)
+    if coalescing_enabled():
+        await sync_to_async(flush_pending)(request.user.pk)
+
+    try:
+        # The whole read-modify-write stays on one thread, as transactions are sync only
+        changed = await sync_to_async(patch_or_create_preferences)(
+            request.user, serializer.validated_data, if_match_versions(request),
+            create_missing=create_missing and not if_match
+        )
+    except PreconditionFailed as e:
+        return json_response({'detail': str(e)}, status=412)
+
+    if changed is None:
+        if if_match:
+            return json_response({'detail': 'Preferences do not exist for this user.'}, status=412)
+        return json_response({'detail': 'Not found.'}, status=404)
+
+    document = await get_document(request.user)
+    return json_response(document['data'], headers={'ETag': document['etag']})
+
+
+@jwt_required
+async def my_preferences(request):
+    if request.method == 'GET':
+        return await conditional_response(request, create_missing=True)
+    if request.method == 'PUT':
+        return await conditional_update(request, create_missing=True)
+    return HttpResponseNotAllowed(['GET', 'PUT'])
+
+
+@jwt_required
+async def my_preferences_section(request, section):
+    if section not in SECTIONS:
+        return json_response({'detail': 'Not found.'}, status=404)
+    if request.method == 'GET':
+        if coalescing_enabled():
+            await sync_to_async(flush_pending)(request.user.pk)
+        with replica_reads(request.user.pk):
+            return content_response(request, await get_section(request.user, section, create_missing=True))
+    if request.method != 'PUT':
+        return HttpResponseNotAllowed(['GET', 'PUT'])
+
+    try:
+        data = parse_json(request)
+    except BadRequest as e:
+        return json_response({'detail': e.detail}, status=e.status)
+    serializer = UserPreferencesSerializer(data={section: data}, partial=True, sections=[section])
+    if not serializer.is_valid():
+        return json_response(serializer.errors, status=400)
+    if coalescing_enabled():
+        await sync_to_async(flush_pending)(request.user.pk)
+
+    expected_versions = None
+    if 'HTTP_IF_MATCH' in request.META:
+        expected_versions = await sync_to_async(section_if_match_versions)(
+            request.user, section, request_etags(request, 'HTTP_IF_MATCH', weak=False)
+        )
+        if expected_versions is None:
+            return json_response({'detail': 'Preferences do not exist for this user.'}, status=412)
+    try:
+        await sync_to_async(patch_or_create_preferences)(
+            request.user, serializer.validated_data, expected_versions, create_missing=expected_versions is None
+        )
+    except PreconditionFailed as e:
+        return json_response({'detail': str(e)}, status=412)
+
+    document = await get_section(request.user, section)
+    return json_response(document['data'], headers={'ETag': document['etag']})
+
+
+@jwt_required
+async def preferences_detail(request, pk):
+    # Preferences are looked up by the authenticated user, as in the viewset
+    if request.method == 'GET':
+        return await conditional_response(request)
+    if request.method in ('PUT', 'PATCH'):
+        return await conditional_update(request)
+    return await sync_to_async(preferences_detail_fallback)(request, pk=pk)
+
+
+@csrf_exempt
+async def register(request):
+    if request.method != 'POST':
+        return HttpResponseNotAllowed(['POST'])
+    try:
+        data = parse_json(request)
+        if throttled := await check_password_throttles(request, data):
+            return throttled
+        validate_password(data.get('password'))
+        # Hashed on the bounded pool, outside the account transaction
+        encoded_password = await amake_password(data.get('password'))
+        await sync_to_async(create_account)(data.get('username'), data.get('email'), encoded_password)
+        return json_response({'message': 'User registered successfully'}, status=201)
+    except BadRequest as e:
+        return json_response({'detail': e.detail}, status=e.status)
+    except HashingOverloaded as e:
+        return throttled_response(e.wait, str(e.detail))
+    except ValidationError as e:
+        return json_response({'detail': list(e.messages)}, status=400)
+    except Exception as e:
+        return json_response({'detail': str(e)}, status=400)
+
+
+@jwt_required
+async def update_password(request):
+    if request.method != 'PUT':
+        return HttpResponseNotAllowed(['PUT'])
+    user = request.user
+    try:
+        data = parse_json(request)
+        if throttled := await check_password_throttles(request, data):
+            return throttled
+        current_password = data.get('currentPassword')
+        new_password = data.get('newPassword')
+
+        if not current_password or not new_password:
+            return json_response(
+                {'errors': {'currentPassword': 'Current password is required', 'newPassword': 'New password is required'}},
+                status=400
+            )
+
+        if not await acheck_password(current_password, user.password):
+            logger.info('Password update for user %s rejected: current password is incorrect', user.pk)
+            return json_response({'errors': {'currentPassword': 'Current password is incorrect'}}, status=400)
+
+        try:
+            validate_password(new_password, user)
+        except ValidationError as e:
+            return json_response(
+                {'errors': {'newPassword': e.messages[0] if e.messages else 'Invalid password format'}},
+                status=400
+            )
+
+        user.password = await amake_password(new_password)
+        await user.asave(update_fields=['password'])
+
+        logger.info('Password updated for user %s', user.pk)
+        return json_response({'message': 'Password updated successfully'})
+
+    except BadRequest as e:
+        return json_response({'detail': e.detail}, status=e.status)
+    except HashingOverloaded as e:
+        return throttled_response(e.wait, str(e.detail))
+    except Exception as e:
+        logger.exception('Error updating password for user %s', user.pk)
+        return json_response({'errors': {'general': str(e)}}, status=500)
@@ -0,0 +1,75 @@
+import itertools
+
+from django.db.models import BooleanField, Q
+
+from .defaults import get_defaults
+from .models import UserPreferences
+from .sharding import get_shards, sharding_enabled
+
+# Preference keys backed by an indexed generated column on UserPreferences
+AUDIENCE_KEYS = {
+    'notifications.emailNotifications': 'email_notifications',
+    'notifications.pushNotifications': 'push_notifications',
+    'notifications.smsNotifications': 'sms_notifications',
+    'notifications.frequency': 'notification_frequency',
+    'notifications.marketingEmails': 'marketing_emails',
+    'privacy.profileVisibility': 'profile_visibility',
+    'privacy.searchableProfile': 'searchable_profile',
+}
+
+
+def _field_name(key):
+    try:
+        return AUDIENCE_KEYS[key]
+    except KeyError:
+        raise ValueError(f'{key} is not an indexed preference key.')
+
+
+def parse_condition_value(key, value):
+    """Convert a query string value to the type stored for ``key``."""
+    field = UserPreferences._meta.get_field(_field_name(key))
+    if isinstance(field.output_field, BooleanField):
+        if value.lower() in ('true', '1'):
+            return True
+        if value.lower() in ('false', '0'):
+            return False
+        raise ValueError(f'{key} must be true or false.')
+    return value
+
+
+def audience_queryset(conditions, using=None):
+    """
+    Query for the ids of users matching every ``{'section.key': value}``
+    condition. A condition on a default value also matches rows that do not
+    override the key; each such alternative becomes its own branch of a
+    UNION ALL, so every branch is a plain index lookup.
+    """
+    alternatives = []
+    for key, value in conditions.items():
+        field = _field_name(key)
+        section, name = key.split('.', 1)
+        # __in keeps booleans as comparisons, which the indexes can serve
+        options = [Q(**{f'{field}__in': [value]})]
+        if get_defaults(section).get(name) == value:
+            options.append(Q(**{f'{field}__isnull': True}))
+        alternatives.append(options)
+
+    branches = [
+        UserPreferences.objects.using(using).filter(*combination).values_list('user_id', flat=True)
+        for combination in itertools.product(*alternatives)
+    ]
+    if len(branches) == 1:
+        return branches[0]
+    return branches[0].union(*branches[1:], all=True)
+
+
+def iter_audience(conditions, chunk_size=5000):
+    """
+    Yield the ids of users whose effective preferences match every condition,
+    shard by shard. Raises ValueError for keys without an index.
+    """
+    if not sharding_enabled():
+        return audience_queryset(conditions).iterator(chunk_size=chunk_size)
+    return itertools.chain.from_iterable(
+        audience_queryset(conditions, alias).iterator(chunk_size=chunk_size) for alias in get_shards()
+    )
@@ -0,0 +1,121 @@
+"""
+Backfills rewrite the stored preference sections of every row, for schema
+changes the defaults registry cannot absorb, such as a renamed key or a new
+value format. Unlike a RunPython migration they run online: the
+backfill_preferences command walks the rows in primary key order, commits
+each chunk on its own and keeps a checkpoint to resume from.
+
+A transform receives a row's effective values for the backfill's sections
+and the user's identity, and returns the values to store; they are compacted
+against the pinned defaults revision. The checkpoints live on the default
+database, where they commit with their chunk; on the other shards they are
+saved once the chunk has committed, so a chunk interrupted in between is
+applied again and transforms must be idempotent.
+"""
+from django.db import transaction
+from django.db.models import F
+from django.utils import timezone
+
+from .cache import invalidate_preferences
+from .changefeed import record_change
+from .defaults import CURRENT_VERSION, compact, expand
+from .models import SECTIONS, UserPreferences
+from .services import changed_keys
+from .sharding import join_users
+
+BACKFILLS = {}
+
+
+class Backfill:
+    # Attempts at a row that keeps being written to concurrently before the
+    # chunk gives up on it
+    retries = 3
+
+    def __init__(self, name, transform, sections=SECTIONS, defaults_version=CURRENT_VERSION, description=''):
+        self.name = name
+        self.transform = transform
+        self.sections = tuple(sections)
+        self.defaults_version = defaults_version
+        self.description = description
+
+    def rewrite(self, row):
+        """The sections of ``row`` that change and the ``section.key`` paths whose values change."""
+        identity = {'username': row['user__username'], 'email': row['user__email']}
+        current = {
+            section: expand(section, row[section], identity, self.defaults_version) for section in self.sections
+        }
+        values = self.transform({section: dict(current[section]) for section in self.sections}, identity)
+
+        changes = {}
+        keys = []
+        for section in self.sections:
+            overrides = compact(section, values[section], identity, self.defaults_version)
+            if overrides != row[section]:
+                changes[section] = overrides
+                keys.extend(changed_keys(
+                    section, current[section], expand(section, overrides, identity, self.defaults_version)
+                ))
+        return changes, keys
+
+    def read(self, queryset):
+        rows = queryset.values('pk', 'user_id', 'version', *self.sections)
+        return list(join_users(rows, ['username', 'email'], prefix='user__'))
+
+    def apply_chunk(self, database, after_pk, limit, dry_run=False):
+        """
+        Rewrite up to ``limit`` rows on ``database`` with a primary key above
+        ``after_pk``. Call it inside a transaction on ``database``. Rows are
+        written with a compare-and-swap on their version, so a concurrent
+        write is re-read rather than overwritten. Returns the last primary key
+        read (None past the last row), the rows read and the rows changed.
+        """
+        queryset = UserPreferences.objects.using(database).order_by('pk')
+        rows = self.read(queryset.filter(pk__gt=after_pk)[:limit])
+        if not rows:
+            return None, 0, 0
+
+        last_pk = rows[-1]['pk']
+        scanned = len(rows)
+        changed = 0
+        for attempt in range(self.retries):
+            lost = []
+            for row in rows:
+                changes, keys = self.rewrite(row)
+                if not changes:
+                    continue
+                if dry_run:
+                    changed += 1
+                    continue
+                updated = queryset.filter(pk=row['pk'], version=row['version']).update(
+                    **changes, version=F('version') + 1, updated_at=timezone.now()
+                )
+                if not updated:
+                    lost.append(row['pk'])
+                    continue
+                changed += 1
+                if keys:
+                    record_change(row['user_id'], keys)
+                transaction.on_commit(
+                    lambda user_id=row['user_id'], sections=list(changes): invalidate_preferences(user_id, sections),
+                    using=database
+                )
+            if not lost:
+                break
+            if attempt == self.retries - 1:
+                raise RuntimeError(f'Rows {lost} kept changing while backfilling {self.name}')
+            rows = self.read(queryset.filter(pk__in=lost))
+        return last_pk, scanned, changed
+
+
+def register(name, sections=SECTIONS, defaults_version=CURRENT_VERSION):
+    """Register the decorated transform as the backfill ``name``."""
+    def decorator(transform):
+        BACKFILLS[name] = Backfill(name, transform, sections, defaults_version, (transform.__doc__ or '').strip())
+        return transform
+    return decorator
+
+
+@register('compact_overrides')
+def compact_overrides(values, identity):
+    """Drops stored values equal to the current defaults, after a revision of the defaults."""
+    return values
@@ -0,0 +1,165 @@
+import asyncio
+import itertools
+import random
+import statistics
+import threading
+import time
+from contextlib import contextmanager
+
+from django.contrib.auth.models import User
+from django.db import connection, transaction
+from django.test.utils import CaptureQueriesContext
+
+from .models import UserPreferences
+
+# Overrides seeded for a share of users, so queries see a realistic mix
+SEED_OVERRIDES = {
+    'notifications': [
+        {'emailNotifications': False},
+        {'frequency': 'weekly'},
+        {'frequency': 'instant', 'pushNotifications': False},
+        {'marketingEmails': True},
+    ],
+    'theme': [
+        {'colorScheme': 'dark'},
+        {'fontSize': 'large', 'compactMode': True},
+    ],
+    'privacy': [
+        {'searchableProfile': False},
+        {'profileVisibility': 'public'},
+    ],
+}
+
+
+@contextmanager
+def benchmark_database(path=None):
+    """
+    Run the block against a freshly migrated throwaway database, created the
+    same way the test runner does, so real data is never touched.
+    """
+    if path:
+        connection.settings_dict.setdefault('TEST', {})['NAME'] = path
+    old_name = connection.settings_dict['NAME']
+    connection.creation.create_test_db(verbosity=0, autoclobber=True, serialize=False)
+    try:
+        yield connection.settings_dict['NAME']
+    finally:
+        connection.creation.destroy_test_db(old_name, verbosity=0)
+
+
+def seed_users(count, batch_size=5000, override_rate=0.3, seed=0, password='!'):
+    """
+    Insert ``count`` users with preferences. The password defaults to an
+    unusable hash so seeding does not pay for hashing.
+    """
+    rng = random.Random(seed)
+    created = 0
+    while created < count:
+        size = min(batch_size, count - created)
+        with transaction.atomic():
+            users = User.objects.bulk_create([
+                User(username=f'bench{created + i}', email=f'bench{created + i}@example.com', password=password)
+                for i in range(size)
+            ])
+            preferences = []
+            for user in users:
+                sections = {}
+                for section, choices in SEED_OVERRIDES.items():
+                    if rng.random() < override_rate:
+                        sections[section] = dict(rng.choice(choices))
+                preferences.append(UserPreferences(user=user, **sections))
+            UserPreferences.objects.bulk_create(preferences)
+        created += size
+    return created
+
+
+def percentile(samples, pct):
+    ordered = sorted(samples)
+    index = min(len(ordered) - 1, max(0, round(pct / 100 * len(ordered)) - 1))
+    return ordered[index]
+
+
+def summarize(samples):
+    """Latency summary in milliseconds for a list of durations in seconds."""
+    return {
+        'count': len(samples),
+        'mean_ms': statistics.fmean(samples) * 1000,
+        'p50_ms': percentile(samples, 50) * 1000,
+        'p95_ms': percentile(samples, 95) * 1000,
+        'p99_ms': percentile(samples, 99) * 1000,
+    }
+
+
+def time_calls(func, repeat):
+    samples = []
+    for _ in range(repeat):
+        started = time.perf_counter()
+        func()
+        samples.append(time.perf_counter() - started)
+    return samples
+
+
+def run_load(call, requests, concurrency=1):
+    """
+    Make ``requests`` calls of ``call(worker, index)`` spread over
+    ``concurrency`` threads, each worker numbered from 0. ``call`` returns
+    whether the call succeeded. Returns the latency samples, the SQL query
+    count of each call, the number of failures and the wall time.
+    """
+    indexes = itertools.count()
+    lock = threading.Lock()
+    samples, queries, failures = [], [], []
+
+    def worker(number):
+        local_samples, local_queries, local_failures = [], [], 0
+        while (index := next(indexes)) < requests:
+            with CaptureQueriesContext(connection) as captured:
+                started = time.perf_counter()
+                ok = call(number, index)
+                local_samples.append(time.perf_counter() - started)
+            local_queries.append(len(captured))
+            local_failures += not ok
+        with lock:
+            samples.extend(local_samples)
+            queries.extend(local_queries)
+            failures.append(local_failures)
+
+    def thread_worker(number):
+        try:
+            worker(number)
+        finally:
+            connection.close()
+
+    started = time.perf_counter()
+    if concurrency == 1:
+        worker(0)
+    else:
+        threads = [threading.Thread(target=thread_worker, args=(number,)) for number in range(concurrency)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+    return samples, queries, sum(failures), time.perf_counter() - started
+
+
+async def arun_load(call, requests, concurrency=1):
+    """
+    run_load() for a coroutine function ``call``, with ``concurrency`` tasks
+    on the running event loop. Queries run on executor threads and are not
+    counted, so the query counts are None.
+    """
+    indexes = itertools.count()
+    samples, failures = [], []
+
+    async def worker(number):
+        local_failures = 0
+        while (index := next(indexes)) < requests:
+            started = time.perf_counter()
+            ok = await call(number, index)
+            samples.append(time.perf_counter() - started)
+            local_failures += not ok
+        failures.append(local_failures)
+
+    started = time.perf_counter()
+    await asyncio.gather(*(worker(number) for number in range(concurrency)))
+    return samples, [None] * len(samples), sum(failures), time.perf_counter() - started
@@ -0,0 +1,176 @@
+import threading
+import time
+
+from django.conf import settings
+from django.core.cache import caches
+
+from .defaults import CURRENT_VERSION as DEFAULTS_VERSION
+from .models import SECTIONS
+
+
+class Counters:
+    """Thread-safe named counters, reported per process."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._values = {}
+
+    def incr(self, name, amount=1):
+        with self._lock:
+            self._values[name] = self._values.get(name, 0) + amount
+
+    def snapshot(self):
+        with self._lock:
+            return dict(self._values)
+
+    def reset(self):
+        with self._lock:
+            self._values.clear()
+
+
+stats = Counters()
+
+
+def get_cache():
+    return caches[getattr(settings, 'PREFERENCES_CACHE_ALIAS', 'default')]
+
+
+def _version():
+    # Bump PREFERENCES_CACHE_VERSION whenever the serialized shape changes
+    cache_version = getattr(settings, 'PREFERENCES_CACHE_VERSION', 1)
+    return f'{cache_version}.{DEFAULTS_VERSION}'
+
+
+def _timeout():
+    return getattr(settings, 'PREFERENCES_CACHE_TIMEOUT', 300)
+
+
+def _generation_key(namespace, user_id):
+    return f'{namespace}:{user_id}:generation'
+
+
+def _document_key(namespace, user_id, generation):
+    return f'{namespace}:{user_id}:{generation}'
+
+
+def get_generation(user_id, namespace='preferences'):
+    # Seeded from the clock so an evicted generation never revives old documents
+    return get_cache().get_or_set(
+        _generation_key(namespace, user_id), time.time_ns, timeout=None, version=_version()
+    )
+
+
+def read_through(namespace, user_id, loader, timeout=None):
+    """
+    Return the cached ``namespace`` entry for ``user_id``, calling ``loader``
+    to build (and store) it on a miss.
+    """
+    cache = get_cache()
+    key = _document_key(namespace, user_id, get_generation(user_id, namespace))
+    data = cache.get(key, version=_version())
+    if data is not None:
+        stats.incr(f'{namespace}_hits')
+        return data
+
+    stats.incr(f'{namespace}_misses')
+    data = loader()
+    if data is not None:
+        # Stored under the generation read before loading, so a concurrent
+        # invalidation leaves this entry unreachable instead of stale.
+        cache.set(key, data, timeout or _timeout(), version=_version())
+    return data
+
+
+async def aread_through(namespace, user_id, loader, timeout=None):
+    """read_through() for async code; ``loader`` is a coroutine function."""
+    cache = get_cache()
+    generation = await cache.aget_or_set(
+        _generation_key(namespace, user_id), time.time_ns, timeout=None, version=_version()
+    )
+    key = _document_key(namespace, user_id, generation)
+    data = await cache.aget(key, version=_version())
+    if data is not None:
+        stats.incr(f'{namespace}_hits')
+        return data
+
+    stats.incr(f'{namespace}_misses')
+    data = await loader()
+    if data is not None:
+        await cache.aset(key, data, timeout or _timeout(), version=_version())
+    return data
+
+
+def invalidate(namespace, user_id):
+    cache = get_cache()
+    key = _generation_key(namespace, user_id)
+    try:
+        cache.incr(key, version=_version())
+    except ValueError:
+        cache.set(key, time.time_ns(), timeout=None, version=_version())
+    stats.incr(f'{namespace}_invalidations')
+
+
+def get_preferences(user_id, loader):
+    """
+    Return the cached preferences document for ``user_id``, calling ``loader``
+    to build (and store) it on a miss.
+    """
+    return read_through('preferences', user_id, loader)
+
+
+def peek_preferences(user_id):
+    """Return the cached document for ``user_id`` without loading on a miss."""
+    key = _document_key('preferences', user_id, get_generation(user_id))
+    data = get_cache().get(key, version=_version())
+    if data is not None:
+        stats.incr('preferences_hits')
+    return data
+
+
+def invalidate_preferences(user_id, sections=SECTIONS):
+    """
+    Drop ``user_id``'s cached document and the cached ``sections``, leaving
+    the sections a write did not touch cached.
+    """
+    invalidate('preferences', user_id)
+    for section in sections:
+        invalidate(section_namespace(section), user_id)
+
+
+def section_namespace(section):
+    return f'preferences.{section}'
+
+
+def get_preferences_section(user_id, section, loader):
+    """get_preferences() for one section, cached apart from the document."""
+    return read_through(section_namespace(section), user_id, loader)
+
+
+def peek_preferences_section(user_id, section):
+    namespace = section_namespace(section)
+    data = get_cache().get(_document_key(namespace, user_id, get_generation(user_id, namespace)), version=_version())
+    if data is not None:
+        stats.incr(f'{namespace}_hits')
+    return data
+
+
+async def aget_preferences(user_id, loader):
+    """get_preferences() for async code; ``loader`` is a coroutine function."""
+    return await aread_through('preferences', user_id, loader)
+
+
+async def apeek_preferences(user_id):
+    """peek_preferences() for async code."""
+    cache = get_cache()
+    generation = await cache.aget_or_set(
+        _generation_key('preferences', user_id), time.time_ns, timeout=None, version=_version()
+    )
+    data = await cache.aget(_document_key('preferences', user_id, generation), version=_version())
+    if data is not None:
+        stats.incr('preferences_hits')
+    return data
+
+
+async def aget_preferences_section(user_id, section, loader):
+    """get_preferences_section() for async code; ``loader`` is a coroutine function."""
+    return await aread_through(section_namespace(section), user_id, loader)
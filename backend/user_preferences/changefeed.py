@@ -0,0 +1,75 @@
+import time
+
+from django.conf import settings
+from django.db import transaction
+from django.utils import timezone
+
+from .models import SECTIONS, ChangeFeedWatermark, PreferenceChange
+
+
+class CursorExpired(Exception):
+    pass
+
+
+def record_change(user_id, keys):
+    """
+    Append a change entry. Call it inside the transaction that performs the
+    write, so the entry commits (or rolls back) together with it.
+    """
+    return PreferenceChange.objects.create(user_id=user_id, keys=list(keys))
+
+
+def record_created(user_ids):
+    # A new row changes every section
+    PreferenceChange.objects.bulk_create([
+        PreferenceChange(user_id=user_id, keys=list(SECTIONS)) for user_id in user_ids
+    ])
+
+
+def read_changes(since=0, limit=100, wait=0, poll_interval=0.25):
+    """
+    Return up to ``limit`` change entries with a sequence number above
+    ``since``, waiting up to ``wait`` seconds for one to arrive.
+
+    Raises CursorExpired if entries after ``since`` may already have been
+    compacted away, in which case the consumer has to resynchronize in full.
+    """
+    if since and since < compacted_through():
+        raise CursorExpired(f'Changes after {since} are no longer retained.')
+
+    deadline = time.monotonic() + wait
+    while True:
+        changes = list(
+            PreferenceChange.objects.filter(id__gt=since).values('id', 'user_id', 'keys', 'created_at')[:limit]
+        )
+        if changes or time.monotonic() >= deadline:
+            return changes
+        time.sleep(min(poll_interval, max(0, deadline - time.monotonic())))
+
+
+def compacted_through():
+    watermark = ChangeFeedWatermark.objects.values_list('compacted_through', flat=True).first()
+    return watermark or 0
+
+
+def compact_changes(retention=None, batch_size=5000):
+    """
+    Delete entries older than the retention period, in batches, raising the
+    watermark that read_changes checks cursors against. Returns the count.
+    """
+    if retention is None:
+        retention = settings.PREFERENCES_CHANGES_RETENTION
+    cutoff = timezone.now() - retention
+    deleted = 0
+    while True:
+        ids = list(
+            PreferenceChange.objects.filter(created_at__lt=cutoff).values_list('id', flat=True)[:batch_size]
+        )
+        if not ids:
+            return deleted
+        with transaction.atomic():
+            deleted += PreferenceChange.objects.filter(id__in=ids).delete()[0]
+            watermark, _ = ChangeFeedWatermark.objects.select_for_update().get_or_create(pk=1)
+            if max(ids) > watermark.compacted_through:
+                watermark.compacted_through = max(ids)
+                watermark.save()
@@ -0,0 +1,243 @@
+import atexit
+import copy
+import logging
+import threading
+import time
+
+from django.conf import settings
+from django.db import close_old_connections
+
+from .defaults import user_identity
+from .metrics import coalescing_events as stats
+from .models import SECTIONS
+from .services import apply_patches, apply_section_patches
+
+logger = logging.getLogger(__name__)
+
+
+def coalescing_enabled():
+    return settings.PREFERENCES_WRITE_COALESCING_WINDOW is not None
+
+
+class PendingWrite:
+    """Patches buffered for one user, written together once due."""
+
+    def __init__(self, user, deadline, patches=(), attempts=None):
+        self.user = user
+        self.deadline = deadline
+        self.patches = list(patches)
+        # Failed attempts to write each patch
+        self.attempts = list(attempts) if attempts is not None else [0] * len(self.patches)
+        # The user's write being flushed when this one started flushing, which
+        # has to land first
+        self.previous = None
+        self.done = threading.Event()
+
+
+class WriteCoalescer:
+    """
+    Buffers merge patches per user for PREFERENCES_WRITE_COALESCING_WINDOW
+    seconds from the first one, then applies them in order with a single
+    UPDATE from a background thread. A user's writes are flushed in order,
+    and flush() lets reads see their own buffered writes.
+
+    When the combined write fails, the patches are written one at a time, so
+    a failing patch holds back only itself: it is buffered again with the
+    patches after it, ahead of newer ones, and dropped on its own after
+    ``max_attempts``. Buffers are per process. They are flushed at
+    interpreter exit, but a killed process loses up to a window of writes.
+    """
+
+    max_attempts = 3
+
+    def __init__(self):
+        self._condition = threading.Condition()
+        self._pending = {}
+        self._flushing = {}
+        self._thread = None
+
+    def add(self, user, patch):
+        """
+        Buffer ``patch`` for ``user``. Returns every patch not yet written
+        for them, oldest first, to preview the document with.
+        """
+        with self._condition:
+            entry = self._pending.get(user.pk)
+            if entry is None:
+                entry = self._pending[user.pk] = PendingWrite(
+                    user, time.monotonic() + settings.PREFERENCES_WRITE_COALESCING_WINDOW
+                )
+                self._start()
+                self._condition.notify()
+            entry.patches.append(patch)
+            entry.attempts.append(0)
+            unwritten = []
+            flushing = self._flushing.get(user.pk)
+            while flushing is not None and not flushing.done.is_set():
+                unwritten[:0] = flushing.patches
+                flushing = flushing.previous
+        stats.incr('buffered_patches')
+        return unwritten + entry.patches
+
+    def flush(self, user_id):
+        """Write ``user_id``'s buffered patches now, waiting for any write in flight."""
+        with self._condition:
+            entry = self._pending.pop(user_id, None)
+            if entry is not None:
+                self._begin(entry)
+            else:
+                in_flight = self._flushing.get(user_id)
+        if entry is not None:
+            self._write(entry)
+        elif in_flight is not None:
+            in_flight.done.wait()
+
+    def flush_all(self):
+        """
+        Write every buffered patch now, retries included, and wait for the
+        writes the background thread has in flight.
+        """
+        while True:
+            with self._condition:
+                entries = list(self._pending.values())
+                self._pending.clear()
+                for entry in entries:
+                    self._begin(entry)
+                in_flight = [entry for entry in self._flushing.values() if entry not in entries]
+            if not entries and not in_flight:
+                return
+            for entry in entries:
+                self._write(entry)
+            for entry in in_flight:
+                entry.done.wait()
+
+    def pending_users(self):
+        with self._condition:
+            return len(self._pending)
+
+    def _begin(self, entry):
+        entry.previous = self._flushing.get(entry.user.pk)
+        self._flushing[entry.user.pk] = entry
+
+    def _write(self, entry):
+        try:
+            if entry.previous is not None:
+                entry.previous.done.wait()
+            self._apply(entry)
+        finally:
+            entry.done.set()
+            with self._condition:
+                if self._flushing.get(entry.user.pk) is entry:
+                    del self._flushing[entry.user.pk]
+
+    def _apply(self, entry):
+        if len(entry.patches) > 1:
+            try:
+                apply_patches(entry.user, entry.patches)
+            except Exception:
+                stats.incr('failed_writes')
+                logger.warning(
+                    'Buffered preference patches for user %s failed to write together, writing them one at a time',
+                    entry.user.pk, exc_info=True
+                )
+            else:
+                stats.incr('writes')
+                stats.incr('written_patches', len(entry.patches))
+                return
+
+        for index, patch in enumerate(entry.patches):
+            try:
+                apply_patches(entry.user, [patch])
+            except Exception:
+                stats.incr('failed_writes')
+                attempts = entry.attempts[index] + 1
+                if attempts < self.max_attempts:
+                    logger.warning(
+                        'A buffered preference patch for user %s failed to write, retrying', entry.user.pk, exc_info=True
+                    )
+                    # Retried together with the patches after it, which must land after it
+                    self._retry(entry.user, entry.patches[index:], [attempts, *entry.attempts[index + 1:]])
+                    return
+                logger.exception(
+                    'Dropped a buffered preference patch for user %s after %d attempts', entry.user.pk, attempts
+                )
+                stats.incr('dropped_patches')
+                continue
+            stats.incr('writes')
+            stats.incr('written_patches')
+
+    def _retry(self, user, patches, attempts):
+        with self._condition:
+            newer = self._pending.get(user.pk)
+            self._pending[user.pk] = PendingWrite(
+                user,
+                newer.deadline if newer else time.monotonic() + settings.PREFERENCES_WRITE_COALESCING_WINDOW,
+                patches + (newer.patches if newer else []),
+                attempts + (newer.attempts if newer else [])
+            )
+            self._condition.notify()
+
+    def _start(self):
+        if self._thread is None:
+            self._thread = threading.Thread(target=self._run, name='preferences-write-coalescer', daemon=True)
+            self._thread.start()
+            atexit.register(self.flush_all)
+
+    def _run(self):
+        while True:
+            with self._condition:
+                while not self._pending:
+                    self._condition.wait()
+                now = time.monotonic()
+                due = [entry for entry in self._pending.values() if entry.deadline <= now]
+                if not due:
+                    self._condition.wait(min(entry.deadline for entry in self._pending.values()) - now)
+                    continue
+                for entry in due:
+                    del self._pending[entry.user.pk]
+                    self._begin(entry)
+            for entry in due:
+                self._write(entry)
+            close_old_connections()
+
+
+coalescer = WriteCoalescer()
+
+
+def normalize_patch(patch):
+    """
+    The preference sections of ``patch``, copied so the caller's data cannot
+    change them while buffered. Raises ValueError if a section is not an
+    object, as merging it would fail when it is written.
+    """
+    normalized = {}
+    for section in SECTIONS:
+        if section in patch:
+            if not isinstance(patch[section], dict):
+                raise ValueError(f'{section} must be a JSON object.')
+            normalized[section] = copy.deepcopy(patch[section])
+    return normalized
+
+
+def buffer_patch(user, data, patch):
+    """
+    Buffer ``patch`` for ``user`` and return their current document ``data``
+    as it will read once their buffered patches are written. Raises
+    ValueError for a patch that cannot be applied, leaving it unbuffered.
+    """
+    # Checked before buffering, so a bad patch is rejected rather than
+    # failing the write of the whole buffer later
+    patches = coalescer.add(user, normalize_patch(patch))
+    identity = user_identity(user)
+    preview = dict(data)
+    for section in SECTIONS:
+        overrides, patched = apply_section_patches(section, data[section], patches, identity)
+        if overrides is not None:
+            preview[section] = patched
+    return preview
+
+
+def flush_pending(user_id):
+    """Write ``user_id``'s buffered patches, if coalescing is on, before reading."""
+    if coalescing_enabled():
+        coalescer.flush(user_id)
@@ -0,0 +1,14 @@
+from django.conf import settings
+
+
+def apply_sqlite_pragmas(connection):
+    """
+    Apply the configured SQLITE_PRAGMAS to a newly opened SQLite connection.
+    With persistent connections this runs once per connection, not per request.
+    """
+    pragmas = getattr(settings, 'SQLITE_PRAGMAS', {})
+    if not pragmas:
+        return
+    with connection.cursor() as cursor:
+        for name, value in pragmas.items():
+            cursor.execute(f'PRAGMA {name} = {value}')
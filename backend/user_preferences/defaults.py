@@ -0,0 +1,72 @@
+"""
+The single definition of default preference values.
+
+Rows only store the keys a user has changed; everything else is read from
+here, so changing a default takes effect without rewriting any rows. Each
+revision of the defaults is kept under its own version so that backfills
+can pin the definition they were written against (migrations freeze a copy
+instead, so replaying them never changes what they store). Bump
+``CURRENT_VERSION`` when adding a revision; it is part of every cache key
+and ETag, so cached documents are refreshed automatically.
+"""
+
+CURRENT_VERSION = 1
+
+REGISTRY = {
+    1: {
+        # username and email default to the values on the User
+        'account': {
+            'firstName': '',
+            'lastName': '',
+            'phone': ''
+        },
+        'notifications': {
+            'emailNotifications': True,
+            'pushNotifications': True,
+            'smsNotifications': False,
+            'frequency': 'daily',
+            'marketingEmails': False,
+            'securityAlerts': True
+        },
+        'theme': {
+            'colorScheme': 'light',
+            'fontSize': 'medium',
+            'layout': 'standard',
+            'animations': True,
+            'compactMode': False
+        },
+        'privacy': {
+            'profileVisibility': 'friends',
+            'dataSharing': False,
+            'analyticsTracking': True,
+            'locationSharing': False,
+            'activityStatus': True,
+            'searchableProfile': True
+        },
+    },
+}
+
+
+def user_identity(user):
+    return {'username': user.username, 'email': user.email}
+
+
+def get_defaults(section, identity=None, version=CURRENT_VERSION):
+    defaults = REGISTRY[version][section]
+    if section == 'account' and identity:
+        return {**identity, **defaults}
+    return defaults
+
+
+def expand(section, overrides, identity=None, version=CURRENT_VERSION):
+    """Merge a section's stored overrides over its defaults."""
+    return {**get_defaults(section, identity, version), **overrides}
+
+
+def compact(section, values, identity=None, version=CURRENT_VERSION):
+    """Reduce a section to the keys that differ from its defaults."""
+    defaults = get_defaults(section, identity, version)
+    return {
+        key: value for key, value in values.items()
+        if key not in defaults or defaults[key] != value
+    }
@@ -0,0 +1,105 @@
+import hashlib
+import json
+from datetime import datetime, timedelta, timezone
+
+from django.core.serializers.json import DjangoJSONEncoder
+from django.utils.dateparse import parse_datetime
+from django.utils.http import parse_etags
+
+from .defaults import CURRENT_VERSION as DEFAULTS_VERSION
+
+EPOCH = datetime(1970, 1, 1, tzinfo=timezone.utc)
+
+
+def timestamp_token(value):
+    """
+    Encode an ``updated_at`` datetime (or its serialized form) as microseconds
+    since the epoch, in hex.
+    """
+    if isinstance(value, str):
+        value = parse_datetime(value)
+    return format((value - EPOCH) // timedelta(microseconds=1), 'x')
+
+
+def content_digest(data):
+    payload = json.dumps(data, sort_keys=True, separators=(',', ':'), cls=DjangoJSONEncoder)
+    return hashlib.sha1(payload.encode('utf-8')).hexdigest()[:16]
+
+
+def validator_token(version, updated_at, user):
+    # The defaults version is included since a defaults change alters documents
+    # without touching their rows, and the embedded user fields since they
+    # change on the user's own row
+    return f'{version}.{timestamp_token(updated_at)}.{DEFAULTS_VERSION}.{content_digest(user)[:8]}'
+
+
+def make_etag(data):
+    """
+    Strong ETag for a serialized preferences document: the row version,
+    ``updated_at`` and user token followed by a hash of the content.
+    """
+    return f'"{validator_token(data["version"], data["updated_at"], data["user"])}-{content_digest(data)}"'
+
+
+def content_etag(data):
+    """
+    Strong ETag from a hash of the content alone, for sections and sparse
+    documents, which are unchanged by writes to the rest of the row.
+    """
+    # Prefixed so the digest is never mistaken for a row version
+    return f'"c-{content_digest(data)}"'
+
+
+def etag_validator(etag):
+    return etag.strip('"').split('-', 1)[0]
+
+
+def matching_etag(etags, version, updated_at, user):
+    """
+    The first of ``etags`` still current for a row and the serialized fields
+    of its ``user``, or None.
+    """
+    token = validator_token(version, updated_at, user)
+    for etag in etags:
+        if etag == '*' or etag_validator(etag) == token:
+            return etag
+    return None
+
+
+def etag_version(etag):
+    """Row version encoded in an ETag, or None if the tag is not one of ours."""
+    try:
+        return int(etag_validator(etag).split('.', 1)[0])
+    except ValueError:
+        return None
+
+
+def request_etags(request, header='HTTP_IF_NONE_MATCH', weak=True):
+    """
+    Parse a conditional header into opaque tags. Weak tags are unprefixed for
+    If-None-Match and dropped when ``weak`` is False, as If-Match requires.
+    """
+    value = request.META.get(header)
+    if not value:
+        return []
+    etags = []
+    for etag in parse_etags(value):
+        if etag.startswith('W/'):
+            if not weak:
+                continue
+            etag = etag[2:]
+        etags.append(etag)
+    return etags
+
+
+def if_match_versions(request):
+    """
+    Row versions an If-Match header accepts, or None when it accepts any (no
+    header, or ``*``). Tags that are not ours accept no version.
+    """
+    if 'HTTP_IF_MATCH' not in request.META:
+        return None
+    etags = request_etags(request, 'HTTP_IF_MATCH', weak=False)
+    if '*' in etags:
+        return None
+    return [version for version in map(etag_version, etags) if version is not None]
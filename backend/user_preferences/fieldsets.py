@@ -0,0 +1,96 @@
+"""
+Single sections and sparse fieldsets of the preferences document. Sections
+are cached apart from the document and from each other, so a write to one
+section leaves the others cached, and carry content ETags, which writes to
+the rest of the row do not change.
+"""
+from django.http import Http404
+
+from .cache import get_preferences_section, peek_preferences
+from .defaults import expand, user_identity
+from .etags import content_etag
+from .models import SECTIONS
+from .serializers import UserPreferencesSerializer
+from .services import ensure_preferences, fetch_preferences_data
+from .sharding import preferences_manager
+
+FIELDS = UserPreferencesSerializer.Meta.fields
+
+
+def split_names(value):
+    if value is None:
+        return None
+    return [name.strip() for name in value.split(',') if name.strip()]
+
+
+def parse_fieldset(params):
+    """
+    The document fields asked for by the ``sections`` and ``fields`` query
+    parameters, in document order, or None for the whole document.
+    ``sections`` drops the other sections, ``fields`` keeps only the named
+    fields. Raises ValueError for unknown names.
+    """
+    sections = split_names(params.get('sections'))
+    fields = split_names(params.get('fields'))
+    if sections is None and fields is None:
+        return None
+    for param, names, known in (('sections', sections, SECTIONS), ('fields', fields, FIELDS)):
+        unknown = [name for name in names or () if name not in known]
+        if unknown:
+            raise ValueError(f'Unknown {param}: {", ".join(unknown)}. Choose from: {", ".join(known)}.')
+    return [
+        name for name in FIELDS
+        if (fields is None or name in fields) and (sections is None or name not in SECTIONS or name in sections)
+    ]
+
+
+def fetch_fields(user, names, create_missing=False):
+    """Read the document fields ``names`` for ``user``, loading only the columns that render them."""
+    sections = [name for name in names if name in SECTIONS]
+    data = fetch_preferences_data(user.pk, sections, fields=names)
+    if data is None:
+        if not create_missing:
+            raise Http404
+        ensure_preferences(user)
+        data = fetch_preferences_data(user.pk, sections, fields=names)
+    return data
+
+
+def load_section(user, section, create_missing=False):
+    values = fetch_fields(user, [section], create_missing)[section]
+    return {'etag': content_etag(values), 'data': values}
+
+
+def get_section(user, section, create_missing=False):
+    """The effective values of one section of ``user``'s preferences and their ETag."""
+    return get_preferences_section(user.pk, section, lambda: load_section(user, section, create_missing))
+
+
+def get_sparse_document(user, names, create_missing=False):
+    """
+    The preferences document restricted to ``names`` with its content ETag:
+    assembled from the cached sections when only sections are asked for,
+    else sliced from the cached document, or read with only the columns
+    rendering them.
+    """
+    if all(name in SECTIONS for name in names):
+        data = {name: get_section(user, name, create_missing)['data'] for name in names}
+    elif (document := peek_preferences(user.pk)) is not None:
+        data = {name: document['data'][name] for name in names}
+    else:
+        data = fetch_fields(user, names, create_missing)
+    return {'etag': content_etag(data), 'data': data}
+
+
+def section_if_match_versions(user, section, etags):
+    """
+    The row versions a write to ``section`` may apply to under an If-Match of
+    ``etags``: the current one if they include the section's ETag or ``*``,
+    else none. None when the user has no preferences row.
+    """
+    row = preferences_manager(user.pk).filter(user=user).values('version', section).first()
+    if row is None:
+        return None
+    if '*' in etags or content_etag(expand(section, row[section], user_identity(user))) in etags:
+        return [row['version']]
+    return []
@@ -0,0 +1,51 @@
+import asyncio
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+from django.conf import settings
+from django.contrib.auth import hashers
+
+from .throttling import hashing_limiter
+
+_executor = None
+_executor_lock = threading.Lock()
+
+
+def get_executor():
+    """
+    The bounded pool password hashes run on, so async views never hash on the
+    event loop. PBKDF2 releases the GIL, so the workers hash in parallel.
+    """
+    global _executor
+    if _executor is None:
+        with _executor_lock:
+            if _executor is None:
+                _executor = ThreadPoolExecutor(
+                    max_workers=settings.PASSWORD_HASHING_WORKERS, thread_name_prefix='password-hashing'
+                )
+    return _executor
+
+
+# Every hash takes a slot from hashing_limiter and raises HashingOverloaded
+# when none is free
+
+def make_password(password):
+    with hashing_limiter.slot():
+        return hashers.make_password(password)
+
+
+def check_password(password, encoded):
+    with hashing_limiter.slot():
+        return hashers.check_password(password, encoded)
+
+
+async def amake_password(password):
+    with hashing_limiter.slot():
+        return await asyncio.get_running_loop().run_in_executor(get_executor(), hashers.make_password, password)
+
+
+async def acheck_password(password, encoded):
+    with hashing_limiter.slot():
+        return await asyncio.get_running_loop().run_in_executor(
+            get_executor(), hashers.check_password, password, encoded
+        )
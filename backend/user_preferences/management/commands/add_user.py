@@ -1,6 +1,7 @@
 from django.core.management.base import BaseCommand
 from django.contrib.auth.models import User
-from user_preferences.models import UserPreferences
+from django.db import transaction
+from user_preferences.sharding import preferences_manager
 
 class Command(BaseCommand):
     help = 'Adds a new user with default preferences'
@@ -15,56 +16,17 @@ class Command(BaseCommand):
         email = options['email']
         password = options['password']
 
-        # Create default preferences
-        default_preferences = {
-            'account': {
-                'username': username,
-                'email': email,
-                'firstName': '',
-                'lastName': '',
-                'phone': ''
-            },
-            'notifications': {
-                'emailNotifications': True,
-                'pushNotifications': True,
-                'smsNotifications': False,
-                'frequency': 'daily',
-                'marketingEmails': False,
-                'securityAlerts': True
-            },
-            'theme': {
-                'colorScheme': 'light',
-                'fontSize': 'medium',
-                'layout': 'standard',
-                'animations': True,
-                'compactMode': False
-            },
-            'privacy': {
-                'profileVisibility': 'friends',
-                'dataSharing': False,
-                'analyticsTracking': True,
-                'locationSharing': False,
-                'activityStatus': True,
-                'searchableProfile': True
-            }
-        }
-
         try:
-            # Create user
-            user = User.objects.create_user(
-                username=username,
-                email=email,
-                password=password
-            )
-            
-            # Create user preferences
-            UserPreferences.objects.create(
-                user=user,
-                account=default_preferences['account'],
-                notifications=default_preferences['notifications'],
-                theme=default_preferences['theme'],
-                privacy=default_preferences['privacy']
-            )
+            with transaction.atomic():
+                # Create user
+                user = User.objects.create_user(
+                    username=username,
+                    email=email,
+                    password=password
+                )
+                
+                # Create user preferences; defaults are not stored per row
+                preferences_manager(user.pk).create(user=user)
 
             self.stdout.write(
                 self.style.SUCCESS(f'Successfully created user "{username}" with default preferences')
@@ -0,0 +1,119 @@
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import router, transaction
+from django.utils import timezone
+from user_preferences.backfills import BACKFILLS
+from user_preferences.models import BackfillCheckpoint
+from user_preferences.sharding import get_shards
+
+
+class Command(BaseCommand):
+    help = (
+        'Runs a registered backfill over every preferences row, shard by shard, in primary key order. '
+        'Each chunk commits on its own and advances a checkpoint, so the command can be stopped at any '
+        'time and started again to resume. Without a name, lists the registered backfills.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('name', nargs='?', help='Registered backfill to run')
+        parser.add_argument('--batch-size', type=int, default=500, help='Rows rewritten per transaction')
+        parser.add_argument(
+            '--rows-per-second', type=float, default=2000,
+            help='Rows read per second at most, so live traffic keeps the database (0 for no limit)'
+        )
+        parser.add_argument(
+            '--dry-run', action='store_true',
+            help='Only count the rows left to read and the rows that would change, leaving the checkpoint as is'
+        )
+        parser.add_argument('--restart', action='store_true', help='Discard the checkpoint and start from the first row')
+
+    def handle(self, *args, **options):
+        if options['name'] is None:
+            for name, backfill in sorted(BACKFILLS.items()):
+                self.stdout.write(f'{name}: {backfill.description}')
+            return
+        backfill = BACKFILLS.get(options['name'])
+        if backfill is None:
+            raise CommandError(f'Unknown backfill "{options["name"]}", choose from: {", ".join(sorted(BACKFILLS))}')
+        if options['batch_size'] < 1:
+            raise CommandError('--batch-size must be at least 1')
+        if options['rows_per_second'] < 0:
+            raise CommandError('--rows-per-second cannot be negative')
+
+        if options['restart'] and not options['dry_run']:
+            BackfillCheckpoint.objects.filter(name=backfill.name).delete()
+
+        verb = 'would change' if options['dry_run'] else 'changed'
+        self.started = time.monotonic()
+        self.scanned = 0
+        total = 0
+        for alias in get_shards():
+            checkpoint = self.get_checkpoint(backfill, alias, options)
+            if checkpoint.completed_at is not None:
+                self.stdout.write(f'{alias}: already completed at {checkpoint.completed_at:%Y-%m-%d %H:%M:%S}')
+                continue
+            scanned, changed = self.run_shard(backfill, checkpoint, options)
+            self.stdout.write(f'{alias}: {scanned} rows read, {changed} {verb}')
+            total += changed
+        self.stdout.write(self.style.SUCCESS(f'{backfill.name}: {self.scanned} rows read, {total} {verb} in total'))
+
+    def get_checkpoint(self, backfill, alias, options):
+        if options['dry_run']:
+            # Counted from where a real run would resume, without saving anything
+            checkpoint = BackfillCheckpoint.objects.filter(name=backfill.name, database=alias).first()
+            if checkpoint is None or options['restart']:
+                checkpoint = BackfillCheckpoint(name=backfill.name, database=alias)
+            return checkpoint
+        checkpoint, created = BackfillCheckpoint.objects.get_or_create(name=backfill.name, database=alias)
+        if not created and checkpoint.completed_at is None and checkpoint.last_pk:
+            self.stdout.write(f'{alias}: resuming after row #{checkpoint.last_pk}')
+        return checkpoint
+
+    def run_shard(self, backfill, checkpoint, options):
+        dry_run = options['dry_run']
+        # A checkpoint on the shard's own database commits with its chunk
+        same_database = router.db_for_write(BackfillCheckpoint) == checkpoint.database
+        scanned = changed = 0
+        while True:
+            if dry_run:
+                last_pk, chunk_scanned, chunk_changed = backfill.apply_chunk(
+                    checkpoint.database, checkpoint.last_pk, options['batch_size'], dry_run=True
+                )
+                self.advance(checkpoint, last_pk, chunk_scanned, chunk_changed)
+            else:
+                # The change feed is on the default database, as for live writes
+                with transaction.atomic(using=checkpoint.database), transaction.atomic(savepoint=False):
+                    last_pk, chunk_scanned, chunk_changed = backfill.apply_chunk(
+                        checkpoint.database, checkpoint.last_pk, options['batch_size']
+                    )
+                    self.advance(checkpoint, last_pk, chunk_scanned, chunk_changed)
+                    if same_database:
+                        checkpoint.save()
+                if not same_database:
+                    # Saved once the shard's chunk has committed, since the
+                    # default database commits first. A crash in between
+                    # repeats the chunk, which idempotent transforms allow.
+                    checkpoint.save()
+            if last_pk is None:
+                return scanned, changed
+
+            scanned += chunk_scanned
+            changed += chunk_changed
+            self.scanned += chunk_scanned
+            self.throttle(options['rows_per_second'])
+
+    def advance(self, checkpoint, last_pk, scanned, changed):
+        if last_pk is None:
+            checkpoint.completed_at = timezone.now()
+        else:
+            checkpoint.last_pk = last_pk
+            checkpoint.rows_scanned += scanned
+            checkpoint.rows_changed += changed
+
+    def throttle(self, rows_per_second):
+        # Paced over the whole run, so a slow chunk is not followed by a burst
+        if rows_per_second:
+            delay = self.scanned / rows_per_second - (time.monotonic() - self.started)
+            if delay > 0:
+                time.sleep(delay)
@@ -0,0 +1,419 @@
+import asyncio
+import inspect
+import json
+import os
+import platform
+import tempfile
+import threading
+import time
+from contextlib import contextmanager
+from types import ModuleType
+
+import django
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+from django.test import AsyncClient, Client
+from django.test.utils import override_settings, setup_test_environment, teardown_test_environment
+from rest_framework_simplejwt.tokens import RefreshToken
+from user_preferences import urls
+from user_preferences.benchmarking import arun_load, benchmark_database, run_load, seed_users, summarize
+from user_preferences.models import UserPreferences
+
+PASSWORDS = ('Bench-secret-1!', 'Bench-secret-2!')
+
+# Scenarios paying for a password hash per request run fewer requests
+HASHING_SCENARIOS = {'token', 'register', 'password', 'login', 'login_bootstrap'}
+
+
+class RoundTripClient(Client):
+    """Client waiting ``round_trip`` seconds per request, standing in for the network."""
+
+    def __init__(self, round_trip=0, **defaults):
+        super().__init__(**defaults)
+        self.round_trip = round_trip
+
+    def request(self, **request):
+        if self.round_trip:
+            time.sleep(self.round_trip)
+        return super().request(**request)
+
+
+class HeaderAsyncClient(AsyncClient):
+    """
+    AsyncClient sending ``headers`` with every request, which Django 5.0's
+    drops, and waiting ``round_trip`` seconds per request.
+    """
+
+    def __init__(self, headers=None, round_trip=0, **defaults):
+        super().__init__(**defaults)
+        self.default_headers = headers or {}
+        self.round_trip = round_trip
+
+    def generic(self, method, path, *args, headers=None, **extra):
+        return super().generic(method, path, *args, headers={**self.default_headers, **(headers or {})}, **extra)
+
+    async def request(self, **request):
+        if self.round_trip:
+            await asyncio.sleep(self.round_trip)
+        return await super().request(**request)
+
+
+class Actor:
+    """
+    A benchmark user driven by one thread, or one task with ``asgi``, with its
+    own clients. ASGI clients return awaitable responses.
+    """
+
+    def __init__(self, user, preferences, asgi=False, round_trip=0):
+        self.user = user
+        self.preferences = preferences
+        self.password = PASSWORDS[0]
+        self.round_trip = round_trip
+        token = RefreshToken.for_user(self.user).access_token
+        client_class = HeaderAsyncClient if asgi else RoundTripClient
+        # Server errors such as "database is locked" count as failures instead of raising
+        self.client = client_class(
+            headers={'Authorization': f'Bearer {token}'}, round_trip=round_trip, raise_request_exception=False
+        )
+        self.anonymous = client_class(round_trip=round_trip, raise_request_exception=False)
+
+    @classmethod
+    def create(cls, name, asgi=False, round_trip=0):
+        user = User.objects.create_user(username=name, email=f'{name}@example.com', password=PASSWORDS[0])
+        return cls(user, UserPreferences.objects.create(user=user), asgi, round_trip)
+
+    def clone(self):
+        return Actor(self.user, self.preferences, round_trip=self.round_trip)
+
+
+def then(response, callback):
+    """Call ``callback`` with the response, once awaited for ASGI clients."""
+    if not inspect.isawaitable(response):
+        callback(response)
+        return response
+
+    async def chained():
+        result = await response
+        callback(result)
+        return result
+
+    return chained()
+
+
+def chain(response, follow_up):
+    """
+    Make the request ``follow_up`` builds from a successful response, awaiting
+    both for ASGI clients.
+    """
+    if not inspect.isawaitable(response):
+        return follow_up(response) if response.status_code < 400 else response
+
+    async def chained():
+        first = await response
+        return await follow_up(first) if first.status_code < 400 else first
+
+    return chained()
+
+
+def obtain_token(actor, index):
+    return actor.anonymous.post(
+        '/api/v1/token/', {'username': actor.user.username, 'password': actor.password},
+        content_type='application/json'
+    )
+
+
+def login(actor, index):
+    # The two calls a login makes without the bootstrap endpoint
+    return chain(obtain_token(actor, index), lambda response: actor.anonymous.get(
+        '/api/v1/preferences/my_preferences/', headers={'Authorization': f'Bearer {response.json()["access"]}'}
+    ))
+
+
+def login_bootstrap(actor, index):
+    return actor.anonymous.post(
+        '/api/v1/token/bootstrap/', {'username': actor.user.username, 'password': actor.password},
+        content_type='application/json'
+    )
+
+
+def register(actor, index):
+    return actor.anonymous.post(
+        '/api/v1/register/',
+        {'username': f'registered{index}', 'email': f'registered{index}@example.com', 'password': PASSWORDS[0]},
+        content_type='application/json'
+    )
+
+
+def get_my_preferences(actor, index):
+    return actor.client.get('/api/v1/preferences/my_preferences/')
+
+
+def get_my_theme(actor, index):
+    return actor.client.get('/api/v1/preferences/my_preferences/theme/')
+
+
+def put_my_preferences(actor, index):
+    # Alternating values so every request is a real write rather than a no-op
+    return actor.client.put(
+        '/api/v1/preferences/my_preferences/',
+        {'theme': {'colorScheme': 'dark' if index % 2 else 'light'}},
+        content_type='application/json'
+    )
+
+
+def retrieve(actor, index):
+    return actor.client.get(f'/api/v1/preferences/{actor.preferences.pk}/')
+
+
+def update(actor, index):
+    return actor.client.put(
+        f'/api/v1/preferences/{actor.preferences.pk}/',
+        {'notifications': {'frequency': 'weekly' if index % 2 else 'daily'}},
+        content_type='application/json'
+    )
+
+
+def change_password(actor, index):
+    new_password = PASSWORDS[actor.password == PASSWORDS[0]]
+
+    def changed(response):
+        if response.status_code == 200:
+            actor.password = new_password
+
+    return then(actor.client.put(
+        '/api/v1/account/password/',
+        {'currentPassword': actor.password, 'newPassword': new_password},
+        content_type='application/json'
+    ), changed)
+
+
+SCENARIOS = {
+    'token': obtain_token,
+    'login': login,
+    'login_bootstrap': login_bootstrap,
+    'register': register,
+    'my_preferences_get': get_my_preferences,
+    'my_preferences_put': put_my_preferences,
+    'my_preferences_theme_get': get_my_theme,
+    'retrieve': retrieve,
+    'update': update,
+    'password': change_password,
+}
+
+
+def find_regressions(results, baseline, tolerance):
+    regressions = []
+    for name, current in results['scenarios'].items():
+        previous = baseline.get('scenarios', {}).get(name)
+        if previous is None:
+            continue
+        # Query counts are deterministic, so any increase is a regression. They
+        # are not counted under ASGI.
+        if None not in (current['queries_per_request'], previous['queries_per_request']) and (
+            current['queries_per_request'] > previous['queries_per_request']
+        ):
+            regressions.append(
+                f'{name}: {current["queries_per_request"]:.2f} queries/request '
+                f'(baseline {previous["queries_per_request"]:.2f})'
+            )
+        if current['p95_ms'] > previous['p95_ms'] * (1 + tolerance):
+            regressions.append(f'{name}: p95 {current["p95_ms"]:.2f}ms (baseline {previous["p95_ms"]:.2f}ms)')
+        if current['throughput_rps'] < previous['throughput_rps'] * (1 - tolerance):
+            regressions.append(
+                f'{name}: {current["throughput_rps"]:.1f} req/s (baseline {previous["throughput_rps"]:.1f} req/s)'
+            )
+    return regressions
+
+
+class Command(BaseCommand):
+    help = (
+        'Benchmarks the API end to end through the Django test client on a throwaway seeded '
+        'database, reporting throughput, latency percentiles and SQL queries per request'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--users', type=int, default=10000, help='Number of users to seed')
+        parser.add_argument('--requests', type=int, default=500, help='Requests per scenario')
+        parser.add_argument(
+            '--hashing-requests', type=int, default=20,
+            help=f'Requests for scenarios that hash passwords ({", ".join(sorted(HASHING_SCENARIOS))})'
+        )
+        parser.add_argument('--concurrency', type=int, default=1, help='Concurrent clients, each with its own user')
+        parser.add_argument('--scenario', action='append', choices=list(SCENARIOS), help='Run only these scenarios')
+        parser.add_argument(
+            '--background-writers', type=int, default=0,
+            help=(
+                'Threads issuing my_preferences PUTs for the benchmarked users while the scenarios run, '
+                'so reads keep missing the cache and contend with writes'
+            )
+        )
+        parser.add_argument(
+            '--asgi', action='store_true',
+            help='Drive the ASGI handler with async clients and the async views, one task per client'
+        )
+        parser.add_argument(
+            '--round-trip-ms', type=float, default=0,
+            help='Simulated network round trip added to every request, for comparing request chains'
+        )
+        parser.add_argument(
+            '--admission-control', action='store_true',
+            help='Keep the password throttles and hashing cap, which otherwise turn hashing scenarios into 429s'
+        )
+        parser.add_argument(
+            '--database-file',
+            help=(
+                'Seed into this SQLite file instead of memory. Concurrent clients and background writers '
+                'default to a temporary file, since in memory they fail on table locks'
+            )
+        )
+        parser.add_argument('--output', help='Write the results as JSON to this file')
+        parser.add_argument('--baseline', help='Fail if the results regress past this JSON results file')
+        parser.add_argument('--tolerance', type=float, default=0.2, help='Allowed latency/throughput regression')
+
+    def database_file(self, options):
+        # Threads sharing the in-memory database lock whole tables, so their
+        # writes fail with "database table is locked" and skew the results
+        if options['database_file'] or (options['concurrency'] == 1 and not options['background_writers']):
+            return options['database_file']
+        return os.path.join(tempfile.gettempdir(), 'benchmark_api.sqlite3')
+
+    def handle(self, *args, **options):
+        if options['concurrency'] < 1:
+            raise CommandError('--concurrency must be at least 1')
+        baseline = None
+        if options['baseline']:
+            with open(options['baseline'], encoding='utf-8') as stream:
+                baseline = json.load(stream)
+
+        results = {
+            'settings': {
+                'users': options['users'],
+                'requests': options['requests'],
+                'hashing_requests': options['hashing_requests'],
+                'concurrency': options['concurrency'],
+                'background_writers': options['background_writers'],
+                'asgi': options['asgi'],
+                'round_trip_ms': options['round_trip_ms'],
+                'admission_control': options['admission_control'],
+            },
+            'environment': {
+                'python': platform.python_version(),
+                'django': django.get_version(),
+                'machine': platform.machine(),
+                'sqlite_profile': settings.SQLITE_PROFILE,
+            },
+            'scenarios': {},
+        }
+
+        # Runs with DEBUG off, as in production, and lets the test client's host through
+        setup_test_environment(debug=False)
+        overrides = {}
+        if options['asgi']:
+            # The async views take over their routes, as with PREFERENCES_ASYNC_VIEWS
+            overrides['ROOT_URLCONF'] = ModuleType('benchmark_urls')
+            overrides['ROOT_URLCONF'].urlpatterns = urls.async_urlpatterns + urls.urlpatterns
+        if not options['admission_control']:
+            overrides['REST_FRAMEWORK'] = {**settings.REST_FRAMEWORK, 'DEFAULT_THROTTLE_RATES': {}}
+            overrides['PASSWORD_HASHING_MAX_IN_FLIGHT'] = None
+        try:
+            with benchmark_database(self.database_file(options)), override_settings(**overrides):
+                started = time.perf_counter()
+                seed_users(options['users'])
+                actors = [
+                    Actor.create(f'actor{number}', options['asgi'], options['round_trip_ms'] / 1000)
+                    for number in range(options['concurrency'])
+                ]
+                writers = [actors[number % len(actors)].clone() for number in range(options['background_writers'])]
+                self.stdout.write(f'Seeded {options["users"]} users in {time.perf_counter() - started:.1f}s')
+
+                with self.background_writes(writers) as writes:
+                    for name in options['scenario'] or SCENARIOS:
+                        results['scenarios'][name] = self.run_scenario(name, actors, options)
+                if writers:
+                    results['background_writes'] = writes
+                    self.stdout.write(
+                        f'background my_preferences_put: {writes["throughput_rps"]:.1f} req/s, '
+                        f'{writes["failures"]} of {writes["requests"]} failed'
+                    )
+        finally:
+            teardown_test_environment()
+
+        if options['output']:
+            with open(options['output'], 'w', encoding='utf-8') as stream:
+                json.dump(results, stream, indent=2)
+
+        if baseline is not None:
+            if baseline.get('settings') != results['settings']:
+                self.stderr.write(self.style.WARNING('Baseline was recorded with different settings'))
+            regressions = find_regressions(results, baseline, options['tolerance'])
+            if regressions:
+                raise CommandError('Regressed past the baseline:\n  ' + '\n  '.join(regressions))
+            self.stdout.write(self.style.SUCCESS('No regressions against the baseline'))
+
+    @contextmanager
+    def background_writes(self, writers):
+        stop = threading.Event()
+        counts = [[0, 0] for _ in writers]
+
+        def write(number):
+            try:
+                while not stop.is_set():
+                    response = put_my_preferences(writers[number], counts[number][0])
+                    counts[number][0] += 1
+                    counts[number][1] += response.status_code >= 400
+            finally:
+                connection.close()
+
+        threads = [threading.Thread(target=write, args=(number,)) for number in range(len(writers))]
+        results = {}
+        started = time.perf_counter()
+        for thread in threads:
+            thread.start()
+        try:
+            yield results
+        finally:
+            stop.set()
+            for thread in threads:
+                thread.join()
+            elapsed = time.perf_counter() - started
+            requests = sum(count for count, _ in counts)
+            results.update(
+                writers=len(writers),
+                requests=requests,
+                failures=sum(failed for _, failed in counts),
+                throughput_rps=requests / elapsed if elapsed else 0.0,
+            )
+
+    def run_scenario(self, name, actors, options):
+        scenario = SCENARIOS[name]
+        requests = options['hashing_requests'] if name in HASHING_SCENARIOS else options['requests']
+
+        if options['asgi']:
+            async def call(worker, index):
+                return (await scenario(actors[worker], index)).status_code < 400
+
+            samples, queries, failures, elapsed = asyncio.run(arun_load(call, requests, options['concurrency']))
+        else:
+            def call(worker, index):
+                return scenario(actors[worker], index).status_code < 400
+
+            samples, queries, failures, elapsed = run_load(call, requests, options['concurrency'])
+        counted = None not in queries
+        result = {
+            **summarize(samples),
+            'failures': failures,
+            'throughput_rps': len(samples) / elapsed if elapsed else 0.0,
+            'queries_per_request': sum(queries) / len(queries) if counted else None,
+            'max_queries': max(queries) if counted else None,
+        }
+        query_text = f'{result["queries_per_request"]:.2f} queries/request, ' if counted else ''
+        self.stdout.write(
+            f'{name}: {result["throughput_rps"]:.1f} req/s, p50 {result["p50_ms"]:.2f}ms, '
+            f'p95 {result["p95_ms"]:.2f}ms, p99 {result["p99_ms"]:.2f}ms, '
+            f'{query_text}{failures} failures'
+        )
+        if failures:
+            self.stderr.write(self.style.WARNING(f'{name}: {failures} of {requests} requests failed'))
+        return result
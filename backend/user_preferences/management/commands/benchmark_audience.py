@@ -0,0 +1,60 @@
+import time
+
+from django.core.management.base import BaseCommand
+from django.db import connection
+from django.db.models import Q
+from user_preferences.audience import audience_queryset, iter_audience
+from user_preferences.benchmarking import benchmark_database, seed_users, summarize, time_calls
+from user_preferences.defaults import get_defaults
+from user_preferences.models import UserPreferences
+
+QUERIES = [
+    {'notifications.emailNotifications': True, 'notifications.frequency': 'daily'},
+    {'notifications.frequency': 'weekly'},
+    {'privacy.searchableProfile': True},
+    {'notifications.marketingEmails': True},
+]
+
+
+def json_scan(conditions):
+    # The equivalent query against the JSON sections, for comparison
+    q = Q()
+    for key, value in conditions.items():
+        section, name = key.split('.', 1)
+        condition = Q(**{f'{section}__{name}': value})
+        if get_defaults(section).get(name) == value:
+            condition |= ~Q(**{f'{section}__has_key': name})
+        q &= condition
+    return UserPreferences.objects.filter(q).values_list('user_id', flat=True).iterator(chunk_size=5000)
+
+
+class Command(BaseCommand):
+    help = 'Benchmarks indexed audience queries against JSON scans on a throwaway seeded database'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--users', type=int, default=100000, help='Number of users to seed')
+        parser.add_argument('--repeat', type=int, default=5, help='Runs per query')
+        parser.add_argument('--database-file', help='Seed into this SQLite file instead of memory')
+
+    def handle(self, *args, **options):
+        with benchmark_database(options['database_file']):
+            started = time.perf_counter()
+            seed_users(options['users'])
+            self.stdout.write(f'Seeded {options["users"]} users in {time.perf_counter() - started:.1f}s')
+
+            for conditions in QUERIES:
+                indexed = list(iter_audience(conditions))
+                scanned = list(json_scan(conditions))
+                if sorted(indexed) != sorted(scanned):
+                    self.stderr.write(self.style.ERROR(f'Result mismatch for {conditions}'))
+
+                plan = audience_queryset(conditions).explain() if connection.vendor == 'sqlite' else 'n/a'
+
+                indexed_stats = summarize(time_calls(lambda: sum(1 for _ in iter_audience(conditions)), options['repeat']))
+                scan_stats = summarize(time_calls(lambda: sum(1 for _ in json_scan(conditions)), options['repeat']))
+                self.stdout.write(
+                    f'{conditions}: {len(indexed)} users\n'
+                    f'  indexed p50 {indexed_stats["p50_ms"]:.1f}ms, JSON scan p50 {scan_stats["p50_ms"]:.1f}ms '
+                    f'({scan_stats["p50_ms"] / max(indexed_stats["p50_ms"], 1e-6):.1f}x)\n'
+                    f'  plan: {plan.replace(chr(10), "; ")}'
+                )
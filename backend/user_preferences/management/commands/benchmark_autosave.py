@@ -0,0 +1,141 @@
+import os
+import tempfile
+import threading
+import time
+
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+from django.test import Client
+from django.test.utils import override_settings, setup_test_environment, teardown_test_environment
+from rest_framework_simplejwt.tokens import AccessToken
+from user_preferences.benchmarking import benchmark_database, seed_users, summarize
+from user_preferences.coalescing import coalescer
+from user_preferences.defaults import get_defaults
+from user_preferences.metrics import coalescing_events
+from user_preferences.models import PreferenceChange
+from user_preferences.services import fetch_preferences_data
+
+# Switches flipped by an autosave burst, in order
+TOGGLES = [
+    ('theme', 'compactMode'),
+    ('notifications', 'emailNotifications'),
+    ('theme', 'animations'),
+    ('privacy', 'dataSharing'),
+    ('notifications', 'pushNotifications'),
+    ('privacy', 'searchableProfile'),
+]
+
+
+def toggle(step, run):
+    """The patch for a burst's ``step``: away from the default on even runs, back on odd ones."""
+    section, key = TOGGLES[step % len(TOGGLES)]
+    default = get_defaults(section)[key]
+    return {section: {key: default if run % 2 else not default}}
+
+
+class Command(BaseCommand):
+    help = (
+        'Benchmarks autosave bursts, each user flipping several switches in quick succession, with '
+        'writes going straight through and then coalesced, on a throwaway seeded database. Reports '
+        'rows written per request and checks every user ends up with all of their changes.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--users', type=int, default=2000, help='Number of users sending bursts')
+        parser.add_argument('--burst', type=int, default=5, help='PUTs per user per burst')
+        parser.add_argument('--gap', type=float, default=0.05, help='Seconds between the steps of a burst')
+        parser.add_argument('--cohort', type=int, default=10, help='Users bursting at the same time per client')
+        parser.add_argument('--concurrency', type=int, default=4, help='Concurrent clients')
+        parser.add_argument('--window', type=float, default=2.0, help='Coalescing window in seconds')
+        parser.add_argument(
+            '--database-file', default=os.path.join(tempfile.gettempdir(), 'benchmark_autosave.sqlite3'),
+            help='SQLite file to seed into. Not in memory, where concurrent writers fail on table locks'
+        )
+
+    def handle(self, *args, **options):
+        if options['burst'] > len(TOGGLES):
+            raise CommandError(f'--burst can be at most {len(TOGGLES)}')
+        if min(options['users'], options['cohort'], options['concurrency']) < 1:
+            raise CommandError('--users, --cohort and --concurrency must be at least 1')
+
+        setup_test_environment(debug=False)
+        try:
+            with benchmark_database(options['database_file']):
+                seed_users(options['users'])
+                users = list(User.objects.filter(username__startswith='bench'))
+                tokens = {user.pk: f'Bearer {AccessToken.for_user(user)}' for user in users}
+
+                direct = self.run_bursts(users, tokens, options, run=0, window=None)
+                coalesced = self.run_bursts(users, tokens, options, run=1, window=options['window'])
+        finally:
+            teardown_test_environment()
+
+        if direct['writes']:
+            self.stdout.write(self.style.SUCCESS(
+                f'Coalescing cut rows written by {(1 - coalesced["writes"] / direct["writes"]) * 100:.1f}% '
+                f'({direct["writes"]} -> {coalesced["writes"]})'
+            ))
+        if direct['mismatches'] or coalesced['mismatches']:
+            raise CommandError('Some users did not end up with all of their changes')
+
+    def run_bursts(self, users, tokens, options, run, window):
+        cohorts = [users[start:start + options['cohort']] for start in range(0, len(users), options['cohort'])]
+        lock = threading.Lock()
+        samples, failures = [], []
+
+        def client_worker(number):
+            client = Client(raise_request_exception=False)
+            local_samples, local_failures = [], 0
+            try:
+                for cohort in cohorts[number::options['concurrency']]:
+                    for step in range(options['burst']):
+                        for user in cohort:
+                            started = time.perf_counter()
+                            response = client.put(
+                                '/api/v1/preferences/my_preferences/', toggle(step, run),
+                                content_type='application/json', headers={'Authorization': tokens[user.pk]}
+                            )
+                            local_samples.append(time.perf_counter() - started)
+                            local_failures += response.status_code >= 400
+                        time.sleep(options['gap'])
+            finally:
+                connection.close()
+            with lock:
+                samples.extend(local_samples)
+                failures.append(local_failures)
+
+        with override_settings(PREFERENCES_WRITE_COALESCING_WINDOW=window):
+            coalescing_events.reset()
+            changes_before = PreferenceChange.objects.count()
+            started = time.perf_counter()
+            threads = [threading.Thread(target=client_worker, args=(number,)) for number in range(options['concurrency'])]
+            for thread in threads:
+                thread.start()
+            for thread in threads:
+                thread.join()
+            # What shutdown would write
+            coalescer.flush_all()
+            elapsed = time.perf_counter() - started
+            writes = PreferenceChange.objects.count() - changes_before
+
+        expected = {}
+        for step in range(options['burst']):
+            for section, values in toggle(step, run).items():
+                expected.setdefault(section, {}).update(values)
+        mismatches = 0
+        for user in users:
+            data = fetch_preferences_data(user.pk)
+            mismatches += any(
+                data[section][key] != value for section, values in expected.items() for key, value in values.items()
+            )
+
+        result = {**summarize(samples), 'writes': writes, 'mismatches': mismatches}
+        label = f'coalesced ({window}s window)' if window is not None else 'write-through'
+        self.stdout.write(
+            f'{label}: {len(samples)} PUTs in {elapsed:.1f}s ({len(samples) / elapsed:.1f} req/s), '
+            f'p50 {result["p50_ms"]:.2f}ms, p95 {result["p95_ms"]:.2f}ms, {writes} rows written '
+            f'({writes / len(samples):.2f} per PUT), {sum(failures)} failures, '
+            f'{mismatches} users missing changes'
+        )
+        return result
@@ -0,0 +1,94 @@
+import statistics
+import time
+
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection, reset_queries
+from django.test import Client
+from django.test.utils import CaptureQueriesContext, setup_test_environment, teardown_test_environment
+from rest_framework_simplejwt.tokens import AccessToken
+from user_preferences.benchmarking import benchmark_database, seed_users, summarize
+from user_preferences.cache import get_cache
+
+BASE = '/api/v1/preferences/my_preferences/'
+
+# What the theme-only screens can fetch, against the whole document
+PATHS = [
+    ('full document', BASE),
+    ('?fields=theme', f'{BASE}?fields=theme'),
+    ('theme section', f'{BASE}theme/'),
+]
+
+
+class Command(BaseCommand):
+    help = (
+        'Compares fetching the whole preferences document with fetching only the theme, as a sparse '
+        'fieldset and from the section endpoint, on a throwaway seeded database. Reports payload size, '
+        'queries and latency with a warm cache and right after a write to another section.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--users', type=int, default=2000, help='Number of users to seed')
+        parser.add_argument(
+            '--active-users', type=int, default=20,
+            help='Users making the requests, few enough for their entries to fit a local memory cache'
+        )
+        parser.add_argument('--requests', type=int, default=2000, help='Timed GETs per path and cache state')
+
+    def handle(self, *args, **options):
+        if min(options['users'], options['active_users'], options['requests']) < 1:
+            raise CommandError('--users, --active-users and --requests must be at least 1')
+
+        setup_test_environment(debug=False)
+        try:
+            with benchmark_database():
+                seed_users(options['users'], override_rate=0.5)
+                users = list(User.objects.filter(username__startswith='bench')[:options['active_users']])
+                clients = [
+                    Client(headers={'Authorization': f'Bearer {AccessToken.for_user(user)}'}) for user in users
+                ]
+                results = {
+                    label: {state: self.measure(clients, path, options['requests'], state) for state in ('warm', 'written')}
+                    for label, path in PATHS
+                }
+        finally:
+            teardown_test_environment()
+
+        full = results[PATHS[0][0]]
+        for label, _ in PATHS[1:]:
+            for state in ('warm', 'written'):
+                current = results[label][state]
+                self.stdout.write(self.style.SUCCESS(
+                    f'{label} ({state}): {(1 - current["bytes"] / full[state]["bytes"]) * 100:.1f}% smaller payload, '
+                    f'p50 {(1 - current["p50_ms"] / full[state]["p50_ms"]) * 100:.1f}% lower than the full document'
+                ))
+
+    def measure(self, clients, path, requests, state):
+        get_cache().clear()
+        # First pass fills the cache, so "warm" times hits only
+        for client in clients:
+            client.get(path)
+
+        samples, sizes, queries = [], [], []
+        for index in range(requests):
+            client = clients[index % len(clients)]
+            if state == 'written':
+                # A write to another section, as the notifications page makes
+                flip = 'weekly' if index // len(clients) % 2 else 'daily'
+                client.put(f'{BASE}notifications/', {'frequency': flip}, content_type='application/json')
+            reset_queries()
+            with CaptureQueriesContext(connection) as captured:
+                started = time.perf_counter()
+                response = client.get(path)
+                samples.append(time.perf_counter() - started)
+            if response.status_code != 200:
+                raise CommandError(f'GET {path} answered {response.status_code}')
+            sizes.append(len(response.content))
+            queries.append(len(captured))
+
+        result = {**summarize(samples), 'bytes': statistics.fmean(sizes), 'queries': statistics.fmean(queries)}
+        self.stdout.write(
+            f'{path} ({state}): {result["bytes"]:.0f} bytes, {result["queries"]:.2f} queries, '
+            f'p50 {result["p50_ms"]:.3f}ms, p95 {result["p95_ms"]:.3f}ms'
+        )
+        return result
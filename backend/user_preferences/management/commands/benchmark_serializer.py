@@ -0,0 +1,41 @@
+from django.core.management.base import BaseCommand
+from django.db import connection, reset_queries
+from django.test.utils import CaptureQueriesContext
+from user_preferences.benchmarking import benchmark_database, seed_users, summarize, time_calls
+from user_preferences.models import UserPreferences
+from user_preferences.serializers import UserPreferencesSerializer
+from user_preferences.services import fetch_preferences_data
+
+
+def current_path(user_id):
+    # The read path as it was: a model fetch, a lazy user fetch and DRF
+    preferences = UserPreferences.objects.filter(user_id=user_id).first()
+    return UserPreferencesSerializer(preferences).data
+
+
+class Command(BaseCommand):
+    help = (
+        'Compares the latency of the precompiled row serializer and UserPreferencesSerializer '
+        'on a throwaway database; RowSerializerTests check that their output matches'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--users', type=int, default=2000, help='Number of users to seed')
+        parser.add_argument('--repeat', type=int, default=2000, help='Timed reads per path')
+
+    def handle(self, *args, **options):
+        with benchmark_database():
+            seed_users(options['users'], override_rate=0.5)
+            user_ids = list(UserPreferences.objects.values_list('user_id', flat=True))
+
+            for label, read in [('UserPreferencesSerializer', current_path), ('row serializer', fetch_preferences_data)]:
+                # A full query log would make the capture below count nothing
+                reset_queries()
+                with CaptureQueriesContext(connection) as queries:
+                    read(user_ids[0])
+                cycle = iter(user_ids * (options['repeat'] // len(user_ids) + 1))
+                stats = summarize(time_calls(lambda: read(next(cycle)), options['repeat']))
+                self.stdout.write(
+                    f'{label}: {len(queries)} queries, mean {stats["mean_ms"]:.3f}ms, '
+                    f'p50 {stats["p50_ms"]:.3f}ms, p99 {stats["p99_ms"]:.3f}ms'
+                )
@@ -0,0 +1,170 @@
+import csv
+import json
+import os
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor
+from itertools import islice
+
+import django
+from django.contrib.auth.hashers import make_password
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand, CommandError
+from django.db import IntegrityError, transaction
+from user_preferences.changefeed import record_created
+from user_preferences.models import UserPreferences
+from user_preferences.sharding import group_by_shard
+
+
+def _setup_worker(settings_module):
+    # Needed when workers are spawned rather than forked
+    os.environ.setdefault('DJANGO_SETTINGS_MODULE', settings_module)
+    django.setup()
+
+
+def read_rows(stream, fmt, on_error):
+    """
+    Yield ``(line_number, row)`` for each input row. Lines that are not a
+    JSON object are passed to ``on_error`` with their number and skipped.
+    """
+    if fmt == 'csv':
+        reader = csv.DictReader(stream)
+        for row in reader:
+            yield reader.line_num, row
+    else:
+        for number, line in enumerate(stream, 1):
+            line = line.strip()
+            if not line:
+                continue
+            try:
+                row = json.loads(line)
+            except json.JSONDecodeError as e:
+                on_error(number, f'invalid JSON ({e.msg})')
+                continue
+            if not isinstance(row, dict):
+                on_error(number, 'expected a JSON object')
+                continue
+            yield number, row
+
+
+def chunked(iterable, size):
+    iterator = iter(iterable)
+    while True:
+        chunk = list(islice(iterator, size))
+        if not chunk:
+            return
+        yield chunk
+
+
+class Command(BaseCommand):
+    help = (
+        'Adds users with default preferences in bulk from CSV or JSONL '
+        '(username, email, password). Users that already exist are skipped, so an '
+        'interrupted run can be resumed by running it again with the same input.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('source', nargs='?', default='-', help='Input file, or - for stdin')
+        parser.add_argument('--format', choices=['csv', 'jsonl'], help='Input format (default: from file extension)')
+        parser.add_argument('--batch-size', type=int, default=1000, help='Users per transaction')
+        parser.add_argument('--workers', type=int, default=os.cpu_count(), help='Password hashing processes')
+
+    def handle(self, *args, **options):
+        source = options['source']
+        fmt = options['format'] or ('csv' if source.endswith('.csv') else 'jsonl')
+        batch_size = options['batch_size']
+        if batch_size < 1:
+            raise CommandError('--batch-size must be at least 1')
+
+        stream = sys.stdin if source == '-' else open(source, newline='', encoding='utf-8')
+        self.workers = options['workers'] or 1
+        self.created = self.skipped = self.failed = 0
+        self.started = time.monotonic()
+        try:
+            with ProcessPoolExecutor(
+                max_workers=self.workers,
+                initializer=_setup_worker,
+                initargs=(os.environ['DJANGO_SETTINGS_MODULE'],)
+            ) as executor:
+                for chunk in chunked(read_rows(stream, fmt, self.fail), batch_size):
+                    self.process_chunk(chunk, executor)
+                    self.report_progress()
+        finally:
+            if stream is not sys.stdin:
+                stream.close()
+
+        self.stdout.write(self.style.SUCCESS(
+            f'Created {self.created} users ({self.skipped} skipped, {self.failed} failed) '
+            f'at {self.throughput():.0f} users/sec'
+        ))
+
+    def fail(self, number, reason):
+        self.failed += 1
+        self.stderr.write(f'Line {number}: skipping row, {reason}')
+
+    def process_chunk(self, chunk, executor):
+        rows = {}
+        for number, row in chunk:
+            username, email, password = row.get('username'), row.get('email') or '', row.get('password')
+            if not isinstance(username, str) or not username.strip():
+                self.fail(number, 'username must be a non-empty string')
+                continue
+            if not isinstance(password, str) or not password:
+                self.fail(number, f'password of {username!r} must be a non-empty string')
+                continue
+            if not isinstance(email, str):
+                self.fail(number, f'email of {username!r} must be a string')
+                continue
+            username = User.normalize_username(username.strip())
+            if username in rows:
+                self.skipped += 1
+                continue
+            rows[username] = {
+                'line': number, 'username': username, 'email': User.objects.normalize_email(email), 'password': password
+            }
+
+        # Users committed by an earlier run are skipped before paying for a hash
+        existing = set(User.objects.filter(username__in=rows).values_list('username', flat=True))
+        self.skipped += len(existing)
+        rows = [row for username, row in rows.items() if username not in existing]
+        if not rows:
+            return
+
+        chunksize = max(1, len(rows) // (self.workers * 4))
+        passwords = list(executor.map(make_password, [row['password'] for row in rows], chunksize=chunksize))
+        try:
+            self.created += self.create_users(rows, passwords)
+        except IntegrityError:
+            # Another writer took some of the usernames since they were
+            # checked, so the chunk is retried one user at a time
+            for row, password in zip(rows, passwords):
+                try:
+                    self.created += self.create_users([row], [password])
+                except IntegrityError:
+                    self.fail(row['line'], f'username {row["username"]!r} already exists')
+
+    def create_users(self, rows, passwords):
+        users = [
+            User(username=row['username'], email=row['email'], password=password)
+            for row, password in zip(rows, passwords)
+        ]
+        with transaction.atomic():
+            users = User.objects.bulk_create(users)
+            if users and users[0].pk is None:
+                # Backends without RETURNING support leave primary keys unset
+                users = list(User.objects.filter(username__in=[user.username for user in users]))
+            for alias, shard_users in group_by_shard(users, lambda user: user.pk).items():
+                UserPreferences.objects.using(alias).bulk_create([UserPreferences(user=user) for user in shard_users])
+            record_created(user.pk for user in users)
+        return len(users)
+
+    def throughput(self):
+        # Only users actually created, so skipped and failed rows do not inflate it
+        elapsed = time.monotonic() - self.started
+        return self.created / elapsed if elapsed else 0.0
+
+    def report_progress(self):
+        self.stdout.write(
+            f'{self.created} created, {self.skipped} skipped, {self.failed} failed '
+            f'({self.throughput():.0f} users/sec)'
+        )
@@ -0,0 +1,17 @@
+from datetime import timedelta
+
+from django.core.management.base import BaseCommand
+from user_preferences.changefeed import compact_changes
+
+
+class Command(BaseCommand):
+    help = 'Deletes preference change feed entries older than the retention period'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--days', type=float, help='Retention in days (default: PREFERENCES_CHANGES_RETENTION)')
+        parser.add_argument('--batch-size', type=int, default=5000, help='Entries deleted per statement')
+
+    def handle(self, *args, **options):
+        retention = timedelta(days=options['days']) if options['days'] is not None else None
+        deleted = compact_changes(retention, options['batch_size'])
+        self.stdout.write(self.style.SUCCESS(f'Deleted {deleted} change entries'))
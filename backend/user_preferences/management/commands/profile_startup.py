@@ -0,0 +1,189 @@
+import json
+import os
+import subprocess
+import sys
+import tempfile
+
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand, CommandError
+from rest_framework_simplejwt.tokens import AccessToken
+from user_preferences.benchmarking import benchmark_database, seed_users
+
+# Run in a fresh interpreter under -X importtime. Phase markers go to stderr
+# between the import lines, so every import is attributed to the phase that
+# paid for it.
+STARTUP_SCRIPT = '''
+import io, json, os, sys, time
+
+def phase(name):
+    print(f'startup phase: {name}', file=sys.stderr, flush=True)
+
+def get(path):
+    environ = {
+        'REQUEST_METHOD': 'GET', 'PATH_INFO': path, 'QUERY_STRING': '', 'SCRIPT_NAME': '',
+        'SERVER_NAME': 'localhost', 'SERVER_PORT': '80', 'HTTP_HOST': 'localhost', 'REMOTE_ADDR': '127.0.0.1',
+        'HTTP_AUTHORIZATION': 'Bearer ' + os.environ['STARTUP_TOKEN'],
+        'wsgi.input': io.BytesIO(), 'wsgi.errors': sys.stderr, 'wsgi.url_scheme': 'http',
+    }
+    statuses = []
+    started = time.perf_counter()
+    b''.join(application(environ, lambda status, headers, exc_info=None: statuses.append(status)))
+    return time.perf_counter() - started, statuses[0]
+
+started = time.perf_counter()
+phase('import')
+from django.conf import settings
+# The throwaway database holding the profiled user
+settings.DATABASES['default']['NAME'] = os.environ['STARTUP_DATABASE']
+application = __import__(os.environ['STARTUP_MODULE'], fromlist=['application']).application
+imported = time.perf_counter()
+phase('warmup')
+warmup = {}
+if os.environ['STARTUP_WARMUP'] == '1':
+    from user_preferences.warmup import warm_up
+    warmup = warm_up()
+warmed = time.perf_counter()
+phase('first_request')
+first_request, status = get('/api/v1/preferences/my_preferences/')
+phase('second_request')
+second_request, _ = get('/api/v1/preferences/my_preferences/')
+print(json.dumps({
+    'import_ms': (imported - started) * 1000,
+    'warmup_ms': (warmed - imported) * 1000,
+    'warmup_steps_ms': {name: elapsed * 1000 for name, elapsed in warmup.items()},
+    'first_request_ms': first_request * 1000,
+    'second_request_ms': second_request * 1000,
+    'first_request_status': status,
+}))
+'''
+
+
+def parse_importtime(output):
+    """
+    The modules listed by ``python -X importtime`` in ``output``, each with
+    its self and cumulative milliseconds and the startup phase importing it.
+    """
+    modules = []
+    current = None
+    for line in output.splitlines():
+        if line.startswith('startup phase: '):
+            current = line.split(': ', 1)[1]
+            continue
+        if not line.startswith('import time:'):
+            continue
+        fields = line[len('import time:'):].split('|')
+        try:
+            self_us, cumulative_us = int(fields[0]), int(fields[1])
+        except (IndexError, ValueError):
+            # The column header
+            continue
+        name = fields[2].rstrip()
+        modules.append({
+            'module': name.strip(),
+            'depth': (len(name) - len(name.lstrip()) - 1) // 2,
+            'self_ms': self_us / 1000,
+            'cumulative_ms': cumulative_us / 1000,
+            'phase': current or 'interpreter',
+        })
+    return modules
+
+
+class Command(BaseCommand):
+    help = (
+        'Profiles worker startup in fresh interpreters: loading the WSGI application under -X importtime, '
+        'the optional warmup and the first requests of a user seeded into a throwaway database. Reports '
+        'the import cost by package, phase and module, and fails when the time to the first response '
+        'exceeds --budget-ms.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--module', default='user_preferences.wsgi', help='Module defining the WSGI application')
+        parser.add_argument('--warmup', action='store_true', help='Run user_preferences.warmup before the first request')
+        parser.add_argument('--runs', type=int, default=3, help='Fresh interpreters to start; the median run is reported')
+        parser.add_argument('--top', type=int, default=15, help='Slowest modules to list')
+        parser.add_argument('--budget-ms', type=float, help='Fail when the first response takes longer than this')
+        parser.add_argument('--output', help='Write the results of the median run as JSON to this file')
+
+    def handle(self, *args, **options):
+        if options['runs'] < 1:
+            raise CommandError('--runs must be at least 1')
+
+        # The profiled requests come from a real user with a preferences row,
+        # on a throwaway database, so they go through authentication, the
+        # preferences read and the serializer like a worker's first request
+        with tempfile.TemporaryDirectory() as directory:
+            with benchmark_database(os.path.join(directory, 'profile_startup.sqlite3')) as database:
+                seed_users(1)
+                token = str(AccessToken.for_user(User.objects.get(username='bench0')))
+                runs = sorted(
+                    (self.run_once(options, database, token) for _ in range(options['runs'])),
+                    key=lambda run: run['startup_ms']
+                )
+        result = runs[len(runs) // 2]
+        result['startup_ms_runs'] = [run['startup_ms'] for run in runs]
+        self.report(result, options['top'])
+
+        if options['output']:
+            with open(options['output'], 'w', encoding='utf-8') as stream:
+                json.dump(result, stream, indent=2)
+        if options['budget_ms'] is not None:
+            if result['startup_ms'] > options['budget_ms']:
+                raise CommandError(
+                    f'Startup took {result["startup_ms"]:.1f}ms, over the {options["budget_ms"]:.1f}ms budget'
+                )
+            self.stdout.write(self.style.SUCCESS(f'Within the {options["budget_ms"]:.1f}ms budget'))
+
+    def run_once(self, options, database, token):
+        env = {
+            **os.environ,
+            'STARTUP_MODULE': options['module'],
+            'STARTUP_DATABASE': database,
+            'STARTUP_WARMUP': '1' if options['warmup'] else '0',
+            'STARTUP_TOKEN': token,
+            # The warmup only runs when asked for
+            'PREFERENCES_WARMUP': '0',
+        }
+        completed = subprocess.run(
+            [sys.executable, '-X', 'importtime', '-c', STARTUP_SCRIPT],
+            cwd=settings.BASE_DIR, env=env, capture_output=True, text=True
+        )
+        if completed.returncode:
+            raise CommandError(f'Startup failed:\n{completed.stderr[-2000:]}')
+        result = json.loads(completed.stdout.strip().splitlines()[-1])
+        result['startup_ms'] = result['import_ms'] + result['warmup_ms'] + result['first_request_ms']
+        result['modules'] = parse_importtime(completed.stderr)
+        return result
+
+    def report(self, result, top):
+        modules = result['modules']
+        self.stdout.write(
+            f'Startup: {result["startup_ms"]:.1f}ms to the first response (median of '
+            f'{len(result["startup_ms_runs"])}): import {result["import_ms"]:.1f}ms, '
+            f'warmup {result["warmup_ms"]:.1f}ms, first request {result["first_request_ms"]:.1f}ms '
+            f'({result["first_request_status"]}), second request {result["second_request_ms"]:.1f}ms'
+        )
+        for name, elapsed in result['warmup_steps_ms'].items():
+            self.stdout.write(f'  warmup {name}: {elapsed:.1f}ms')
+
+        self.stdout.write('Import time by phase:')
+        for phase in dict.fromkeys(module['phase'] for module in modules):
+            imported = [module for module in modules if module['phase'] == phase]
+            self.stdout.write(
+                f'  {phase:<16} {sum(module["self_ms"] for module in imported):8.1f}ms in {len(imported)} modules'
+            )
+
+        packages = {}
+        for module in modules:
+            package = module['module'].split('.')[0]
+            packages[package] = packages.get(package, 0.0) + module['self_ms']
+        self.stdout.write('Import time by package:')
+        for package, elapsed in sorted(packages.items(), key=lambda item: -item[1])[:top]:
+            self.stdout.write(f'  {package:<32} {elapsed:8.1f}ms')
+
+        self.stdout.write('Slowest modules (self time):')
+        for module in sorted(modules, key=lambda module: -module['self_ms'])[:top]:
+            self.stdout.write(
+                f'  {module["module"]:<48} {module["self_ms"]:8.1f}ms self, '
+                f'{module["cumulative_ms"]:8.1f}ms cumulative ({module["phase"]})'
+            )
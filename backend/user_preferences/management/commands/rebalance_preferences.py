@@ -0,0 +1,81 @@
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+from django.db.models import Q
+from user_preferences.models import UserPreferences
+from user_preferences.sharding import get_shards, group_by_shard, shard_for
+
+
+class Command(BaseCommand):
+    help = (
+        'Moves preferences rows that are not on the shard of their user id, in batches. Run it after '
+        'adding shards to PREFERENCES_SHARDS and before serving traffic with the new layout. Copies '
+        'overwrite rows already on the target, so an interrupted run can simply be started again.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=1000, help='Rows moved per transaction')
+        parser.add_argument('--dry-run', action='store_true', help='Only count the rows that would move')
+
+    def handle(self, *args, **options):
+        if options['batch_size'] < 1:
+            raise CommandError('--batch-size must be at least 1')
+        # Rows keep their content and timestamps but get a new id on the target
+        self.fields = [
+            field.name for field in UserPreferences._meta.concrete_fields
+            if not field.primary_key and not field.generated and field.name != 'user'
+        ]
+
+        total = 0
+        for alias in get_shards():
+            moved = self.rebalance_shard(alias, options['batch_size'], options['dry_run'])
+            self.stdout.write(f'{alias}: {moved} rows {"to move" if options["dry_run"] else "moved"}')
+            total += moved
+        self.stdout.write(self.style.SUCCESS(f'{total} rows {"to move" if options["dry_run"] else "moved"} in total'))
+
+    def rebalance_shard(self, alias, batch_size, dry_run):
+        queryset = UserPreferences.objects.using(alias).order_by('pk')
+        moved = 0
+        last_pk = 0
+        while True:
+            rows = list(queryset.filter(pk__gt=last_pk).values_list('pk', 'user_id')[:batch_size])
+            if not rows:
+                return moved
+            last_pk = rows[-1][0]
+            misplaced = [pk for pk, user_id in rows if shard_for(user_id) != alias]
+            if misplaced and not dry_run:
+                self.move(alias, misplaced)
+            moved += len(misplaced)
+
+    def move(self, source, pks):
+        queryset = UserPreferences.objects.using(source)
+        while pks:
+            preferences = list(queryset.filter(pk__in=pks))
+            for target, rows in group_by_shard(preferences, lambda row: row.user_id).items():
+                self.copy(target, rows)
+            # Deleted only once every copy has committed, and only where the
+            # version is still the one copied; rows written meanwhile go again
+            by_version = {}
+            for row in preferences:
+                by_version.setdefault(row.version, []).append(row.pk)
+            copied = Q()
+            for version, version_pks in by_version.items():
+                copied |= Q(version=version, pk__in=version_pks)
+            with transaction.atomic(using=source):
+                unchanged = list(queryset.select_for_update().filter(copied).values_list('pk', flat=True))
+                queryset.filter(pk__in=unchanged).delete()
+            pks = list(queryset.filter(pk__in=[row.pk for row in preferences]).values_list('pk', flat=True))
+
+    def copy(self, target, rows):
+        queryset = UserPreferences.objects.using(target)
+        with transaction.atomic(using=target):
+            queryset.bulk_create(
+                [UserPreferences(user_id=row.user_id, **{name: getattr(row, name) for name in self.fields}) for row in rows],
+                update_conflicts=True, unique_fields=['user'], update_fields=self.fields
+            )
+            # bulk_create stamps both timestamps; put the original ones back
+            originals = {row.user_id: row for row in rows}
+            copies = list(queryset.filter(user_id__in=originals).only('pk', 'user_id'))
+            for copy in copies:
+                copy.created_at = originals[copy.user_id].created_at
+                copy.updated_at = originals[copy.user_id].updated_at
+            queryset.bulk_update(copies, ['created_at', 'updated_at'])
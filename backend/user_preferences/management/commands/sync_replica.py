@@ -0,0 +1,12 @@
+from django.core.management.base import BaseCommand, CommandError
+from user_preferences.replicas import replica_configured, sync_replica
+
+
+class Command(BaseCommand):
+    help = 'Copies the primary database into the local SQLite read replica (PREFERENCES_REPLICA_DB)'
+
+    def handle(self, *args, **options):
+        if not replica_configured():
+            raise CommandError('No replica is configured; set PREFERENCES_REPLICA_DB.')
+        sync_replica()
+        self.stdout.write(self.style.SUCCESS('Replica synced from the primary'))
@@ -0,0 +1,181 @@
+import bisect
+import re
+import threading
+import time
+from contextvars import ContextVar
+
+from .cache import Counters, stats as cache_stats
+from .throttling import hashing_limiter, stats as throttling_stats
+
+# Upper bounds, in seconds, of the latency histogram buckets
+LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0)
+QUERY_BUCKETS = (0, 1, 2, 3, 5, 8, 13, 21, 34)
+SIZE_BUCKETS = (256, 1024, 4096, 16384, 65536, 262144, 1048576)
+
+
+class Histogram:
+    """Thread-safe labelled histogram with fixed buckets, reported per process."""
+
+    def __init__(self, name, help_text, buckets):
+        self.name = name
+        self.help_text = help_text
+        self.buckets = buckets
+        self._lock = threading.Lock()
+        self._series = {}
+
+    def observe(self, labels, value):
+        index = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            series = self._series.get(labels)
+            if series is None:
+                series = self._series[labels] = [[0] * (len(self.buckets) + 1), 0, 0]
+            series[0][index] += 1
+            series[1] += value
+            series[2] += 1
+
+    def snapshot(self):
+        with self._lock:
+            return {labels: (list(counts), total, count) for labels, (counts, total, count) in self._series.items()}
+
+    def reset(self):
+        with self._lock:
+            self._series.clear()
+
+    def render(self):
+        lines = [f'# HELP {self.name} {self.help_text}', f'# TYPE {self.name} histogram']
+        for labels, (counts, total, count) in sorted(self.snapshot().items()):
+            label_text = ','.join(f'{key}="{_escape(value)}"' for key, value in labels)
+            prefix = f'{label_text},' if label_text else ''
+            cumulative = 0
+            for bound, bucket_count in zip(self.buckets, counts):
+                cumulative += bucket_count
+                lines.append(f'{self.name}_bucket{{{prefix}le="{bound}"}} {cumulative}')
+            lines.append(f'{self.name}_bucket{{{prefix}le="+Inf"}} {count}')
+            lines.append(f'{self.name}_sum{{{label_text}}} {total}')
+            lines.append(f'{self.name}_count{{{label_text}}} {count}')
+        return lines
+
+
+def _escape(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+request_duration = Histogram(
+    'preferences_http_request_duration_seconds', 'Time spent handling a request.', LATENCY_BUCKETS
+)
+sql_queries = Histogram('preferences_http_request_sql_queries', 'SQL queries run per request.', QUERY_BUCKETS)
+sql_duration = Histogram(
+    'preferences_http_request_sql_duration_seconds', 'Time spent in SQL per request.', LATENCY_BUCKETS
+)
+stage_duration = Histogram(
+    'preferences_http_request_stage_duration_seconds', 'Time spent in an instrumented stage of a request.',
+    LATENCY_BUCKETS
+)
+response_size = Histogram(
+    'preferences_http_response_size_bytes', 'Size of non-streaming response bodies.', SIZE_BUCKETS
+)
+HISTOGRAMS = (request_duration, sql_queries, sql_duration, stage_duration, response_size)
+
+# Autosave patches buffered and written by the write coalescer
+coalescing_events = Counters()
+
+# Seconds each step of the boot warmup took, see user_preferences.warmup
+warmup_durations = {}
+
+# Literals and placeholder lists, collapsed so logged SQL carries no values
+_SQL_LITERALS = re.compile(r"'(?:[^']|'')*'|\b\d+(?:\.\d+)?\b|%s")
+_SQL_VALUE_LISTS = re.compile(r'\(\s*\?(?:\s*,\s*\?)+\s*\)')
+
+_current_request = ContextVar('preferences_request_metrics', default=None)
+
+
+class RequestMetrics:
+    """SQL and stage timings collected while one request is handled."""
+
+    def __init__(self, max_statements):
+        self.queries = 0
+        self.sql_time = 0.0
+        self.statements = []
+        self.max_statements = max_statements
+        self.stages = {}
+
+    def record_query(self, sql, elapsed):
+        self.queries += 1
+        self.sql_time += elapsed
+        # Kept for the slow-request log, capped so bulk requests stay cheap
+        if len(self.statements) < self.max_statements:
+            self.statements.append((sql, elapsed))
+
+
+def normalize_sql(sql):
+    """Replace the values in ``sql`` with ``?`` and collapse lists of them."""
+    return _SQL_VALUE_LISTS.sub('(...)', _SQL_LITERALS.sub('?', sql))
+
+
+def start_request(max_statements):
+    metrics = RequestMetrics(max_statements)
+    return metrics, _current_request.set(metrics)
+
+
+def finish_request(token):
+    _current_request.reset(token)
+
+
+def time_query(execute, sql, params, many, context):
+    """
+    Execute wrapper installed on every connection. Times the queries of the
+    request being handled, including those async views run on other threads.
+    """
+    metrics = _current_request.get()
+    if metrics is None:
+        return execute(sql, params, many, context)
+    started = time.perf_counter()
+    try:
+        return execute(sql, params, many, context)
+    finally:
+        metrics.record_query(sql, time.perf_counter() - started)
+
+
+def record_stage(name, elapsed):
+    """Add ``elapsed`` seconds to stage ``name`` of the request being handled, if any."""
+    metrics = _current_request.get()
+    if metrics is not None:
+        metrics.stages[name] = metrics.stages.get(name, 0.0) + elapsed
+
+
+def render_metrics():
+    lines = []
+    for histogram in HISTOGRAMS:
+        lines.extend(histogram.render())
+    lines.append('# HELP preferences_cache_events_total Preference and auth cache events.')
+    lines.append('# TYPE preferences_cache_events_total counter')
+    for name, value in sorted(cache_stats.snapshot().items()):
+        lines.append(f'preferences_cache_events_total{{event="{_escape(name)}"}} {value}')
+    lines.append('# HELP preferences_admission_events_total Throttled requests and admitted or shed password hashes.')
+    lines.append('# TYPE preferences_admission_events_total counter')
+    for name, value in sorted(throttling_stats.snapshot().items()):
+        lines.append(f'preferences_admission_events_total{{event="{_escape(name)}"}} {value}')
+    lines.append('# HELP preferences_password_hashes_in_flight Password hashes running or queued.')
+    lines.append('# TYPE preferences_password_hashes_in_flight gauge')
+    lines.append(f'preferences_password_hashes_in_flight {hashing_limiter.in_flight}')
+    lines.append('# HELP preferences_password_hashes_in_flight_peak Most password hashes in flight at once.')
+    lines.append('# TYPE preferences_password_hashes_in_flight_peak gauge')
+    lines.append(f'preferences_password_hashes_in_flight_peak {hashing_limiter.peak}')
+    coalescing = coalescing_events.snapshot()
+    lines.append('# HELP preferences_write_coalescing_events_total Patches buffered and rows written by the write coalescer.')
+    lines.append('# TYPE preferences_write_coalescing_events_total counter')
+    for name, value in sorted(coalescing.items()):
+        lines.append(f'preferences_write_coalescing_events_total{{event="{_escape(name)}"}} {value}')
+    if coalescing.get('written_patches'):
+        lines.append('# HELP preferences_write_coalescing_reduction_ratio Share of buffered patches that did not need a write of their own.')
+        lines.append('# TYPE preferences_write_coalescing_reduction_ratio gauge')
+        lines.append(
+            'preferences_write_coalescing_reduction_ratio '
+            f'{1 - coalescing.get("writes", 0) / coalescing["written_patches"]}'
+        )
+    if warmup_durations:
+        lines.append('# HELP preferences_warmup_duration_seconds Time each warmup step took when the worker booted.')
+        lines.append('# TYPE preferences_warmup_duration_seconds gauge')
+        for name, value in warmup_durations.items():
+            lines.append(f'preferences_warmup_duration_seconds{{step="{_escape(name)}"}} {value}')
+    return '\n'.join(lines) + '\n'
@@ -0,0 +1,81 @@
+import logging
+import random
+import time
+
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction
+from django.conf import settings
+
+from . import metrics
+
+logger = logging.getLogger(__name__)
+
+
+class RequestMetricsMiddleware:
+    """
+    Records per-view latency, SQL query counts and time, instrumented stage
+    timings and response sizes, and logs the normalized SQL of sampled slow
+    requests.
+
+    Streaming responses are timed to their first byte and their size is not
+    recorded. Queries are counted by metrics.time_query, which is installed
+    on every database connection.
+    """
+
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        self.slow_threshold = getattr(settings, 'METRICS_SLOW_REQUEST_THRESHOLD', 0.5)
+        self.slow_sample_rate = getattr(settings, 'METRICS_SLOW_REQUEST_SAMPLE_RATE', 0.01)
+        self.max_statements = getattr(settings, 'METRICS_SLOW_REQUEST_MAX_QUERIES', 50)
+        self.async_mode = iscoroutinefunction(get_response)
+        if self.async_mode:
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if self.async_mode:
+            return self.__acall__(request)
+        request_metrics, token = metrics.start_request(self.max_statements)
+        started = time.perf_counter()
+        try:
+            response = self.get_response(request)
+        finally:
+            metrics.finish_request(token)
+        self.record(request, response, request_metrics, time.perf_counter() - started)
+        return response
+
+    async def __acall__(self, request):
+        request_metrics, token = metrics.start_request(self.max_statements)
+        started = time.perf_counter()
+        try:
+            response = await self.get_response(request)
+        finally:
+            metrics.finish_request(token)
+        self.record(request, response, request_metrics, time.perf_counter() - started)
+        return response
+
+    def record(self, request, response, request_metrics, elapsed):
+        match = getattr(request, 'resolver_match', None)
+        # Labelled by view name rather than path to keep the series bounded
+        view = (match.view_name or match.route) if match else 'unmatched'
+        labels = (('method', request.method), ('view', view))
+        metrics.request_duration.observe(labels + (('status', str(response.status_code)),), elapsed)
+        metrics.sql_queries.observe(labels, request_metrics.queries)
+        metrics.sql_duration.observe(labels, request_metrics.sql_time)
+        for stage, stage_elapsed in request_metrics.stages.items():
+            metrics.stage_duration.observe(labels + (('stage', stage),), stage_elapsed)
+        if not response.streaming:
+            metrics.response_size.observe(labels, len(response.content))
+
+        if elapsed >= self.slow_threshold and random.random() < self.slow_sample_rate:
+            # Statements are normalized so no user data reaches the log
+            statements = '\n'.join(
+                f'  {query_elapsed * 1000:.1f}ms {metrics.normalize_sql(sql)}'
+                for sql, query_elapsed in request_metrics.statements
+            )
+            logger.warning(
+                'Slow request %s %s (%s) took %.1fms with %d queries in %.1fms:\n%s',
+                request.method, request.path, view, elapsed * 1000, request_metrics.queries,
+                request_metrics.sql_time * 1000, statements
+            )
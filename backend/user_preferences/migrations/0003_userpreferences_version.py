@@ -0,0 +1,18 @@
+# Generated by Django 5.0.2 on 2026-10-18 09:38
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('user_preferences', '0002_add_default_preferences'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='userpreferences',
+            name='version',
+            field=models.PositiveIntegerField(default=1),
+        ),
+    ]
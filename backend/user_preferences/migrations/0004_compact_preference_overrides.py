@@ -0,0 +1,93 @@
+from django.db import migrations, transaction
+
+# The version 1 defaults, frozen here so later revisions of
+# user_preferences.defaults never change what this migration stores
+DEFAULTS = {
+    'account': {
+        'firstName': '',
+        'lastName': '',
+        'phone': ''
+    },
+    'notifications': {
+        'emailNotifications': True,
+        'pushNotifications': True,
+        'smsNotifications': False,
+        'frequency': 'daily',
+        'marketingEmails': False,
+        'securityAlerts': True
+    },
+    'theme': {
+        'colorScheme': 'light',
+        'fontSize': 'medium',
+        'layout': 'standard',
+        'animations': True,
+        'compactMode': False
+    },
+    'privacy': {
+        'profileVisibility': 'friends',
+        'dataSharing': False,
+        'analyticsTracking': True,
+        'locationSharing': False,
+        'activityStatus': True,
+        'searchableProfile': True
+    },
+}
+SECTIONS = tuple(DEFAULTS)
+BATCH_SIZE = 500
+
+
+def _defaults(section, user):
+    if section == 'account':
+        # username and email default to the values on the User
+        return {'username': user.username, 'email': user.email, **DEFAULTS[section]}
+    return DEFAULTS[section]
+
+
+def compact(section, values, user):
+    defaults = _defaults(section, user)
+    return {key: value for key, value in values.items() if key not in defaults or defaults[key] != value}
+
+
+def expand(section, overrides, user):
+    return {**_defaults(section, user), **overrides}
+
+
+def _rewrite(apps, transform):
+    # Each batch commits on its own, so the table is never locked for the
+    # whole rewrite and an interrupted run can simply be applied again
+    UserPreferences = apps.get_model('user_preferences', 'UserPreferences')
+    last_pk = 0
+    while True:
+        with transaction.atomic():
+            batch = list(
+                UserPreferences.objects.select_related('user').filter(pk__gt=last_pk).order_by('pk')[:BATCH_SIZE]
+            )
+            if not batch:
+                return
+            for preferences in batch:
+                for section in SECTIONS:
+                    values = getattr(preferences, section)
+                    if isinstance(values, dict):
+                        setattr(preferences, section, transform(section, values, preferences.user))
+            UserPreferences.objects.bulk_update(batch, SECTIONS)
+        last_pk = batch[-1].pk
+
+
+def compact_preferences(apps, schema_editor):
+    _rewrite(apps, compact)
+
+
+def expand_preferences(apps, schema_editor):
+    _rewrite(apps, expand)
+
+
+class Migration(migrations.Migration):
+    atomic = False
+
+    dependencies = [
+        ('user_preferences', '0003_userpreferences_version'),
+    ]
+
+    operations = [
+        migrations.RunPython(compact_preferences, expand_preferences),
+    ]
@@ -0,0 +1,79 @@
+# Generated by Django 5.0.2 on 2026-10-18 09:51
+
+import django.db.models.fields.json
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('user_preferences', '0004_compact_preference_overrides'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='userpreferences',
+            name='email_notifications',
+            field=models.GeneratedField(db_persist=False, expression=models.Case(models.When(notifications__emailNotifications=True, then=models.Value(True)), models.When(notifications__emailNotifications=False, then=models.Value(False)), default=models.Value(None), output_field=models.BooleanField(null=True)), output_field=models.BooleanField(null=True)),
+        ),
+        migrations.AddField(
+            model_name='userpreferences',
+            name='marketing_emails',
+            field=models.GeneratedField(db_persist=False, expression=models.Case(models.When(notifications__marketingEmails=True, then=models.Value(True)), models.When(notifications__marketingEmails=False, then=models.Value(False)), default=models.Value(None), output_field=models.BooleanField(null=True)), output_field=models.BooleanField(null=True)),
+        ),
+        migrations.AddField(
+            model_name='userpreferences',
+            name='notification_frequency',
+            field=models.GeneratedField(db_persist=False, expression=django.db.models.fields.json.KeyTextTransform('frequency', 'notifications'), output_field=models.CharField(max_length=20, null=True)),
+        ),
+        migrations.AddField(
+            model_name='userpreferences',
+            name='profile_visibility',
+            field=models.GeneratedField(db_persist=False, expression=django.db.models.fields.json.KeyTextTransform('profileVisibility', 'privacy'), output_field=models.CharField(max_length=20, null=True)),
+        ),
+        migrations.AddField(
+            model_name='userpreferences',
+            name='push_notifications',
+            field=models.GeneratedField(db_persist=False, expression=models.Case(models.When(notifications__pushNotifications=True, then=models.Value(True)), models.When(notifications__pushNotifications=False, then=models.Value(False)), default=models.Value(None), output_field=models.BooleanField(null=True)), output_field=models.BooleanField(null=True)),
+        ),
+        migrations.AddField(
+            model_name='userpreferences',
+            name='searchable_profile',
+            field=models.GeneratedField(db_persist=False, expression=models.Case(models.When(privacy__searchableProfile=True, then=models.Value(True)), models.When(privacy__searchableProfile=False, then=models.Value(False)), default=models.Value(None), output_field=models.BooleanField(null=True)), output_field=models.BooleanField(null=True)),
+        ),
+        migrations.AddField(
+            model_name='userpreferences',
+            name='sms_notifications',
+            field=models.GeneratedField(db_persist=False, expression=models.Case(models.When(notifications__smsNotifications=True, then=models.Value(True)), models.When(notifications__smsNotifications=False, then=models.Value(False)), default=models.Value(None), output_field=models.BooleanField(null=True)), output_field=models.BooleanField(null=True)),
+        ),
+        migrations.AddIndex(
+            model_name='userpreferences',
+            index=models.Index(fields=['email_notifications', 'notification_frequency', 'user'], name='prefs_email_notif_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='userpreferences',
+            index=models.Index(fields=['push_notifications', 'user'], name='prefs_push_notif_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='userpreferences',
+            index=models.Index(fields=['sms_notifications', 'user'], name='prefs_sms_notif_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='userpreferences',
+            index=models.Index(fields=['notification_frequency', 'user'], name='prefs_notif_frequency_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='userpreferences',
+            index=models.Index(fields=['marketing_emails', 'user'], name='prefs_marketing_emails_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='userpreferences',
+            index=models.Index(fields=['profile_visibility', 'user'], name='prefs_profile_visibility_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='userpreferences',
+            index=models.Index(fields=['searchable_profile', 'user'], name='prefs_searchable_profile_idx'),
+        ),
+    ]
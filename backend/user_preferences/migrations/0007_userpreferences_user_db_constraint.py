@@ -0,0 +1,51 @@
+# Generated by Django 5.0.2 on 2026-10-18 10:05
+
+import django.db.models.deletion
+from django.conf import settings
+from django.db import DEFAULT_DB_ALIAS, migrations, models
+
+
+class DropConstraintOnShards(migrations.AlterField):
+    """
+    Drops the foreign key constraint of a field on the shard databases only.
+    They hold preferences rows but no users, so the constraint could never
+    hold there; the default database, where the users live, keeps it, and
+    so does the migration state.
+    """
+
+    def state_forwards(self, app_label, state):
+        pass
+
+    def applies_to(self, alias):
+        return alias != DEFAULT_DB_ALIAS and alias in settings.PREFERENCES_SHARDS
+
+    def database_forwards(self, app_label, schema_editor, from_state, to_state):
+        if self.applies_to(schema_editor.connection.alias):
+            unconstrained = from_state.clone()
+            super().state_forwards(app_label, unconstrained)
+            super().database_forwards(app_label, schema_editor, from_state, unconstrained)
+
+    def database_backwards(self, app_label, schema_editor, from_state, to_state):
+        if self.applies_to(schema_editor.connection.alias):
+            unconstrained = to_state.clone()
+            super().state_forwards(app_label, unconstrained)
+            super().database_forwards(app_label, schema_editor, unconstrained, to_state)
+
+    def describe(self):
+        return f'Drop the database constraint of {self.model_name}.{self.name} on the shard databases'
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('user_preferences', '0006_preferencechange'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        DropConstraintOnShards(
+            model_name='userpreferences',
+            name='user',
+            field=models.OneToOneField(db_constraint=False, on_delete=django.db.models.deletion.CASCADE, related_name='preferences', to=settings.AUTH_USER_MODEL),
+        ),
+    ]
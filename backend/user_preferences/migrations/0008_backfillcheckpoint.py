@@ -0,0 +1,31 @@
+# Generated by Django 5.0.2 on 2026-10-18 10:37
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('user_preferences', '0007_userpreferences_user_db_constraint'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='BackfillCheckpoint',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('name', models.CharField(max_length=100)),
+                ('database', models.CharField(max_length=100)),
+                ('last_pk', models.BigIntegerField(default=0)),
+                ('rows_scanned', models.BigIntegerField(default=0)),
+                ('rows_changed', models.BigIntegerField(default=0)),
+                ('started_at', models.DateTimeField(auto_now_add=True)),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+                ('completed_at', models.DateTimeField(blank=True, null=True)),
+            ],
+        ),
+        migrations.AddConstraint(
+            model_name='backfillcheckpoint',
+            constraint=models.UniqueConstraint(fields=('name', 'database'), name='backfill_checkpoint_name_database_uniq'),
+        ),
+    ]
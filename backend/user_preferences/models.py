@@ -1,18 +1,119 @@
 from django.db import models
+from django.db.models.fields.json import KT
 from django.contrib.auth.models import User
 
+SECTIONS = ('account', 'notifications', 'theme', 'privacy')
+
+def indexed_key(section, key, output_field):
+    # Virtual column mirroring one stored override; NULL means the key is not
+    # overridden and so has its default value
+    lookup = f'{section}__{key}'
+    if isinstance(output_field, models.BooleanField):
+        # Compared as JSON values, since JSON booleans do not cast portably
+        expression = models.Case(
+            models.When(**{lookup: True}, then=models.Value(True)),
+            models.When(**{lookup: False}, then=models.Value(False)),
+            default=models.Value(None),
+            output_field=output_field,
+        )
+    else:
+        expression = KT(lookup)
+    return models.GeneratedField(
+        expression=expression,
+        output_field=output_field,
+        db_persist=False,
+    )
+
+
 class UserPreferences(models.Model):
+    # Constrained on the default database only: migration 0007 drops the
+    # constraint on the shard databases, whose rows live apart from the users.
+    # There, deleting a user removes their row through delete_sharded_preferences.
     user = models.OneToOneField(User, on_delete=models.CASCADE, related_name='preferences')
     account = models.JSONField(default=dict)
     notifications = models.JSONField(default=dict)
     theme = models.JSONField(default=dict)
     privacy = models.JSONField(default=dict)
+    version = models.PositiveIntegerField(default=1)
+
+    # Hot keys for audience queries, see user_preferences.audience
+    email_notifications = indexed_key('notifications', 'emailNotifications', models.BooleanField(null=True))
+    push_notifications = indexed_key('notifications', 'pushNotifications', models.BooleanField(null=True))
+    sms_notifications = indexed_key('notifications', 'smsNotifications', models.BooleanField(null=True))
+    notification_frequency = indexed_key('notifications', 'frequency', models.CharField(max_length=20, null=True))
+    marketing_emails = indexed_key('notifications', 'marketingEmails', models.BooleanField(null=True))
+    profile_visibility = indexed_key('privacy', 'profileVisibility', models.CharField(max_length=20, null=True))
+    searchable_profile = indexed_key('privacy', 'searchableProfile', models.BooleanField(null=True))
     created_at = models.DateTimeField(auto_now_add=True)
     updated_at = models.DateTimeField(auto_now=True)
 
     class Meta:
         verbose_name = 'User Preferences'
         verbose_name_plural = 'User Preferences'
+        # Covering indexes, so audience queries never read the JSON sections
+        indexes = [
+            models.Index(fields=['email_notifications', 'notification_frequency', 'user'], name='prefs_email_notif_idx'),
+            models.Index(fields=['push_notifications', 'user'], name='prefs_push_notif_idx'),
+            models.Index(fields=['sms_notifications', 'user'], name='prefs_sms_notif_idx'),
+            models.Index(fields=['notification_frequency', 'user'], name='prefs_notif_frequency_idx'),
+            models.Index(fields=['marketing_emails', 'user'], name='prefs_marketing_emails_idx'),
+            models.Index(fields=['profile_visibility', 'user'], name='prefs_profile_visibility_idx'),
+            models.Index(fields=['searchable_profile', 'user'], name='prefs_searchable_profile_idx'),
+        ]
+
+    def save(self, *args, **kwargs):
+        if not self._state.adding:
+            self.version += 1
+            update_fields = kwargs.get('update_fields')
+            if update_fields is not None:
+                kwargs['update_fields'] = {*update_fields, 'version', 'updated_at'}
+        super().save(*args, **kwargs)
+
+    def __str__(self):
+        return f"{self.user.username}'s preferences"
+
+
+class PreferenceChange(models.Model):
+    # Transactional outbox of preference writes; the id is the sequence number
+    # consumers use as their cursor
+    id = models.BigAutoField(primary_key=True)
+    user_id = models.BigIntegerField(db_index=True)
+    keys = models.JSONField(default=list)
+    created_at = models.DateTimeField(auto_now_add=True, db_index=True)
+
+    class Meta:
+        ordering = ['id']
+
+    def __str__(self):
+        return f'#{self.id} user {self.user_id}: {", ".join(self.keys)}'
+
+
+class ChangeFeedWatermark(models.Model):
+    # Highest change sequence number compaction has deleted; cursors below it
+    # may have missed entries even once the table is empty
+    compacted_through = models.BigIntegerField(default=0)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    def __str__(self):
+        return f'compacted through #{self.compacted_through}'
+
+
+class BackfillCheckpoint(models.Model):
+    # How far a backfill has walked one database's preferences rows, see
+    # user_preferences.backfills
+    name = models.CharField(max_length=100)
+    database = models.CharField(max_length=100)
+    last_pk = models.BigIntegerField(default=0)
+    rows_scanned = models.BigIntegerField(default=0)
+    rows_changed = models.BigIntegerField(default=0)
+    started_at = models.DateTimeField(auto_now_add=True)
+    updated_at = models.DateTimeField(auto_now=True)
+    completed_at = models.DateTimeField(null=True, blank=True)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['name', 'database'], name='backfill_checkpoint_name_database_uniq'),
+        ]
 
     def __str__(self):
-        return f"{self.user.username}'s preferences" 
\ No newline at end of file
+        return f'{self.name} on {self.database}: {"done" if self.completed_at else f"after #{self.last_pk}"}'
@@ -0,0 +1,67 @@
+from contextlib import contextmanager
+from contextvars import ContextVar
+
+from django.conf import settings
+from django.db import DEFAULT_DB_ALIAS, connections
+
+from .cache import get_cache
+
+REPLICA_ALIAS = 'replica'
+
+_replica_reads = ContextVar('preferences_replica_reads', default=None)
+
+
+def replica_configured():
+    return REPLICA_ALIAS in settings.DATABASES
+
+
+def _sticky_key(user_id):
+    return f'replica_sticky:{user_id}'
+
+
+@contextmanager
+def replica_reads(user_id):
+    """
+    Route the block's UserPreferences and User reads to the replica, unless
+    ``user_id`` wrote recently enough that the replica may not have the
+    write yet.
+    """
+    state = {
+        'user_id': user_id,
+        'allowed': replica_configured() and not get_cache().get(_sticky_key(user_id)),
+    }
+    token = _replica_reads.set(state)
+    try:
+        yield
+    finally:
+        _replica_reads.reset(token)
+
+
+def reading_from_replica():
+    state = _replica_reads.get()
+    return state is not None and state['allowed']
+
+
+def mark_written(user_id):
+    """
+    Pin ``user_id``'s reads to the primary for PREFERENCES_REPLICA_STICKY_SECONDS,
+    which has to cover the replica's lag, so users read their own writes.
+    """
+    if not replica_configured():
+        return
+    get_cache().set(_sticky_key(user_id), True, settings.PREFERENCES_REPLICA_STICKY_SECONDS)
+    state = _replica_reads.get()
+    if state is not None and state['user_id'] == user_id:
+        state['allowed'] = False
+
+
+def sync_replica():
+    """
+    Copy the primary into the SQLite replica with SQLite's online backup.
+    Stands in for replication in tests and local setups.
+    """
+    primary = connections[DEFAULT_DB_ALIAS]
+    replica = connections[REPLICA_ALIAS]
+    primary.ensure_connection()
+    replica.ensure_connection()
+    primary.connection.backup(replica.connection)
@@ -0,0 +1,76 @@
+from django.conf import settings
+from django.db import DEFAULT_DB_ALIAS
+
+from .replicas import REPLICA_ALIAS, reading_from_replica
+from .sharding import get_shards, shard_for, sharding_enabled
+
+PREFERENCES_MODEL = 'user_preferences.userpreferences'
+
+
+class PrimaryReplicaRouter:
+    """
+    Sends UserPreferences and User reads made inside replica_reads() to the
+    replica and every write to the primary.
+    """
+
+    replicated_models = {'user_preferences.userpreferences', settings.AUTH_USER_MODEL.lower()}
+
+    def db_for_read(self, model, **hints):
+        if model._meta.label_lower in self.replicated_models and reading_from_replica():
+            return REPLICA_ALIAS
+        return None
+
+    def db_for_write(self, model, **hints):
+        # Explicit, so instances read from the replica are still saved to the primary
+        return DEFAULT_DB_ALIAS
+
+    def allow_relation(self, obj1, obj2, **hints):
+        if {obj1._state.db, obj2._state.db} <= {DEFAULT_DB_ALIAS, REPLICA_ALIAS}:
+            return True
+        return None
+
+
+class ShardRouter:
+    """
+    Places UserPreferences rows on the shard of their user id. Queries only
+    carry the shard when given an instance, so code that filters by user goes
+    through sharding.preferences_manager(). Everything else, the users
+    included, stays on the default database.
+    """
+
+    def _shard(self, model, hints):
+        instance = hints.get('instance')
+        if model._meta.label_lower != PREFERENCES_MODEL or instance is None:
+            return None
+        # The instance is a user when following the reverse relation
+        if instance._meta.label_lower == PREFERENCES_MODEL:
+            return shard_for(instance.user_id)
+        return shard_for(instance.pk)
+
+    def _route(self, model, hints):
+        if not sharding_enabled():
+            return None
+        if model._meta.label_lower == PREFERENCES_MODEL:
+            return self._shard(model, hints)
+        # Relations followed from a sharded row lead back to the default database
+        instance = hints.get('instance')
+        if instance is not None and instance._state.db in get_shards():
+            return DEFAULT_DB_ALIAS
+        return None
+
+    def db_for_read(self, model, **hints):
+        return self._route(model, hints)
+
+    def db_for_write(self, model, **hints):
+        return self._route(model, hints)
+
+    def allow_relation(self, obj1, obj2, **hints):
+        if sharding_enabled() and {obj1._state.db, obj2._state.db} <= set(get_shards()):
+            return True
+        return None
+
+    def allow_migrate(self, db, app_label, model_name=None, **hints):
+        if not sharding_enabled() or db == DEFAULT_DB_ALIAS or db not in get_shards():
+            return None
+        # Shards hold preferences rows and nothing else, data migrations included
+        return app_label == 'user_preferences' and model_name == 'userpreferences'
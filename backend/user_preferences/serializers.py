@@ -1,5 +1,10 @@
+from functools import lru_cache
+
 from rest_framework import serializers
-from .models import UserPreferences
+from django.conf import settings
+from .defaults import compact, expand, user_identity
+from .models import SECTIONS, UserPreferences
+from .sharding import preferences_manager
 from django.contrib.auth.models import User
 
 class UserSerializer(serializers.ModelSerializer):
@@ -7,10 +12,150 @@ class UserSerializer(serializers.ModelSerializer):
         model = User
         fields = ['id', 'username', 'email', 'first_name', 'last_name']
 
+
+def user_fields(user):
+    """UserSerializer's output for ``user``, read straight off its plain attributes."""
+    return {name: getattr(user, name) for name in UserSerializer.Meta.fields}
+
+
 class UserPreferencesSerializer(serializers.ModelSerializer):
     user = UserSerializer(read_only=True)
 
     class Meta:
         model = UserPreferences
-        fields = ['id', 'user', 'account', 'notifications', 'theme', 'privacy', 'created_at', 'updated_at']
-        read_only_fields = ['id', 'user', 'created_at', 'updated_at'] 
\ No newline at end of file
+        fields = ['id', 'user', 'account', 'notifications', 'theme', 'privacy', 'version', 'created_at', 'updated_at']
+        read_only_fields = ['id', 'user', 'version', 'created_at', 'updated_at']
+
+    def __init__(self, *args, sections=None, **kwargs):
+        super().__init__(*args, **kwargs)
+        # Restrict the preference sections, e.g. for sparse fieldsets
+        if sections is not None:
+            for section in set(SECTIONS) - set(sections):
+                self.fields.pop(section)
+
+    def validate_section(self, value):
+        # Sections are merged key by key, so each has to be an object
+        if not isinstance(value, dict):
+            raise serializers.ValidationError('Expected a JSON object.')
+        return value
+
+    validate_account = validate_notifications = validate_theme = validate_privacy = validate_section
+
+    def to_representation(self, instance):
+        data = super().to_representation(instance)
+        identity = user_identity(instance.user)
+        for section in SECTIONS:
+            if section in data:
+                data[section] = expand(section, data[section], identity)
+        return data
+
+    def compact_sections(self, validated_data, user):
+        # Only keys that differ from the defaults are stored
+        identity = user_identity(user)
+        for section in SECTIONS:
+            if section in validated_data:
+                validated_data[section] = compact(section, validated_data[section], identity)
+        return validated_data
+
+    def create(self, validated_data):
+        user = validated_data['user']
+        return preferences_manager(user.pk).create(**self.compact_sections(validated_data, user))
+
+    def update(self, instance, validated_data):
+        return super().update(instance, self.compact_sections(validated_data, instance.user))
+
+
+class PreferencesRowSerializer:
+    """
+    Read-only renderer producing UserPreferencesSerializer's output from a
+    ``values()`` row that is joined to the user.
+
+    The rendering plan is compiled once from UserPreferencesSerializer's own
+    fields, so the two stay in step, and DRF's per-call field setup is
+    skipped. Use get_row_serializer() for the per-process instance.
+    """
+
+    def __init__(self, serializer_class=UserPreferencesSerializer):
+        self.plan = []
+        # Fields read from each related model, by relation
+        self.relations = {}
+        for name, field in serializer_class().fields.items():
+            if isinstance(field, serializers.BaseSerializer):
+                children = [
+                    (child_name, f'{field.source}__{child.source}', self._converter(child))
+                    for child_name, child in field.fields.items()
+                ]
+                self.plan.append((name, None, children))
+                self.relations[field.source] = [child.source for child in field.fields.values()]
+            else:
+                self.plan.append((name, field.source, self._converter(field)))
+
+    @staticmethod
+    def _converter(field):
+        if isinstance(field, (serializers.JSONField, serializers.IntegerField)):
+            return None
+        return field.to_representation
+
+    def columns(self, sections=SECTIONS, join=True, fields=None):
+        """
+        The ``values()`` columns to render ``sections``, and of the other
+        fields only ``fields`` when given. Without ``join`` the related models
+        are left out for only their ``<relation>_id`` key, to be filled in
+        separately.
+        """
+        columns = []
+        for name, column, converter in self.plan:
+            if column is None:
+                # The account section defaults to values on the user
+                if fields is not None and name not in fields and 'account' not in sections:
+                    continue
+                if join:
+                    columns.extend(child_column for _, child_column, _ in converter)
+                else:
+                    columns.append(f'{name}_id')
+            elif name in SECTIONS:
+                if name in sections:
+                    columns.append(column)
+            elif fields is None or name in fields:
+                columns.append(column)
+        return columns
+
+    def render(self, row, sections=SECTIONS, fields=None):
+        identity = {'username': row.get('user__username'), 'email': row.get('user__email')}
+        data = {}
+        for name, column, converter in self.plan:
+            if name in SECTIONS:
+                if name in sections:
+                    data[name] = expand(name, row[column], identity)
+            elif fields is not None and name not in fields:
+                continue
+            elif column is None:
+                data[name] = {
+                    child_name: self._convert(row[child_column], child_converter)
+                    for child_name, child_column, child_converter in converter
+                }
+            else:
+                data[name] = self._convert(row[column], converter)
+        return data
+
+    @staticmethod
+    def _convert(value, converter):
+        if value is None or converter is None:
+            return value
+        return converter(value)
+
+
+@lru_cache(maxsize=None)
+def get_row_serializer():
+    return PreferencesRowSerializer()
+
+
+class PreferencesBatchSerializer(serializers.Serializer):
+    user_ids = serializers.ListField(child=serializers.IntegerField(min_value=1), allow_empty=False)
+    sections = serializers.MultipleChoiceField(choices=SECTIONS, required=False)
+
+    def validate_user_ids(self, value):
+        limit = settings.PREFERENCES_BATCH_MAX_USERS
+        if len(value) > limit:
+            raise serializers.ValidationError(f'At most {limit} user ids can be requested at once.')
+        return list(dict.fromkeys(value)) 
\ No newline at end of file
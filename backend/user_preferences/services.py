@@ -0,0 +1,227 @@
+import time
+
+from django.contrib.auth import get_user_model
+from django.db import transaction
+from django.db.models import F
+from django.utils import timezone
+
+from .cache import invalidate_preferences
+from .changefeed import record_change
+from .defaults import compact, expand, user_identity
+from .metrics import record_stage
+from .models import SECTIONS
+from .replicas import mark_written
+from .serializers import get_row_serializer
+from .sharding import group_by_shard, join_users, preferences_db, preferences_manager, sharding_enabled
+
+
+User = get_user_model()
+
+
+class PreconditionFailed(Exception):
+    pass
+
+
+def create_account(username, email, encoded_password):
+    """
+    Create a user with an already hashed password together with their
+    preferences row, so the hashing can happen outside the transaction.
+    """
+    if not username:
+        raise ValueError('The given username must be set')
+    user = User(
+        username=User.normalize_username(username),
+        email=User.objects.normalize_email(email),
+        password=encoded_password
+    )
+    with transaction.atomic():
+        user.save()
+        # On another shard this commits on its own; an orphaned row left by a
+        # rollback only costs space
+        preferences_manager(user.pk).create(user=user)
+    return user
+
+
+def ensure_preferences(user):
+    """Return ``user``'s preferences row, creating it if missing."""
+    preferences, created = preferences_manager(user.pk).get_or_create(user=user)
+    # The replica missed the row, so the rest of the request reads the primary
+    mark_written(user.pk)
+    return preferences
+
+
+def update_preferences(user, changes, expected_versions=None):
+    """
+    Write ``changes`` to the user's preferences row with a single UPDATE that
+    also bumps the row version.
+
+    When ``expected_versions`` is given the UPDATE only matches a row still at
+    one of those versions, and PreconditionFailed is raised if none did.
+    Returns the number of rows updated.
+    """
+    queryset = preferences_manager(user.pk).filter(user=user)
+    if expected_versions is not None:
+        queryset = queryset.filter(version__in=expected_versions)
+
+    updated = queryset.update(
+        **changes,
+        version=F('version') + 1,
+        updated_at=timezone.now()
+    )
+    if expected_versions is not None and not updated:
+        raise PreconditionFailed('Preferences were modified by another request.')
+
+    if updated:
+        # QuerySet.update() bypasses post_save, so invalidate explicitly; the
+        # sections left alone stay cached
+        mark_written(user.pk)
+        sections = [section for section in SECTIONS if section in changes]
+        transaction.on_commit(lambda: invalidate_preferences(user.pk, sections), using=preferences_db(user.pk))
+    return updated
+
+
+def merge_patch(target, patch):
+    """Apply an RFC 7396 JSON merge patch to ``target`` and return the result."""
+    if not isinstance(patch, dict):
+        return patch
+    result = dict(target) if isinstance(target, dict) else {}
+    for key, value in patch.items():
+        if value is None:
+            result.pop(key, None)
+        else:
+            result[key] = merge_patch(result.get(key), value)
+    return result
+
+
+def changed_keys(section, old, new):
+    return [
+        f'{section}.{key}' for key in sorted(old.keys() | new.keys())
+        if key not in old or key not in new or old[key] != new[key]
+    ]
+
+
+def apply_section_patches(section, current, patches, identity):
+    """
+    Merge-patch ``section`` of each of ``patches`` in turn into the effective
+    values ``current``. Returns the resulting overrides (None if no patch
+    touches the section) and effective values.
+    """
+    overrides = None
+    for patch in patches:
+        if section in patch:
+            overrides = compact(section, merge_patch(current, patch[section]), identity)
+            current = expand(section, overrides, identity)
+    return overrides, current
+
+
+def patch_preferences(user, patch, expected_versions=None, retries=3):
+    """
+    Merge-patch the sections in ``patch`` into the user's preferences and
+    persist only the sections whose content changed. Patches apply to the
+    effective values, so a null resets a key to its default.
+
+    The sections are read together with the row version and written back with
+    a compare-and-swap on that version, retrying on a concurrent write unless
+    the caller pinned ``expected_versions``. Returns the changed keys as
+    ``section.key`` paths (empty when nothing changed, in which case nothing
+    is written), or None if the user has no preferences row. Each write is
+    recorded in the change feed within the same transaction.
+    """
+    return apply_patches(user, [patch], expected_versions, retries)
+
+
+def apply_patches(user, patches, expected_versions=None, retries=3):
+    """patch_preferences() for several patches applied in order with one write."""
+    sections = [section for section in SECTIONS if any(section in patch for patch in patches)]
+    identity = user_identity(user)
+    for attempt in range(retries):
+        row = preferences_manager(user.pk).filter(user=user).values('version', *sections).first()
+        if row is None:
+            return None
+        if expected_versions is not None and row['version'] not in expected_versions:
+            raise PreconditionFailed('Preferences were modified by another request.')
+
+        changes = {}
+        keys = []
+        for section in sections:
+            current = expand(section, row[section], identity)
+            overrides, patched = apply_section_patches(section, current, patches, identity)
+            if overrides != row[section]:
+                changes[section] = overrides
+                keys.extend(changed_keys(section, current, patched))
+        if not changes:
+            return []
+
+        try:
+            # The change feed stays on the default database. With the row on
+            # another shard, the entry commits just before the row, so a failed
+            # commit leaves at most a spurious entry.
+            with transaction.atomic(using=preferences_db(user.pk)), transaction.atomic(savepoint=False):
+                update_preferences(user, changes, [row['version']])
+                if keys:
+                    record_change(user.pk, keys)
+        except PreconditionFailed:
+            if expected_versions is not None or attempt == retries - 1:
+                raise
+            continue
+        return keys
+
+
+def patch_or_create_preferences(user, patch, expected_versions=None, create_missing=False):
+    """
+    patch_preferences(), first creating the user's preferences row when it is
+    missing and ``create_missing`` is set.
+    """
+    changed = patch_preferences(user, patch, expected_versions)
+    if changed is None and create_missing:
+        ensure_preferences(user)
+        changed = patch_preferences(user, patch, expected_versions)
+    return changed
+
+
+def preference_rows(queryset, sections=SECTIONS, chunk_size=500, fields=None):
+    """
+    Iterate over the rows of a UserPreferences ``queryset`` with the columns
+    the row serializer renders. Sharded rows cannot join to the users, which
+    are then read from the default database in chunks.
+    """
+    serializer = get_row_serializer()
+    if not sharding_enabled():
+        return queryset.values(*serializer.columns(sections, fields=fields)).iterator(chunk_size=chunk_size)
+    columns = serializer.columns(sections, join=False, fields=fields)
+    rows = queryset.values(*columns).iterator(chunk_size=chunk_size)
+    if 'user_id' not in columns:
+        return rows
+    return join_users(rows, serializer.relations['user'], prefix='user__', chunk_size=chunk_size)
+
+
+def fetch_preferences_data(user_id, sections=SECTIONS, fields=None):
+    """
+    Serialized preferences for ``user_id`` from one query joined to the user
+    (a second one for the user when sharded) that selects only the rendered
+    columns, or None if there is no row. ``fields`` restricts the document's
+    other fields, see PreferencesRowSerializer.columns().
+    """
+    serializer = get_row_serializer()
+    queryset = preferences_manager(user_id).filter(user_id=user_id)[:1]
+    rows = list(preference_rows(queryset, sections, chunk_size=1, fields=fields))
+    if not rows:
+        return None
+    row = rows[0]
+    started = time.perf_counter()
+    data = serializer.render(row, sections, fields)
+    record_stage('serialize', time.perf_counter() - started)
+    return data
+
+
+def iter_preferences(user_ids, sections=SECTIONS, chunk_size=500):
+    """
+    Yield serialized preferences for ``user_ids`` from a single ``IN`` query
+    per shard joined to the users, loading only the requested sections. Users
+    without preferences are skipped.
+    """
+    serializer = get_row_serializer()
+    for shard_user_ids in group_by_shard(user_ids).values():
+        queryset = preferences_manager(shard_user_ids[0]).filter(user_id__in=shard_user_ids)
+        for row in preference_rows(queryset, sections, chunk_size):
+            yield serializer.render(row, sections)
@@ -29,14 +29,24 @@ INSTALLED_APPS = [
 
 REST_FRAMEWORK = {
     'DEFAULT_AUTHENTICATION_CLASSES': [
-        'rest_framework_simplejwt.authentication.JWTAuthentication',
+        'user_preferences.authentication.CachedJWTAuthentication',
         'rest_framework.authentication.SessionAuthentication',
     ],
     'DEFAULT_PERMISSION_CLASSES': [
         'rest_framework.permissions.IsAuthenticated',
     ],
+    # Token buckets for the endpoints that hash passwords (login, registration,
+    # password changes), per client address and per account
+    'DEFAULT_THROTTLE_RATES': {
+        'password_ip': '30/min',
+        'password_user': '10/min',
+    },
 }
 
+# Where the throttle buckets live: 'cache' shares them through the default
+# cache, 'memory' keeps them per process
+THROTTLE_BUCKET_STORE = 'cache'
+
 SIMPLE_JWT = {
     'ACCESS_TOKEN_LIFETIME': timedelta(minutes=60),
     'REFRESH_TOKEN_LIFETIME': timedelta(days=1),
@@ -63,6 +73,7 @@ TEMPLATES = [
 ]
 
 MIDDLEWARE = [
+    'user_preferences.middleware.RequestMetricsMiddleware',
     'django.middleware.security.SecurityMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'corsheaders.middleware.CorsMiddleware',
@@ -85,6 +96,149 @@ DATABASES = {
     }
 }
 
+# SQLite tuning, selected with the SQLITE_PROFILE environment variable. The
+# production profile uses WAL so reads are not blocked by a writer, waits on
+# locks instead of failing with "database is locked", and keeps connections
+# open across requests so the pragmas are only applied once per connection.
+SQLITE_PROFILES = {
+    'default': {
+        'CONN_MAX_AGE': 0,
+        'PRAGMAS': {},
+    },
+    'production': {
+        'CONN_MAX_AGE': 600,
+        'PRAGMAS': {
+            'journal_mode': 'WAL',
+            'synchronous': 'NORMAL',
+            'busy_timeout': 5000,
+            'mmap_size': 268435456,
+            'cache_size': -16000,
+            'temp_store': 'MEMORY',
+        },
+    },
+}
+SQLITE_PROFILE = os.environ.get('SQLITE_PROFILE', 'default')
+SQLITE_PRAGMAS = SQLITE_PROFILES[SQLITE_PROFILE]['PRAGMAS']
+DATABASES['default']['CONN_MAX_AGE'] = SQLITE_PROFILES[SQLITE_PROFILE]['CONN_MAX_AGE']
+DATABASES['default']['CONN_HEALTH_CHECKS'] = True
+
+# Optional read replica for preference reads, e.g. a second SQLite file kept in
+# sync with the primary. Users read from the primary for
+# PREFERENCES_REPLICA_STICKY_SECONDS after their own writes, so the window has
+# to cover the replica's lag.
+if os.environ.get('PREFERENCES_REPLICA_DB'):
+    DATABASES['replica'] = {
+        'ENGINE': 'django.db.backends.sqlite3',
+        'NAME': os.environ['PREFERENCES_REPLICA_DB'],
+        'CONN_MAX_AGE': DATABASES['default']['CONN_MAX_AGE'],
+        'CONN_HEALTH_CHECKS': True,
+    }
+PREFERENCES_REPLICA_STICKY_SECONDS = 5
+
+# Optional hash sharding of UserPreferences rows by user id across the aliases
+# in PREFERENCES_SHARDS. 'default' stays the first shard and keeps the users
+# and every other table; PREFERENCES_SHARD_DBS adds comma-separated SQLite
+# files as further shards. Migrate each new shard with
+# `migrate --database shard_N`, then run rebalance_preferences before serving
+# traffic with the new layout. Preference ids are then only unique within a
+# shard and change when a row moves, so clients and exports should identify
+# rows by user id.
+PREFERENCES_SHARDS = ['default']
+for index, path in enumerate(filter(None, os.environ.get('PREFERENCES_SHARD_DBS', '').split(',')), 1):
+    DATABASES[f'shard_{index}'] = {
+        'ENGINE': 'django.db.backends.sqlite3',
+        'NAME': path,
+        'CONN_MAX_AGE': DATABASES['default']['CONN_MAX_AGE'],
+        'CONN_HEALTH_CHECKS': True,
+    }
+    PREFERENCES_SHARDS.append(f'shard_{index}')
+
+DATABASE_ROUTERS = [
+    'user_preferences.routers.ShardRouter',
+    'user_preferences.routers.PrimaryReplicaRouter',
+]
+
+# Cache
+CACHES = {
+    'default': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+        'LOCATION': 'user-preferences',
+    }
+}
+
+# Read-through cache for serialized preferences documents. Point the alias at a
+# shared backend (Redis, Memcached) when running more than one worker process.
+PREFERENCES_CACHE_ALIAS = 'default'
+PREFERENCES_CACHE_TIMEOUT = 300
+PREFERENCES_CACHE_VERSION = 2
+
+# Seconds a user resolved from a JWT stays cached; entries are also dropped
+# whenever the user is saved
+AUTH_USER_CACHE_TIMEOUT = 60
+
+# Maximum number of users in one internal batch preferences lookup
+PREFERENCES_BATCH_MAX_USERS = 1000
+
+# Preference change feed: largest page, longest long-poll (seconds) and how
+# long entries are kept before compact_preference_changes removes them
+PREFERENCES_CHANGES_MAX_BATCH = 1000
+PREFERENCES_CHANGES_MAX_WAIT = 30
+PREFERENCES_CHANGES_RETENTION = timedelta(days=7)
+
+# Request metrics, scraped from /metrics by the listed addresses. Requests
+# slower than the threshold (seconds) are logged with their normalized SQL
+# at the sample rate.
+METRICS_ALLOWED_IPS = ['127.0.0.1']
+METRICS_SLOW_REQUEST_THRESHOLD = 0.5
+METRICS_SLOW_REQUEST_SAMPLE_RATE = 0.01
+METRICS_SLOW_REQUEST_MAX_QUERIES = 50
+
+# Opt-in coalescing of autosave bursts: my_preferences PUTs without If-Match
+# are buffered per user for this many seconds and written together, answered
+# with a 202 and the document as it will read. The user's own reads flush
+# first; buffers are per process and flushed at exit. None writes through.
+PREFERENCES_WRITE_COALESCING_WINDOW = (
+    float(os.environ['PREFERENCES_WRITE_COALESCING_WINDOW'])
+    if os.environ.get('PREFERENCES_WRITE_COALESCING_WINDOW') else None
+)
+
+# Native async views for registration, preferences and password changes,
+# taking over their routes when served through ASGI (user_preferences.asgi).
+# Password hashes run on a pool of PASSWORD_HASHING_WORKERS threads.
+PREFERENCES_ASYNC_VIEWS = os.environ.get('PREFERENCES_ASYNC_VIEWS') == '1'
+PASSWORD_HASHING_WORKERS = os.cpu_count() or 1
+
+# At most this many password hashes run or queue per process; further
+# requests get a 429 asking to retry after PASSWORD_HASHING_RETRY_AFTER
+# seconds. None disables the cap.
+PASSWORD_HASHING_MAX_IN_FLIGHT = 2 * PASSWORD_HASHING_WORKERS
+PASSWORD_HASHING_RETRY_AFTER = 1
+
+# Opt-in warmup run by wsgi.py and asgi.py when they are imported
+# (user_preferences.warmup), on with PREFERENCES_WARMUP=1. It opens database
+# connections, so leave it off under servers that import the application
+# before forking workers and call warm_up() from their post-fork hook instead.
+# It also caches the preferences of the PREFERENCES_WARMUP_HOT_USERS users
+# with the latest changes.
+PREFERENCES_WARMUP = os.environ.get('PREFERENCES_WARMUP') == '1'
+PREFERENCES_WARMUP_HOT_USERS = int(os.environ.get('PREFERENCES_WARMUP_HOT_USERS', 0))
+
+LOGGING = {
+    'version': 1,
+    'disable_existing_loggers': False,
+    'handlers': {
+        'console': {
+            'class': 'logging.StreamHandler',
+        },
+    },
+    'loggers': {
+        'user_preferences': {
+            'handlers': ['console'],
+            'level': 'INFO',
+        },
+    },
+}
+
 # Password validation
 AUTH_PASSWORD_VALIDATORS = [
     {
@@ -133,8 +287,13 @@ CORS_ALLOWED_HEADERS = [
     'authorization',
     'content-type',
     'dnt',
+    'if-match',
+    'if-none-match',
     'origin',
     'user-agent',
     'x-csrftoken',
     'x-requested-with',
-] 
\ No newline at end of file
+]
+CORS_EXPOSE_HEADERS = [
+    'etag',
+]
@@ -0,0 +1,75 @@
+from itertools import islice
+
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.db import DEFAULT_DB_ALIAS
+
+from .models import UserPreferences
+
+
+def get_shards():
+    return settings.PREFERENCES_SHARDS
+
+
+def sharding_enabled():
+    return len(get_shards()) > 1
+
+
+def jump_hash(key, buckets):
+    """
+    Jump consistent hash (Lamping and Veach): growing from n to n + 1 buckets
+    only moves the keys that land in the new bucket.
+    """
+    bucket, jump = -1, 0
+    while jump < buckets:
+        bucket = jump
+        key = (key * 2862933555777941757 + 1) & 0xFFFFFFFFFFFFFFFF
+        jump = int((bucket + 1) * ((1 << 31) / ((key >> 33) + 1)))
+    return bucket
+
+
+def shard_for(user_id):
+    shards = get_shards()
+    return shards[jump_hash(int(user_id), len(shards))]
+
+
+def preferences_db(user_id):
+    """The database holding ``user_id``'s preferences row."""
+    return shard_for(user_id) if sharding_enabled() else DEFAULT_DB_ALIAS
+
+
+def preferences_manager(user_id):
+    """
+    UserPreferences manager bound to ``user_id``'s shard. Unsharded, reads are
+    left to the routers, so they can still go to the replica.
+    """
+    if not sharding_enabled():
+        return UserPreferences.objects
+    return UserPreferences.objects.db_manager(shard_for(user_id))
+
+
+def group_by_shard(items, user_id=lambda item: item):
+    groups = {}
+    for item in items:
+        groups.setdefault(preferences_db(user_id(item)), []).append(item)
+    return groups
+
+
+def join_users(rows, fields, prefix='', chunk_size=1000):
+    """
+    Fill in the user's ``fields`` on rows read from a shard, which cannot join
+    to the users table on the default database. Rows need a ``user_id`` key;
+    users are looked up with one query per ``chunk_size`` rows.
+    """
+    User = get_user_model()
+    rows = iter(rows)
+    while chunk := list(islice(rows, chunk_size)):
+        users = {
+            user['id']: user
+            for user in User.objects.filter(pk__in={row['user_id'] for row in chunk}).values('id', *fields)
+        }
+        for row in chunk:
+            user = users.get(row['user_id'], {})
+            for field in fields:
+                row[prefix + field] = user.get(field)
+            yield row
@@ -0,0 +1,60 @@
+from django.contrib.auth import get_user_model
+from django.db import transaction
+from django.db.backends.signals import connection_created
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+
+from .authentication import invalidate_user
+from .cache import invalidate_preferences
+from .changefeed import record_change
+from .database import apply_sqlite_pragmas
+from .metrics import time_query
+from .models import SECTIONS, UserPreferences
+from .replicas import mark_written
+from .sharding import preferences_db, preferences_manager
+
+User = get_user_model()
+
+
+@receiver([post_save, post_delete], sender=UserPreferences)
+def invalidate_on_preferences_change(sender, instance, using, **kwargs):
+    mark_written(instance.user_id)
+    transaction.on_commit(lambda: invalidate_preferences(instance.user_id), using=using)
+
+
+@receiver(post_save, sender=UserPreferences)
+def record_created_preferences(sender, instance, created, **kwargs):
+    # Writers wrap the create in a transaction so the entry commits with it
+    if created:
+        record_change(instance.user_id, SECTIONS)
+
+
+@receiver(post_delete, sender=UserPreferences)
+def record_deleted_preferences(sender, instance, **kwargs):
+    # Consumers find the row gone when they re-read; a move between shards
+    # records a spurious entry, which they tolerate anyway
+    record_change(instance.user_id, SECTIONS)
+
+
+@receiver([post_save, post_delete], sender=User)
+def invalidate_on_user_change(sender, instance, **kwargs):
+    # The preferences document embeds the serialized user
+    mark_written(instance.pk)
+    transaction.on_commit(lambda: invalidate_preferences(instance.pk))
+    transaction.on_commit(lambda: invalidate_user(instance.pk))
+
+
+@receiver(post_delete, sender=User)
+def delete_sharded_preferences(sender, instance, using, **kwargs):
+    # The delete cascade only reaches the user's own database
+    if preferences_db(instance.pk) != using:
+        preferences_manager(instance.pk).filter(user_id=instance.pk).delete()
+
+
+@receiver(connection_created)
+def configure_connection(sender, connection, **kwargs):
+    # The wrapper list outlives reconnects, so the wrapper is only added once
+    if time_query not in connection.execute_wrappers:
+        connection.execute_wrappers.append(time_query)
+    if connection.vendor == 'sqlite':
+        apply_sqlite_pragmas(connection)
@@ -0,0 +1,24 @@
+from django.contrib.auth.models import User
+from django.test import TransactionTestCase
+from rest_framework.test import APIClient
+
+from .cache import get_cache
+from .models import UserPreferences
+
+MY_PREFERENCES = '/api/v1/preferences/my_preferences/'
+
+
+class PreferencesTestCase(TransactionTestCase):
+    """
+    A user with an authenticated API client. Transactional, so the cache
+    invalidations run on commit as they do outside tests.
+    """
+
+    def setUp(self):
+        get_cache().clear()
+        self.user = User.objects.create_user('alice', 'alice@example.com', 'Alice-secret-1!')
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+
+    def stored(self):
+        return UserPreferences.objects.get(user=self.user)
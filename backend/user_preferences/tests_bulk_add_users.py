@@ -0,0 +1,68 @@
+import os
+import tempfile
+from io import StringIO
+from unittest import mock
+
+from django.contrib.auth.models import User
+from django.core.management import call_command
+from django.test import TransactionTestCase, override_settings
+
+from .management.commands import bulk_add_users
+from .models import UserPreferences
+
+
+@override_settings(PASSWORD_HASHERS=['django.contrib.auth.hashers.MD5PasswordHasher'])
+class BulkAddUsersTests(TransactionTestCase):
+    def run_import(self, content, suffix='.jsonl'):
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, f'users{suffix}')
+            with open(path, 'w', encoding='utf-8') as stream:
+                stream.write(content)
+            stdout, stderr = StringIO(), StringIO()
+            call_command('bulk_add_users', path, workers=1, stdout=stdout, stderr=stderr)
+        return stdout.getvalue(), stderr.getvalue()
+
+    def test_creates_users_with_preferences(self):
+        stdout, _ = self.run_import('username,email,password\ncarol,carol@EXAMPLE.com,secret\n', suffix='.csv')
+        user = User.objects.get(username='carol')
+        self.assertEqual(user.email, 'carol@example.com')
+        self.assertTrue(user.check_password('secret'))
+        self.assertTrue(UserPreferences.objects.filter(user=user).exists())
+        self.assertIn('Created 1 users', stdout)
+
+    def test_normalizes_like_registration(self):
+        # NFKC folds the fullwidth letters into plain ones
+        self.run_import('{"username": " ｄave ", "email": "dave@EXAMPLE.COM", "password": "secret"}\n')
+        user = User.objects.get()
+        self.assertEqual((user.username, user.email), ('dave', 'dave@example.com'))
+
+    def test_reports_malformed_rows(self):
+        stdout, stderr = self.run_import(
+            '{"username": "erin", "password": "secret"}\n{broken\n[1]\n{"username": 5, "password": "x"}\n'
+        )
+        self.assertEqual(list(User.objects.values_list('username', flat=True)), ['erin'])
+        self.assertIn('Line 2:', stderr)
+        self.assertIn('Line 3:', stderr)
+        self.assertIn('Line 4:', stderr)
+        self.assertIn('(0 skipped, 3 failed)', stdout)
+
+    def test_skips_existing_users(self):
+        User.objects.create_user('frank', password='secret')
+        stdout, _ = self.run_import('{"username": "frank", "password": "x"}\n{"username": "grace", "password": "x"}\n')
+        self.assertIn('Created 1 users (1 skipped, 0 failed)', stdout)
+
+    def test_reports_usernames_taken_meanwhile(self):
+        User.objects.create_user('heidi', password='secret')
+        filter_users = User.objects.filter
+
+        def missing_existing(*args, **kwargs):
+            # As if heidi registered after the existing users were checked
+            if 'username__in' in kwargs:
+                return User.objects.none()
+            return filter_users(*args, **kwargs)
+
+        with mock.patch.object(bulk_add_users.User.objects, 'filter', missing_existing):
+            stdout, stderr = self.run_import('{"username": "heidi", "password": "x"}\n{"username": "ivan", "password": "x"}\n')
+        self.assertIn("Line 1: skipping row, username 'heidi' already exists", stderr)
+        self.assertIn('Created 1 users (0 skipped, 1 failed)', stdout)
+        self.assertTrue(User.objects.filter(username='ivan').exists())
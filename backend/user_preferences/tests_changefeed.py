@@ -0,0 +1,46 @@
+from datetime import timedelta
+from unittest import mock
+
+from .changefeed import CursorExpired, compact_changes, read_changes
+from .models import SECTIONS, PreferenceChange, UserPreferences
+from .testing import PreferencesTestCase
+
+PREFERENCES = '/api/v1/preferences/'
+
+
+class ChangeFeedTests(PreferencesTestCase):
+    def entries(self):
+        return list(PreferenceChange.objects.filter(user_id=self.user.pk).values_list('keys', flat=True))
+
+    def test_create_records_change(self):
+        response = self.client.post(PREFERENCES, {}, format='json')
+        self.assertEqual(response.status_code, 201)
+        self.assertEqual(self.entries(), [list(SECTIONS)])
+
+    def test_create_rolls_back_with_change(self):
+        with mock.patch('user_preferences.signals.record_change', side_effect=RuntimeError('feed down')):
+            with self.assertRaises(RuntimeError):
+                self.client.post(PREFERENCES, {}, format='json')
+        self.assertFalse(UserPreferences.objects.filter(user=self.user).exists())
+
+    def test_delete_records_change(self):
+        preferences = UserPreferences.objects.create(user=self.user)
+        response = self.client.delete(f'{PREFERENCES}{preferences.pk}/')
+        self.assertEqual(response.status_code, 204)
+        self.assertEqual(self.entries(), [list(SECTIONS), list(SECTIONS)])
+
+    def test_compacted_cursor_expires(self):
+        UserPreferences.objects.create(user=self.user)
+        since = read_changes()[-1]['id']
+        UserPreferences.objects.filter(user=self.user).delete()
+        self.assertEqual(compact_changes(retention=timedelta(seconds=-1)), 2)
+
+        # The table is empty, but the delete entry after the cursor is gone
+        with self.assertRaises(CursorExpired):
+            read_changes(since)
+        self.assertEqual(read_changes(since + 1), [])
+
+        self.user.is_staff = True
+        self.client.force_authenticate(user=self.user)
+        response = self.client.get('/api/v1/internal/preferences/changes/', {'since': since})
+        self.assertEqual(response.status_code, 410)
@@ -0,0 +1,47 @@
+from unittest import mock
+
+from django.test import override_settings
+
+from . import coalescing
+from .coalescing import coalescer
+from .testing import MY_PREFERENCES, PreferencesTestCase
+
+
+@override_settings(PREFERENCES_WRITE_COALESCING_WINDOW=60)
+class CoalescingTests(PreferencesTestCase):
+    def tearDown(self):
+        coalescer.flush_all()
+
+    def test_reads_see_buffered_writes(self):
+        response = self.client.put(MY_PREFERENCES, {'theme': {'colorScheme': 'dark'}}, format='json')
+        self.assertEqual(response.status_code, 202)
+        response = self.client.put(MY_PREFERENCES, {'theme': {'fontSize': 'large'}}, format='json')
+        self.assertEqual(response.data['theme']['colorScheme'], 'dark')
+
+        response = self.client.get(MY_PREFERENCES)
+        self.assertEqual((response.data['theme']['colorScheme'], response.data['theme']['fontSize']), ('dark', 'large'))
+        self.assertEqual(self.stored().version, 2)
+
+    def test_invalid_patch_is_not_buffered(self):
+        self.client.put(MY_PREFERENCES, {'theme': {'colorScheme': 'dark'}}, format='json')
+        response = self.client.put(MY_PREFERENCES, {'theme': 'x'}, format='json')
+        self.assertEqual(response.status_code, 400)
+        coalescer.flush_all()
+        self.assertEqual(self.stored().theme, {'colorScheme': 'dark'})
+
+    def test_failing_patch_is_dropped_alone(self):
+        apply_patches = coalescing.apply_patches
+
+        def failing(user, patches, *args, **kwargs):
+            if any(patch.get('theme') == {'colorScheme': 'broken'} for patch in patches):
+                raise RuntimeError('write failed')
+            return apply_patches(user, patches, *args, **kwargs)
+
+        self.client.get(MY_PREFERENCES)
+        with mock.patch.object(coalescing, 'apply_patches', failing), self.assertLogs('user_preferences.coalescing'):
+            for theme in ({'colorScheme': 'dark'}, {'colorScheme': 'broken'}, {'fontSize': 'large'}):
+                self.client.put(MY_PREFERENCES, {'theme': theme}, format='json')
+            coalescer.flush_all()
+
+        self.assertEqual(self.stored().theme, {'colorScheme': 'dark', 'fontSize': 'large'})
+        self.assertEqual(coalescer.pending_users(), 0)
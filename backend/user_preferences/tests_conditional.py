@@ -0,0 +1,30 @@
+from django.contrib.auth.models import User
+
+from .cache import get_cache
+from .testing import MY_PREFERENCES, PreferencesTestCase
+
+
+class ConditionalReadTests(PreferencesTestCase):
+    def test_not_modified(self):
+        etag = self.client.get(MY_PREFERENCES)['ETag']
+        self.assertEqual(self.client.get(MY_PREFERENCES, HTTP_IF_NONE_MATCH=etag).status_code, 304)
+        # Validated against the row when the document is not cached
+        get_cache().clear()
+        self.assertEqual(self.client.get(MY_PREFERENCES, HTTP_IF_NONE_MATCH=etag).status_code, 304)
+
+    def test_write_modifies(self):
+        etag = self.client.get(MY_PREFERENCES)['ETag']
+        self.client.put(MY_PREFERENCES, {'theme': {'colorScheme': 'dark'}}, format='json')
+        response = self.client.get(MY_PREFERENCES, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertNotEqual(response['ETag'], etag)
+
+    def test_user_change_modifies(self):
+        etag = self.client.get(MY_PREFERENCES)['ETag']
+        self.user.email = 'new@example.com'
+        self.user.save()
+        self.client.force_authenticate(User.objects.get(pk=self.user.pk))
+
+        response = self.client.get(MY_PREFERENCES, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.data['account']['email'], 'new@example.com')
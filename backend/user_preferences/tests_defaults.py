@@ -0,0 +1,68 @@
+from django.db import connection
+from django.db.migrations.executor import MigrationExecutor
+from django.test import SimpleTestCase, TransactionTestCase
+
+from .defaults import REGISTRY, compact, expand, get_defaults
+from .testing import MY_PREFERENCES, PreferencesTestCase
+
+IDENTITY = {'username': 'alice', 'email': 'alice@example.com'}
+
+
+class DefaultsTests(SimpleTestCase):
+    def test_compact_keeps_only_changed_keys(self):
+        values = {**get_defaults('theme'), 'colorScheme': 'dark', 'custom': 1}
+        self.assertEqual(compact('theme', values), {'colorScheme': 'dark', 'custom': 1})
+
+    def test_expand_restores_defaults(self):
+        self.assertEqual(expand('theme', {'colorScheme': 'dark'}), {**get_defaults('theme'), 'colorScheme': 'dark'})
+
+    def test_account_defaults_to_the_user(self):
+        account = expand('account', {}, IDENTITY)
+        self.assertEqual((account['username'], account['email']), ('alice', 'alice@example.com'))
+        self.assertEqual(compact('account', account, IDENTITY), {})
+
+
+class StoredOverridesTests(PreferencesTestCase):
+    def test_stores_only_overrides(self):
+        self.client.put(MY_PREFERENCES, {'theme': {'colorScheme': 'dark', 'fontSize': 'medium'}}, format='json')
+        self.assertEqual(self.stored().theme, {'colorScheme': 'dark'})
+        self.client.put(MY_PREFERENCES, {'theme': {'colorScheme': None}}, format='json')
+        self.assertEqual(self.stored().theme, {})
+
+    def test_rejects_non_object_sections(self):
+        for body in ({'theme': 'x'}, {'privacy': [1]}, {'account': 3}):
+            with self.subTest(body=body):
+                response = self.client.put(MY_PREFERENCES, body, format='json')
+                self.assertEqual(response.status_code, 400)
+
+
+class CompactMigrationTests(TransactionTestCase):
+    before = [('user_preferences', '0003_userpreferences_version')]
+    after = [('user_preferences', '0004_compact_preference_overrides')]
+
+    def migrate(self, targets):
+        executor = MigrationExecutor(connection)
+        executor.loader.build_graph()
+        executor.migrate(targets)
+        return executor.loader.project_state(targets).apps
+
+    def tearDown(self):
+        executor = MigrationExecutor(connection)
+        executor.migrate(executor.loader.graph.leaf_nodes())
+
+    def test_compacts_and_expands_rows(self):
+        apps = self.migrate(self.before)
+        user = apps.get_model('auth', 'User').objects.create(username='alice', email='alice@example.com')
+        full = {section: expand(section, {}, IDENTITY, version=1) for section in REGISTRY[1]}
+        preferences = apps.get_model('user_preferences', 'UserPreferences').objects.create(
+            user=user, **{**full, 'theme': {**full['theme'], 'colorScheme': 'dark'}}
+        )
+
+        apps = self.migrate(self.after)
+        row = apps.get_model('user_preferences', 'UserPreferences').objects.get(pk=preferences.pk)
+        self.assertEqual((row.account, row.notifications, row.theme), ({}, {}, {'colorScheme': 'dark'}))
+
+        apps = self.migrate(self.before)
+        row = apps.get_model('user_preferences', 'UserPreferences').objects.get(pk=preferences.pk)
+        self.assertEqual(row.theme, {**full['theme'], 'colorScheme': 'dark'})
+        self.assertEqual(row.account, full['account'])
@@ -0,0 +1,33 @@
+from .models import UserPreferences
+from .services import PreconditionFailed, update_preferences
+from .testing import MY_PREFERENCES, PreferencesTestCase
+
+
+class IfMatchTests(PreferencesTestCase):
+    def test_if_match(self):
+        etag = self.client.get(MY_PREFERENCES)['ETag']
+        response = self.client.put(MY_PREFERENCES, {'theme': {'layout': 'wide'}}, format='json', HTTP_IF_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.data['version'], 2)
+
+        # The first write moved the version on
+        response = self.client.put(MY_PREFERENCES, {'theme': {'layout': 'grid'}}, format='json', HTTP_IF_MATCH=etag)
+        self.assertEqual(response.status_code, 412)
+        self.assertEqual(self.stored().theme, {'layout': 'wide'})
+
+    def test_if_match_any(self):
+        self.client.get(MY_PREFERENCES)
+        response = self.client.put(MY_PREFERENCES, {'theme': {'layout': 'wide'}}, format='json', HTTP_IF_MATCH='*')
+        self.assertEqual(response.status_code, 200)
+
+    def test_if_match_without_row(self):
+        response = self.client.put(MY_PREFERENCES, {'theme': {}}, format='json', HTTP_IF_MATCH='"1.0.1"')
+        self.assertEqual(response.status_code, 412)
+        self.assertFalse(UserPreferences.objects.filter(user=self.user).exists())
+
+    def test_compare_and_swap(self):
+        UserPreferences.objects.create(user=self.user)
+        self.assertEqual(update_preferences(self.user, {'theme': {'layout': 'wide'}}, [1]), 1)
+        with self.assertRaises(PreconditionFailed):
+            update_preferences(self.user, {'theme': {'layout': 'grid'}}, [1])
+        self.assertEqual((self.stored().version, self.stored().theme), (2, {'layout': 'wide'}))
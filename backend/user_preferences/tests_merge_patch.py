@@ -0,0 +1,40 @@
+from django.test import SimpleTestCase
+
+from .defaults import get_defaults
+from .services import merge_patch
+from .testing import MY_PREFERENCES, PreferencesTestCase
+
+
+class MergePatchTests(SimpleTestCase):
+    def test_merges_nested_objects(self):
+        self.assertEqual(merge_patch({'a': {'b': 1, 'c': 2}}, {'a': {'c': 3}}), {'a': {'b': 1, 'c': 3}})
+
+    def test_null_removes_key(self):
+        self.assertEqual(merge_patch({'a': 1, 'b': 2}, {'a': None}), {'b': 2})
+
+    def test_non_object_replaces(self):
+        self.assertEqual(merge_patch({'a': {'b': 1}}, {'a': [1]}), {'a': [1]})
+
+
+class PatchWriteTests(PreferencesTestCase):
+    def test_patch_keeps_other_keys(self):
+        self.client.put(MY_PREFERENCES, {'theme': {'colorScheme': 'dark'}}, format='json')
+        response = self.client.put(MY_PREFERENCES, {'theme': {'fontSize': 'large'}}, format='json')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual((response.data['theme']['colorScheme'], response.data['theme']['fontSize']), ('dark', 'large'))
+
+    def test_patch_keeps_other_sections(self):
+        self.client.put(MY_PREFERENCES, {'theme': {'colorScheme': 'dark'}}, format='json')
+        response = self.client.put(MY_PREFERENCES, {'privacy': {'dataSharing': True}}, format='json')
+        self.assertEqual(response.data['theme']['colorScheme'], 'dark')
+
+    def test_null_resets_to_default(self):
+        self.client.put(MY_PREFERENCES, {'theme': {'colorScheme': 'dark'}}, format='json')
+        response = self.client.put(MY_PREFERENCES, {'theme': {'colorScheme': None}}, format='json')
+        self.assertEqual(response.data['theme']['colorScheme'], get_defaults('theme')['colorScheme'])
+
+    def test_unchanged_patch_keeps_version(self):
+        self.client.put(MY_PREFERENCES, {'theme': {'colorScheme': 'dark'}}, format='json')
+        version = self.stored().version
+        self.client.put(MY_PREFERENCES, {'theme': {'colorScheme': 'dark'}}, format='json')
+        self.assertEqual(self.stored().version, version)
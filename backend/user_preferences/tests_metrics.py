@@ -0,0 +1,54 @@
+from django.test import SimpleTestCase, override_settings
+from rest_framework.test import APIClient
+
+from . import metrics
+from .testing import MY_PREFERENCES, PreferencesTestCase
+
+
+class NormalizeSqlTests(SimpleTestCase):
+    def test_values_are_removed(self):
+        sql = (
+            'SELECT "id" FROM "auth_user" WHERE ("username" = \'alice\' AND "id" IN (%s, %s, %s)'
+            ' AND "t2"."score" > 1.5) LIMIT 21'
+        )
+        self.assertEqual(
+            metrics.normalize_sql(sql),
+            'SELECT "id" FROM "auth_user" WHERE ("username" = ? AND "id" IN (...) AND "t2"."score" > ?) LIMIT ?'
+        )
+
+
+@override_settings(METRICS_ALLOWED_IPS=['127.0.0.1'])
+class MetricsEndpointTests(PreferencesTestCase):
+    def setUp(self):
+        super().setUp()
+        for histogram in metrics.HISTOGRAMS:
+            histogram.reset()
+
+    def test_exposition(self):
+        self.client.get(MY_PREFERENCES)
+        response = APIClient().get('/metrics')
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(response['Content-Type'].startswith('text/plain; version=0.0.4'))
+        body = response.content.decode()
+        self.assertIn('# TYPE preferences_http_request_duration_seconds histogram', body)
+        self.assertIn(
+            'preferences_http_request_duration_seconds_count'
+            '{method="GET",view="preferences-my-preferences",status="200"} 1',
+            body
+        )
+        self.assertIn(
+            'preferences_http_request_sql_queries_bucket{method="GET",view="preferences-my-preferences",le="+Inf"} 1',
+            body
+        )
+
+    def test_other_addresses_are_forbidden(self):
+        response = APIClient(REMOTE_ADDR='10.0.0.7').get('/metrics')
+        self.assertEqual(response.status_code, 403)
+
+    @override_settings(METRICS_SLOW_REQUEST_THRESHOLD=0, METRICS_SLOW_REQUEST_SAMPLE_RATE=1.0)
+    def test_slow_request_log_has_no_values(self):
+        with self.assertLogs('user_preferences.middleware', 'WARNING') as logs:
+            APIClient().post('/api/v1/token/', {'username': 'alice', 'password': 'wrong'}, format='json')
+        self.assertIn('Slow request POST /api/v1/token/', logs.output[0])
+        self.assertIn('"username" = ?', logs.output[0])
+        self.assertNotIn('alice', logs.output[0])
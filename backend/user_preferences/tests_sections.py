@@ -0,0 +1,9 @@
+from .testing import MY_PREFERENCES, PreferencesTestCase
+
+
+class SectionTests(PreferencesTestCase):
+    def test_section_etag_ignores_other_sections(self):
+        url = f'{MY_PREFERENCES}theme/'
+        etag = self.client.get(url)['ETag']
+        self.client.put(f'{MY_PREFERENCES}notifications/', {'frequency': 'weekly'}, format='json')
+        self.assertEqual(self.client.get(url, HTTP_IF_NONE_MATCH=etag).status_code, 304)
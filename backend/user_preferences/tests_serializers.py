@@ -0,0 +1,54 @@
+import json
+
+from django.core.serializers.json import DjangoJSONEncoder
+
+from .benchmarking import seed_users
+from .models import SECTIONS, UserPreferences
+from .serializers import UserPreferencesSerializer, get_row_serializer
+from .services import fetch_preferences_data
+from .testing import PreferencesTestCase
+
+
+def as_json(data):
+    return json.dumps(data, cls=DjangoJSONEncoder, sort_keys=True)
+
+
+class RowSerializerTests(PreferencesTestCase):
+    def assert_same_output(self, fields=None):
+        preferences = UserPreferences.objects.select_related('user').get(user=self.user)
+        expected = UserPreferencesSerializer(preferences).data
+        if fields is not None:
+            expected = {name: value for name, value in expected.items() if name in fields}
+        sections = [section for section in SECTIONS if fields is None or section in fields]
+        self.assertEqual(as_json(fetch_preferences_data(self.user.pk, sections, fields=fields)), as_json(expected))
+
+    def test_defaults(self):
+        UserPreferences.objects.create(user=self.user)
+        self.assert_same_output()
+
+    def test_overrides(self):
+        UserPreferences.objects.create(
+            user=self.user, account={'firstName': 'Alice', 'email': 'work@example.com'},
+            theme={'colorScheme': 'dark'}, privacy={'extra': [1, 2]}
+        )
+        self.assert_same_output()
+
+    def test_fieldsets(self):
+        UserPreferences.objects.create(user=self.user, theme={'fontSize': 'large'})
+        for fields in (['theme'], ['id', 'version', 'notifications'], ['user', 'account'], ['updated_at']):
+            with self.subTest(fields=fields):
+                self.assert_same_output(fields)
+
+    def test_seeded_rows(self):
+        # The mix of overrides benchmark_serializer times
+        seed_users(50, override_rate=0.5)
+        for preferences in UserPreferences.objects.select_related('user'):
+            with self.subTest(user=preferences.user.username):
+                self.assertEqual(
+                    as_json(fetch_preferences_data(preferences.user_id)),
+                    as_json(UserPreferencesSerializer(preferences).data)
+                )
+
+    def test_columns_skip_unrequested_sections(self):
+        columns = get_row_serializer().columns(['theme'], fields=['theme'])
+        self.assertEqual(columns, ['theme'])
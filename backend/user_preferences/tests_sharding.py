@@ -0,0 +1,23 @@
+from django.test import SimpleTestCase, override_settings
+
+from .sharding import group_by_shard, jump_hash, preferences_db, shard_for
+
+
+class ShardingTests(SimpleTestCase):
+    def test_unsharded(self):
+        self.assertEqual(preferences_db(42), 'default')
+
+    def test_jump_hash_moves_keys_to_new_bucket_only(self):
+        for key in range(1000):
+            before, after = jump_hash(key, 3), jump_hash(key, 4)
+            self.assertIn(after, (before, 3))
+
+    @override_settings(PREFERENCES_SHARDS=['default', 'shard_1', 'shard_2'])
+    def test_routing(self):
+        shards = {user_id: shard_for(user_id) for user_id in range(1, 301)}
+        self.assertEqual(set(shards.values()), {'default', 'shard_1', 'shard_2'})
+        self.assertEqual({user_id: preferences_db(user_id) for user_id in shards}, shards)
+        groups = group_by_shard(shards)
+        self.assertEqual({alias: set(user_ids) for alias, user_ids in groups.items()}, {
+            alias: {user_id for user_id, shard in shards.items() if shard == alias} for alias in groups
+        })
@@ -0,0 +1,36 @@
+from django.contrib.auth.models import User
+from django.test import TransactionTestCase, override_settings
+from rest_framework.test import APIClient
+
+from .throttling import take_token
+
+
+@override_settings(
+    THROTTLE_BUCKET_STORE='memory',
+    REST_FRAMEWORK={
+        'DEFAULT_AUTHENTICATION_CLASSES': ['user_preferences.authentication.CachedJWTAuthentication'],
+        'DEFAULT_PERMISSION_CLASSES': ['rest_framework.permissions.IsAuthenticated'],
+        'DEFAULT_THROTTLE_RATES': {'password_ip': '100/min', 'password_user': '2/min'},
+    },
+)
+class ThrottleTests(TransactionTestCase):
+    def test_take_token(self):
+        state, wait = take_token(None, 2, 60, now=0)
+        state, wait = take_token(state, 2, 60, now=0)
+        self.assertEqual(wait, 0)
+        state, wait = take_token(state, 2, 60, now=0)
+        self.assertEqual(wait, 30)
+        _, wait = take_token(state, 2, 60, now=30)
+        self.assertEqual(wait, 0)
+
+    def test_login_attempts_per_account(self):
+        User.objects.create_user('throttled', password='Throttled-secret-1!')
+        client = APIClient()
+        statuses = [
+            client.post('/api/v1/token/', {'username': 'throttled', 'password': 'wrong'}, format='json').status_code
+            for _ in range(3)
+        ]
+        self.assertEqual(statuses, [401, 401, 429])
+        # Other accounts keep their own bucket
+        response = client.post('/api/v1/token/', {'username': 'other', 'password': 'wrong'}, format='json')
+        self.assertEqual(response.status_code, 401)
@@ -0,0 +1,161 @@
+import threading
+from contextlib import contextmanager
+
+from django.conf import settings
+from rest_framework.exceptions import Throttled
+from rest_framework.settings import api_settings
+from rest_framework.throttling import SimpleRateThrottle
+
+from .cache import Counters
+
+stats = Counters()
+
+
+def take_token(state, capacity, period, now):
+    """
+    Take a token from a bucket holding up to ``capacity`` tokens and refilling
+    them all over ``period`` seconds. ``state`` is the bucket's ``(tokens,
+    updated)`` or None for a full one. Returns the new state and the seconds
+    until a token is available, 0 if one was taken.
+    """
+    rate = capacity / period
+    tokens = capacity if state is None else min(capacity, state[0] + (now - state[1]) * rate)
+    if tokens >= 1:
+        return (tokens - 1, now), 0.0
+    return (tokens, now), (1 - tokens) / rate
+
+
+class CacheBuckets:
+    """
+    Buckets in the default cache, shared by every process using it. The read
+    and write are not atomic, so concurrent requests can overdraw a bucket
+    by a token or two.
+    """
+
+    def take(self, key, capacity, period, now):
+        cache = SimpleRateThrottle.cache
+        state, wait = take_token(cache.get(key), capacity, period, now)
+        cache.set(key, state, period)
+        return wait
+
+
+class MemoryBuckets:
+    """Buckets in process memory, for single-process deployments."""
+
+    max_buckets = 10000
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._buckets = {}
+
+    def take(self, key, capacity, period, now):
+        with self._lock:
+            if len(self._buckets) >= self.max_buckets:
+                # Buckets idle for a whole period are full again and can go
+                self._buckets = {
+                    bucket_key: entry for bucket_key, entry in self._buckets.items() if now - entry[0][1] < entry[1]
+                }
+            state, wait = take_token(self._buckets.get(key, (None,))[0], capacity, period, now)
+            self._buckets[key] = (state, period)
+            return wait
+
+
+BUCKET_STORES = {'cache': CacheBuckets(), 'memory': MemoryBuckets()}
+
+
+class TokenBucketThrottle(SimpleRateThrottle):
+    """
+    Token bucket throttle: a rate of N/period allows bursts of N requests,
+    refilled evenly over the period. Buckets are kept in the store named by
+    THROTTLE_BUCKET_STORE. A scope rated None is not throttled.
+    """
+
+    def get_rate(self):
+        # Read on every request rather than at import, so rate changes apply
+        return api_settings.DEFAULT_THROTTLE_RATES.get(self.scope)
+
+    def allow_request(self, request, view):
+        if self.rate is None:
+            return True
+
+        self.key = self.get_cache_key(request, view)
+        if self.key is None:
+            return True
+
+        store = BUCKET_STORES[settings.THROTTLE_BUCKET_STORE]
+        self.wait_time = store.take(self.key, self.num_requests, self.duration, self.timer())
+        if self.wait_time:
+            stats.incr(f'throttled_{self.scope}')
+            return False
+        return True
+
+    def wait(self):
+        return self.wait_time
+
+
+class PasswordIPThrottle(TokenBucketThrottle):
+    """Password hashing requests per client address."""
+
+    scope = 'password_ip'
+
+    def get_cache_key(self, request, view):
+        return self.cache_format % {'scope': self.scope, 'ident': self.get_ident(request)}
+
+
+class PasswordUserThrottle(TokenBucketThrottle):
+    """
+    Password hashing requests per account: the authenticated user, or the
+    username submitted to log in or register, so one account cannot be
+    guessed at from many addresses.
+    """
+
+    scope = 'password_user'
+
+    def get_cache_key(self, request, view):
+        if request.user.is_authenticated:
+            ident = f'id:{request.user.pk}'
+        else:
+            data = getattr(request, 'data', None)
+            username = data.get('username') if hasattr(data, 'get') else None
+            if not isinstance(username, str) or not username:
+                return None
+            ident = f'name:{username.casefold()}'
+        return self.cache_format % {'scope': self.scope, 'ident': ident}
+
+
+PASSWORD_THROTTLES = [PasswordIPThrottle, PasswordUserThrottle]
+
+
+class HashingOverloaded(Throttled):
+    default_detail = 'Too many password operations are in progress. Try again shortly.'
+
+
+class HashingLimiter:
+    """
+    Admission control for password hashing: at most PASSWORD_HASHING_MAX_IN_FLIGHT
+    hashes run or wait per process, and further ones are shed at once.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.in_flight = 0
+        self.peak = 0
+
+    @contextmanager
+    def slot(self):
+        limit = settings.PASSWORD_HASHING_MAX_IN_FLIGHT
+        with self._lock:
+            if limit is not None and self.in_flight >= limit:
+                stats.incr('hashing_shed')
+                raise HashingOverloaded(wait=settings.PASSWORD_HASHING_RETRY_AFTER)
+            self.in_flight += 1
+            self.peak = max(self.peak, self.in_flight)
+        stats.incr('hashing_admitted')
+        try:
+            yield
+        finally:
+            with self._lock:
+                self.in_flight -= 1
+
+
+hashing_limiter = HashingLimiter()
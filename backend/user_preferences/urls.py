@@ -1,20 +1,53 @@
+from django.conf import settings
 from django.contrib import admin
 from django.urls import path, include
 from rest_framework.routers import DefaultRouter
-from rest_framework_simplejwt.views import (
-    TokenObtainPairView,
-    TokenRefreshView,
+from rest_framework_simplejwt.views import TokenRefreshView
+from user_preferences import async_views
+from user_preferences.views import (
+    UserPreferencesViewSet,
+    RegisterView,
+    TokenBootstrapView,
+    TokenObtainView,
+    internal_cache_stats,
+    metrics_view,
+    preferences_audience,
+    preferences_batch,
+    preferences_changes,
+    preferences_export,
+    update_password,
 )
-from user_preferences.views import UserPreferencesViewSet, RegisterView, update_password
 
 router = DefaultRouter()
 router.register(r'preferences', UserPreferencesViewSet, basename='preferences')
 
+# Resolved ahead of the DRF routes they replace when async views are enabled
+async_urlpatterns = [
+    path('api/v1/preferences/my_preferences/', async_views.my_preferences, name='preferences-my-preferences'),
+    path(
+        'api/v1/preferences/my_preferences/<str:section>/', async_views.my_preferences_section,
+        name='preferences-my-preferences-section'
+    ),
+    path('api/v1/preferences/<int:pk>/', async_views.preferences_detail, name='preferences-detail'),
+    path('api/v1/register/', async_views.register, name='register'),
+    path('api/v1/account/password/', async_views.update_password, name='update-password'),
+]
+
 urlpatterns = [
     path('admin/', admin.site.urls),
     path('api/v1/', include(router.urls)),
-    path('api/v1/token/', TokenObtainPairView.as_view(), name='token_obtain_pair'),
+    path('api/v1/token/', TokenObtainView.as_view(), name='token_obtain_pair'),
+    path('api/v1/token/bootstrap/', TokenBootstrapView.as_view(), name='token_bootstrap'),
     path('api/v1/token/refresh/', TokenRefreshView.as_view(), name='token_refresh'),
     path('api/v1/register/', RegisterView.as_view(), name='register'),
     path('api/v1/account/password/', update_password, name='update-password'),
-] 
\ No newline at end of file
+    path('api/v1/internal/preferences/batch/', preferences_batch, name='preferences-batch'),
+    path('api/v1/internal/preferences/export/', preferences_export, name='preferences-export'),
+    path('api/v1/internal/preferences/audience/', preferences_audience, name='preferences-audience'),
+    path('api/v1/internal/preferences/changes/', preferences_changes, name='preferences-changes'),
+    path('api/v1/internal/cache/stats/', internal_cache_stats, name='cache-stats'),
+    path('metrics', metrics_view, name='metrics'),
+]
+
+if settings.PREFERENCES_ASYNC_VIEWS:
+    urlpatterns = async_urlpatterns + urlpatterns
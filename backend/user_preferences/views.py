@@ -1,63 +1,113 @@
+import json
+import logging
+
 from rest_framework import viewsets, permissions, status
 from rest_framework.response import Response
-from rest_framework.decorators import action, api_view, permission_classes
+from rest_framework.decorators import action, api_view, permission_classes, throttle_classes
 from rest_framework.views import APIView
 from django.contrib.auth.models import User
 from django.contrib.auth.password_validation import validate_password
+from django.conf import settings
 from django.core.exceptions import ValidationError
-from .models import UserPreferences
-from .serializers import UserPreferencesSerializer
+from django.db import transaction
+from .cache import get_preferences, peek_preferences, stats as cache_stats
+from .coalescing import buffer_patch, coalescing_enabled, flush_pending
+from .metrics import render_metrics
+from .audience import iter_audience, parse_condition_value
+from .changefeed import CursorExpired, read_changes
+from .export import export_rows, gzip_stream, iter_ndjson, parse_watermark
+from .fieldsets import get_section, get_sparse_document, parse_fieldset, section_if_match_versions
+from .hashing import make_password
+from .etags import if_match_versions, make_etag, matching_etag, request_etags
+from .models import SECTIONS
+from .replicas import replica_reads
+from .sharding import preferences_db, preferences_manager
+from .throttling import PASSWORD_THROTTLES, HashingOverloaded, hashing_limiter
+from .serializers import PreferencesBatchSerializer, UserPreferencesSerializer, user_fields
+from .services import (
+    PreconditionFailed,
+    create_account,
+    ensure_preferences,
+    fetch_preferences_data,
+    iter_preferences,
+    patch_or_create_preferences,
+)
+from django.core.serializers.json import DjangoJSONEncoder
+from django.http import Http404, HttpResponse, HttpResponseForbidden, StreamingHttpResponse
 from django.shortcuts import get_object_or_404
 from django.contrib.auth import get_user_model
+from rest_framework_simplejwt.exceptions import InvalidToken, TokenError
 from rest_framework_simplejwt.tokens import RefreshToken
+from rest_framework_simplejwt.views import TokenObtainPairView
 
 User = get_user_model()
+logger = logging.getLogger(__name__)
+
+def get_document(user, create_missing=False):
+    """
+    The user's preferences document and its ETag, creating their row first
+    when missing and ``create_missing`` is set.
+    """
+    def load():
+        # Joined single-query read through the precompiled row serializer
+        data = fetch_preferences_data(user.pk)
+        if data is None:
+            if not create_missing:
+                raise Http404
+            ensure_preferences(user)
+            data = fetch_preferences_data(user.pk)
+        return {'etag': make_etag(data), 'data': data}
+
+    # Cache hits are served without touching the database
+    return get_preferences(user.pk, load)
+
+class TokenObtainView(TokenObtainPairView):
+    throttle_classes = PASSWORD_THROTTLES
+
+    def post(self, request, *args, **kwargs):
+        # The serializer checks the password while authenticating
+        with hashing_limiter.slot():
+            return super().post(request, *args, **kwargs)
+
+class TokenBootstrapView(TokenObtainView):
+    """
+    Token obtain that also returns the user's preferences document, so
+    logging in takes a single round trip.
+    """
+
+    def post(self, request, *args, **kwargs):
+        serializer = self.get_serializer(data=request.data)
+        with hashing_limiter.slot():
+            try:
+                serializer.is_valid(raise_exception=True)
+            except TokenError as e:
+                raise InvalidToken(e.args[0])
+
+        user = serializer.user
+        try:
+            document = get_document(user)
+        except Http404:
+            # A missing row is created and read back in one transaction
+            with transaction.atomic(using=preferences_db(user.pk)):
+                document = get_document(user, create_missing=True)
+        return Response({
+            **serializer.validated_data,
+            'preferences': document['data'],
+            'preferences_etag': document['etag'],
+        })
 
 class RegisterView(APIView):
     permission_classes = [permissions.AllowAny]
+    throttle_classes = PASSWORD_THROTTLES
 
     def post(self, request):
         try:
             validate_password(request.data.get('password'))
             
-            user = User.objects.create_user(
-                username=request.data.get('username'),
-                email=request.data.get('email'),
-                password=request.data.get('password')
-            )
-            
-            UserPreferences.objects.create(
-                user=user,
-                account={
-                    'username': user.username,
-                    'email': user.email,
-                    'firstName': '',
-                    'lastName': '',
-                    'phone': ''
-                },
-                notifications={
-                    'emailNotifications': True,
-                    'pushNotifications': True,
-                    'smsNotifications': False,
-                    'frequency': 'daily',
-                    'marketingEmails': False,
-                    'securityAlerts': True
-                },
-                theme={
-                    'colorScheme': 'light',
-                    'fontSize': 'medium',
-                    'layout': 'standard',
-                    'animations': True,
-                    'compactMode': False
-                },
-                privacy={
-                    'profileVisibility': 'friends',
-                    'dataSharing': False,
-                    'analyticsTracking': True,
-                    'locationSharing': False,
-                    'activityStatus': True,
-                    'searchableProfile': True
-                }
+            create_account(
+                request.data.get('username'),
+                request.data.get('email'),
+                make_password(request.data.get('password'))
             )
             
             return Response({
@@ -68,6 +118,8 @@ class RegisterView(APIView):
             return Response({
                 'detail': list(e.messages)
             }, status=status.HTTP_400_BAD_REQUEST)
+        except HashingOverloaded:
+            raise
         except Exception as e:
             return Response({
                 'detail': str(e)
@@ -78,13 +130,16 @@ class UserPreferencesViewSet(viewsets.ModelViewSet):
     permission_classes = [permissions.IsAuthenticated]
 
     def get_queryset(self):
-        return UserPreferences.objects.filter(user=self.request.user)
+        return preferences_manager(self.request.user.pk).filter(user=self.request.user)
 
     def get_object(self):
-        return get_object_or_404(UserPreferences, user=self.request.user)
+        preferences = get_object_or_404(preferences_manager(self.request.user.pk), user=self.request.user)
+        # Reuse the authenticated user rather than lazily querying it again
+        preferences.user = self.request.user
+        return preferences
 
     def create(self, request, *args, **kwargs):
-        if UserPreferences.objects.filter(user=request.user).exists():
+        if preferences_manager(request.user.pk).filter(user=request.user).exists():
             return Response(
                 {"detail": "Preferences already exist for this user."},
                 status=status.HTTP_400_BAD_REQUEST
@@ -92,86 +147,177 @@ class UserPreferencesViewSet(viewsets.ModelViewSet):
         
         serializer = self.get_serializer(data=request.data)
         serializer.is_valid(raise_exception=True)
-        serializer.save(user=request.user)
+        # The change feed entry recorded on save commits with the row
+        with transaction.atomic(using=preferences_db(request.user.pk)), transaction.atomic(savepoint=False):
+            serializer.save(user=request.user)
         return Response(serializer.data, status=status.HTTP_201_CREATED)
 
+    def perform_destroy(self, instance):
+        with transaction.atomic(using=preferences_db(instance.user_id)), transaction.atomic(savepoint=False):
+            instance.delete()
+
     def update(self, request, *args, **kwargs):
-        instance = self.get_object()
-        serializer = self.get_serializer(instance, data=request.data, partial=True)
+        return self.conditional_update(request)
+
+    def get_document(self, request, create_missing=False):
+        return get_document(request.user, create_missing)
+
+    def get_not_modified_etag(self, request):
+        etags = request_etags(request)
+        if not etags:
+            return None
+
+        document = peek_preferences(request.user.pk)
+        if document is not None:
+            if '*' in etags or document['etag'] in etags:
+                return document['etag']
+            return None
+
+        # Validate against the version and timestamp columns and the
+        # authenticated user, leaving the JSON sections unread
+        row = preferences_manager(request.user.pk).filter(user=request.user).values_list(
+            'version', 'updated_at'
+        ).first()
+        return matching_etag(etags, *row, user_fields(request.user)) if row is not None else None
+
+    def conditional_response(self, request, create_missing=False):
+        flush_pending(request.user.pk)
+        try:
+            names = parse_fieldset(request.query_params)
+        except ValueError as e:
+            return Response({'detail': str(e)}, status=status.HTTP_400_BAD_REQUEST)
+        if names is not None:
+            return self.content_response(request, get_sparse_document(request.user, names, create_missing))
+
+        etag = self.get_not_modified_etag(request)
+        if etag is not None:
+            return Response(status=status.HTTP_304_NOT_MODIFIED, headers={'ETag': etag})
+
+        document = self.get_document(request, create_missing)
+        return Response(document['data'], headers={'ETag': document['etag']})
+
+    def content_response(self, request, document):
+        # Sparse documents and sections have content ETags, compared as is
+        etags = request_etags(request)
+        if '*' in etags or document['etag'] in etags:
+            return Response(status=status.HTTP_304_NOT_MODIFIED, headers={'ETag': document['etag']})
+        return Response(document['data'], headers={'ETag': document['etag']})
+
+    def conditional_update(self, request, create_missing=False):
+        serializer = self.get_serializer(data=request.data, partial=True)
         serializer.is_valid(raise_exception=True)
-        serializer.save()
-        return Response(serializer.data)
+
+        if create_missing and coalescing_enabled() and 'HTTP_IF_MATCH' not in request.META:
+            # Autosave bursts are buffered and answered with the document as
+            # it will read, without an ETag since it is not stored yet
+            document = self.get_document(request, create_missing=True)
+            try:
+                preview = buffer_patch(request.user, document['data'], serializer.validated_data)
+            except ValueError as e:
+                return Response({'detail': str(e)}, status=status.HTTP_400_BAD_REQUEST)
+            return Response(preview, status=status.HTTP_202_ACCEPTED)
+        # Buffered patches land before this write
+        flush_pending(request.user.pk)
+
+        # If-Match turns the write into a compare-and-swap on the row version
+        expected_versions = if_match_versions(request)
+
+        try:
+            changed = patch_or_create_preferences(
+                request.user, serializer.validated_data, expected_versions,
+                create_missing=create_missing and 'HTTP_IF_MATCH' not in request.META
+            )
+        except PreconditionFailed as e:
+            return Response({'detail': str(e)}, status=status.HTTP_412_PRECONDITION_FAILED)
+
+        if changed is None:
+            if 'HTTP_IF_MATCH' in request.META:
+                return Response(
+                    {'detail': 'Preferences do not exist for this user.'},
+                    status=status.HTTP_412_PRECONDITION_FAILED
+                )
+            raise Http404
+
+        document = self.get_document(request)
+        return Response(document['data'], headers={'ETag': document['etag']})
+
+    def list(self, request, *args, **kwargs):
+        flush_pending(request.user.pk)
+        with replica_reads(request.user.pk):
+            return super().list(request, *args, **kwargs)
+
+    def retrieve(self, request, *args, **kwargs):
+        with replica_reads(request.user.pk):
+            return self.conditional_response(request)
 
     @action(detail=False, methods=['get', 'put'])
     def my_preferences(self, request):
-        preferences = UserPreferences.objects.filter(user=request.user).first()
-        if not preferences:
-            preferences = UserPreferences.objects.create(
-                user=request.user,
-                account={
-                    'username': request.user.username,
-                    'email': request.user.email,
-                    'firstName': '',
-                    'lastName': '',
-                    'phone': ''
-                },
-                notifications={
-                    'emailNotifications': True,
-                    'pushNotifications': True,
-                    'smsNotifications': False,
-                    'frequency': 'daily',
-                    'marketingEmails': False,
-                    'securityAlerts': True
-                },
-                theme={
-                    'colorScheme': 'light',
-                    'fontSize': 'medium',
-                    'layout': 'standard',
-                    'animations': True,
-                    'compactMode': False
-                },
-                privacy={
-                    'profileVisibility': 'friends',
-                    'dataSharing': False,
-                    'analyticsTracking': True,
-                    'locationSharing': False,
-                    'activityStatus': True,
-                    'searchableProfile': True
-                }
-            )
-        
         if request.method == 'PUT':
-            serializer = self.get_serializer(preferences, data=request.data, partial=True)
-            serializer.is_valid(raise_exception=True)
-            serializer.save()
-            return Response(serializer.data)
-        
-        serializer = self.get_serializer(preferences)
-        return Response(serializer.data)
+            return self.conditional_update(request, create_missing=True)
+
+        with replica_reads(request.user.pk):
+            return self.conditional_response(request, create_missing=True)
+
+    @action(
+        detail=False, methods=['get', 'put'], url_path=f'my_preferences/(?P<section>{"|".join(SECTIONS)})',
+        url_name='my-preferences-section'
+    )
+    def my_preferences_section(self, request, section):
+        # Reads and writes one section, loading and caching only its column
+        if request.method == 'PUT':
+            return self.section_update(request, section)
+
+        flush_pending(request.user.pk)
+        with replica_reads(request.user.pk):
+            return self.content_response(request, get_section(request.user, section, create_missing=True))
+
+    def section_update(self, request, section):
+        if not isinstance(request.data, dict):
+            return Response({'detail': 'Expected a JSON object.'}, status=status.HTTP_400_BAD_REQUEST)
+        serializer = self.get_serializer(data={section: request.data}, partial=True, sections=[section])
+        serializer.is_valid(raise_exception=True)
+        flush_pending(request.user.pk)
+
+        # If-Match holds the section's ETag, which other sections' writes leave alone
+        expected_versions = None
+        if 'HTTP_IF_MATCH' in request.META:
+            expected_versions = section_if_match_versions(
+                request.user, section, request_etags(request, 'HTTP_IF_MATCH', weak=False)
+            )
+            if expected_versions is None:
+                return Response(
+                    {'detail': 'Preferences do not exist for this user.'},
+                    status=status.HTTP_412_PRECONDITION_FAILED
+                )
+
+        try:
+            patch_or_create_preferences(
+                request.user, serializer.validated_data, expected_versions, create_missing=expected_versions is None
+            )
+        except PreconditionFailed as e:
+            return Response({'detail': str(e)}, status=status.HTTP_412_PRECONDITION_FAILED)
+
+        document = get_section(request.user, section)
+        return Response(document['data'], headers={'ETag': document['etag']})
 
 @api_view(['PUT'])
 @permission_classes([permissions.IsAuthenticated])
+@throttle_classes(PASSWORD_THROTTLES)
 def update_password(request):
     try:
-        print("Received password update request")
-        print("Request data:", request.data)
-        print("User:", request.user)
-        
         current_password = request.data.get('currentPassword')
         new_password = request.data.get('newPassword')
         
-        print("Current password provided:", bool(current_password))
-        print("New password provided:", bool(new_password))
-        
         if not current_password or not new_password:
-            print("Missing password fields")
             return Response(
                 {'errors': {'currentPassword': 'Current password is required', 'newPassword': 'New password is required'}},
                 status=status.HTTP_400_BAD_REQUEST
             )
         
-        if not request.user.check_password(current_password):
-            print("Current password verification failed")
+        with hashing_limiter.slot():
+            password_correct = request.user.check_password(current_password)
+        if not password_correct:
+            logger.info('Password update for user %s rejected: current password is incorrect', request.user.pk)
             return Response(
                 {'errors': {'currentPassword': 'Current password is incorrect'}},
                 status=status.HTTP_400_BAD_REQUEST
@@ -180,26 +326,123 @@ def update_password(request):
         try:
             validate_password(new_password, request.user)
         except ValidationError as e:
-            print("New password validation failed:", e.messages)
             return Response(
                 {'errors': {'newPassword': e.messages[0] if e.messages else 'Invalid password format'}},
                 status=status.HTTP_400_BAD_REQUEST
             )
         
-        request.user.set_password(new_password)
+        with hashing_limiter.slot():
+            request.user.set_password(new_password)
         request.user.save()
         
         RefreshToken.for_user(request.user)
         
-        print("Password updated successfully")
+        logger.info('Password updated for user %s', request.user.pk)
         return Response(
             {'message': 'Password updated successfully'},
             status=status.HTTP_200_OK
         )
         
+    except HashingOverloaded:
+        raise
     except Exception as e:
-        print("Error updating password:", str(e))
+        logger.exception('Error updating password for user %s', request.user.pk)
         return Response(
             {'errors': {'general': str(e)}},
             status=status.HTTP_500_INTERNAL_SERVER_ERROR
-        ) 
\ No newline at end of file
+        )
+
+@api_view(['POST'])
+@permission_classes([permissions.IsAdminUser])
+def preferences_batch(request):
+    serializer = PreferencesBatchSerializer(data=request.data)
+    serializer.is_valid(raise_exception=True)
+    user_ids = serializer.validated_data['user_ids']
+    sections = serializer.validated_data.get('sections') or SECTIONS
+
+    def stream():
+        # Rows are written out as they are serialized instead of collected first
+        found = set()
+        yield '{"results": ['
+        for index, data in enumerate(iter_preferences(user_ids, sections)):
+            found.add(data['user']['id'])
+            yield (',' if index else '') + json.dumps(data, cls=DjangoJSONEncoder)
+        missing = [user_id for user_id in user_ids if user_id not in found]
+        yield '], "missing": ' + json.dumps(missing) + '}'
+
+    return StreamingHttpResponse(stream(), content_type='application/json')
+
+@api_view(['GET'])
+@permission_classes([permissions.IsAdminUser])
+def preferences_export(request):
+    since = None
+    if request.query_params.get('since'):
+        try:
+            since = parse_watermark(request.query_params['since'])
+        except ValueError as e:
+            return Response({'detail': str(e)}, status=status.HTTP_400_BAD_REQUEST)
+
+    lines = iter_ndjson(export_rows(since))
+    if request.query_params.get('gzip') in ('1', 'true'):
+        response = StreamingHttpResponse(gzip_stream(lines), content_type='application/gzip')
+        response['Content-Disposition'] = 'attachment; filename="preferences.ndjson.gz"'
+        return response
+    return StreamingHttpResponse(lines, content_type='application/x-ndjson')
+
+@api_view(['GET'])
+@permission_classes([permissions.IsAdminUser])
+def preferences_audience(request):
+    try:
+        conditions = {
+            key: parse_condition_value(key, value) for key, value in request.query_params.items()
+        }
+    except ValueError as e:
+        return Response({'detail': str(e)}, status=status.HTTP_400_BAD_REQUEST)
+    if not conditions:
+        return Response({'detail': 'At least one condition is required.'}, status=status.HTTP_400_BAD_REQUEST)
+    user_ids = iter_audience(conditions)
+
+    def stream():
+        yield '{"user_ids": ['
+        for index, user_id in enumerate(user_ids):
+            yield f',{user_id}' if index else str(user_id)
+        yield ']}'
+
+    return StreamingHttpResponse(stream(), content_type='application/json')
+
+@api_view(['GET'])
+@permission_classes([permissions.IsAdminUser])
+def preferences_changes(request):
+    try:
+        since = int(request.query_params.get('since', 0))
+        limit = int(request.query_params.get('limit', 100))
+        wait = float(request.query_params.get('wait', 0))
+    except ValueError:
+        return Response({'detail': 'since, limit and wait must be numbers.'}, status=status.HTTP_400_BAD_REQUEST)
+    limit = max(1, min(limit, settings.PREFERENCES_CHANGES_MAX_BATCH))
+    wait = max(0, min(wait, settings.PREFERENCES_CHANGES_MAX_WAIT))
+
+    try:
+        changes = read_changes(since, limit, wait)
+    except CursorExpired as e:
+        return Response({'detail': str(e)}, status=status.HTTP_410_GONE)
+
+    return Response({
+        'changes': [
+            {'seq': change['id'], 'user_id': change['user_id'], 'keys': change['keys'], 'created_at': change['created_at']}
+            for change in changes
+        ],
+        'next': changes[-1]['id'] if changes else since,
+    })
+
+@api_view(['GET'])
+@permission_classes([permissions.IsAdminUser])
+def internal_cache_stats(request):
+    # Counters are per process
+    return Response(cache_stats.snapshot())
+
+def metrics_view(request):
+    # Plain Django view so scrapes skip DRF's authentication and negotiation
+    if request.META.get('REMOTE_ADDR') not in settings.METRICS_ALLOWED_IPS:
+        return HttpResponseForbidden()
+    return HttpResponse(render_metrics(), content_type='text/plain; version=0.0.4; charset=utf-8')
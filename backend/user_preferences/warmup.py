@@ -0,0 +1,147 @@
+"""
+Warmup run when a worker boots, so the first requests it serves do not pay
+for work Django and DRF otherwise do lazily: compiling the URL patterns,
+importing the classes named in settings, building serializer fields,
+loading password hashers and validators, setting up the JWT backend and
+connecting to the databases.
+
+wsgi.py and asgi.py run it on import when PREFERENCES_WARMUP is set, which
+suits servers importing the application in each worker. Servers that import
+it once before forking would hand the connections it opens to every worker,
+so leave the setting off there and call warm_up() after the fork, e.g. from
+gunicorn's ``post_fork`` hook. Connections belong to the thread that opened
+them and are kept only with CONN_MAX_AGE set.
+"""
+import logging
+import time
+
+from django.conf import settings
+from django.contrib.auth.hashers import get_hasher, get_hashers
+from django.contrib.auth.password_validation import get_default_password_validators
+from django.db import connections
+from django.urls import URLResolver, get_resolver, resolve
+
+from . import metrics
+from .cache import get_preferences, get_preferences_section
+from .etags import content_etag, make_etag
+from .models import SECTIONS, PreferenceChange
+from .services import iter_preferences
+
+logger = logging.getLogger(__name__)
+
+
+def compile_patterns(resolver):
+    # Patterns compile their regex on first use
+    for pattern in resolver.url_patterns:
+        pattern.pattern.regex
+        if isinstance(pattern, URLResolver):
+            compile_patterns(pattern)
+
+
+def warm_urls():
+    resolver = get_resolver()
+    compile_patterns(resolver)
+    # Builds the reverse lookup tables, and resolves through the router's routes
+    resolver.reverse_dict
+    resolve('/api/v1/preferences/my_preferences/')
+
+
+def warm_rest_framework():
+    from rest_framework.settings import api_settings
+    from rest_framework_simplejwt.serializers import TokenObtainPairSerializer
+
+    from .serializers import PreferencesBatchSerializer, UserPreferencesSerializer, get_row_serializer
+
+    for name in api_settings.import_strings:
+        getattr(api_settings, name)
+    for serializer_class in (UserPreferencesSerializer, PreferencesBatchSerializer, TokenObtainPairSerializer):
+        serializer_class().fields
+    get_row_serializer()
+
+
+def warm_passwords():
+    get_hashers()
+    get_hasher()
+    # Loads the common passwords list
+    get_default_password_validators()
+
+
+def warm_jwt():
+    from rest_framework_simplejwt.tokens import AccessToken
+
+    from .authentication import CachedJWTAuthentication
+
+    CachedJWTAuthentication()
+    # Encodes and verifies a token, importing the signing backend
+    AccessToken(str(AccessToken()))
+
+
+def warm_databases():
+    for connection in connections.all():
+        connection.ensure_connection()
+        with connection.cursor() as cursor:
+            cursor.execute('SELECT 1')
+        # Dropped now rather than failing the first request
+        if not connection.is_usable():
+            connection.close()
+
+
+def hot_user_ids(limit):
+    """The users behind the latest preference changes, most recent first."""
+    user_ids = {}
+    recent = PreferenceChange.objects.order_by('-id').values_list('user_id', flat=True)[:limit * 10]
+    for user_id in recent.iterator(chunk_size=1000):
+        user_ids.setdefault(user_id)
+        if len(user_ids) == limit:
+            break
+    return list(user_ids)
+
+
+def warm_preferences(limit):
+    """Cache the documents and sections of the ``limit`` hottest users. Returns how many were cached."""
+    cached = 0
+    for data in iter_preferences(hot_user_ids(limit)):
+        user_id = data['user']['id']
+        get_preferences(user_id, lambda: {'etag': make_etag(data), 'data': data})
+        for section in SECTIONS:
+            values = data[section]
+            get_preferences_section(user_id, section, lambda: {'etag': content_etag(values), 'data': values})
+        cached += 1
+    return cached
+
+
+STEPS = [
+    ('urls', warm_urls),
+    ('rest_framework', warm_rest_framework),
+    ('passwords', warm_passwords),
+    ('jwt', warm_jwt),
+    ('databases', warm_databases),
+]
+
+
+def warm_up(hot_users=None):
+    """
+    Run every warmup step, then cache the preferences of the ``hot_users``
+    hottest users (PREFERENCES_WARMUP_HOT_USERS by default). A failing step
+    is logged and skipped. Returns the seconds each step took.
+    """
+    if hot_users is None:
+        hot_users = settings.PREFERENCES_WARMUP_HOT_USERS
+    steps = list(STEPS)
+    if hot_users:
+        steps.append(('preferences', lambda: warm_preferences(hot_users)))
+
+    durations = {}
+    for name, step in steps:
+        started = time.perf_counter()
+        try:
+            step()
+        except Exception:
+            logger.warning('Warmup step %s failed', name, exc_info=True)
+        durations[name] = time.perf_counter() - started
+    metrics.warmup_durations.update(durations)
+    logger.info(
+        'Warmed up in %.1fms (%s)', sum(durations.values()) * 1000,
+        ', '.join(f'{name} {elapsed * 1000:.1f}ms' for name, elapsed in durations.items())
+    )
+    return durations